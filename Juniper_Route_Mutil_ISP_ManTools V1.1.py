@@ -1,13 +1,26 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
-import pandas as pd
-import paramiko
-import threading
+import multiprocessing
+import queue
 import os
-import re
+import threading
 import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+from juniper_engine import (
+    AsyncSessionLogger, CliTimeoutError, ConfigSnapshotStore, DeviceCommandQueue, InventoryIndex, JunosXmlStream,
+    PRIORITY_CONFIG, PRIORITY_POLL, PRIORITY_QUERY, RibTable, RouteTextParser, SSHConnectionPool, apply_config,
+    build_arg_parser, config_verify_budget, delete_static_route_command, discard_route_commands, download_config,
+    fbf_filter_name, find_unapplied_statements, firewall_source_commands, fleet_max_workers, format_route_records,
+    ingest_rib, inspect_device, is_headless, isp_matrix_cells, isp_matrix_commands, isp_matrix_max_channels,
+    load_device_file, metrics_export_interval, metrics_jsonl_file, metrics_prometheus_file, metrics_ring_size,
+    paramiko, parse_route_element, plan_prefix_import, prefix_key, prefix_list_commands, profile_dir, profile_env_var,
+    profiler, read_commit_id, read_prefix_file, rib_store_dir, rib_table_command, route_next_hop, route_query_command,
+    run_headless, run_inspection, spans, split_prefixes, static_route_commands
+)
+
 '''
 本程序主要功能：
 1、针对juniper路由器开发。主要用做BGP多线接入路由器的路由、线路操作。
@@ -25,19 +38,327 @@ from datetime import datetime
 layout_padx = 5
 layout_pady = 5
 
+# 输出窗口参数
+output_refresh_interval = 33  # 输出窗口刷新间隔(毫秒)，约30Hz
+output_max_lines = 5000  # 输出窗口最多保留的行数，超出部分只保留在备份文件中
+output_spool_file = "output_full.txt"  # 当前查询的完整输出备份文件
+
+
+class BufferedTextOutput:
+    """线程安全的输出缓冲：任意线程写入队列，Tk主线程按固定频率合并插入文本框。
+    文本框只保留最后 max_lines 行，完整输出写入备份文件"""
+
+    _CLEAR = object()
+
+    def __init__(self, root, max_lines=output_max_lines, interval=output_refresh_interval,
+                 spool_path=output_spool_file, on_flush=None):
+        self.root = root
+        self.max_lines = max_lines
+        self.interval = interval
+        self.spool_path = spool_path
+        self.on_flush = on_flush  # 每次刷新时以合并后的文本调用，如写日志
+        self.widget = None
+        self._queue = queue.SimpleQueue()
+        self._spool = None
+
+    def attach(self, widget):
+        """绑定文本框并开始定时刷新"""
+        self.widget = widget
+        self.root.after(self.interval, self._pump)
+
+    def write(self, text):
+        self._queue.put(text)
+
+    def clear(self):
+        """清空文本框并重新开始备份文件，与写入按顺序处理"""
+        self._queue.put(self._CLEAR)
+
+    def full_text(self):
+        """返回当前查询的完整输出(包括已从文本框裁剪的部分)"""
+        self._flush_pending()
+        if self._spool is None:
+            return self.widget.get(1.0, tk.END)
+        self._spool.flush()
+        with open(self.spool_path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def close(self):
+        """把尚未刷新的输出写入备份文件和on_flush(会话日志)后关闭。
+        退出时文本框可能已销毁，不再插入文本框"""
+        pieces = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._CLEAR:
+                pieces.append(item)
+        if pieces:
+            self._persist(''.join(pieces))
+        if self._spool:
+            self._spool.close()
+            self._spool = None
+
+    def _pump(self):
+        try:
+            self._flush_pending()
+        finally:
+            self.root.after(self.interval, self._pump)
+
+    def _flush_pending(self):
+        pieces = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is self._CLEAR:
+                self._render(pieces)
+                pieces = []
+                self._reset()
+            else:
+                pieces.append(item)
+        self._render(pieces)
+
+    def _reset(self):
+        self.widget.config(state='normal')
+        self.widget.delete(1.0, tk.END)
+        self.widget.config(state='disabled')
+        if self._spool:
+            self._spool.close()
+        self._spool = open(self.spool_path, 'w', encoding='utf-8')
+
+    def _persist(self, text):
+        if self._spool:
+            self._spool.write(text)
+            self._spool.flush()
+        if self.on_flush:
+            self.on_flush(text)
+
+    def _render(self, pieces):
+        if not pieces:
+            return
+        text = ''.join(pieces)
+        self._persist(text)
+
+        # 单次数据超过行数上限时只插入末尾部分，其余部分由备份文件保存
+        if text.count('\n') > self.max_lines:
+            text = '\n'.join(text.split('\n')[-self.max_lines:])
+
+        self.widget.config(state='normal')
+        self.widget.insert(tk.END, text)
+        line_count = int(self.widget.index('end-1c').split('.')[0])
+        if line_count > self.max_lines:
+            self.widget.delete(1.0, f"{line_count - self.max_lines + 1}.0")
+        self.widget.see(tk.END)
+        self.widget.config(state='disabled')
+
+
+class VirtualTreeview:
+    """只渲染可见行的表格：全部行保存在列表中，Treeview里始终只有一屏的条目，
+    滚动、排序和过滤只改变行号索引，数十万行也不会卡住界面"""
+
+    def __init__(self, parent, columns, height=20, filter_delay=200):
+        self.columns = columns  # [(字段名, 标题, 宽度)]
+        self.fields = [field for field, _, _ in columns]
+        self.filter_delay = filter_delay
+        self.rows = []  # 全部行(字符串元组)
+        self.view = []  # 过滤、排序后的行号
+        self.offset = 0
+        self.sort_field, self.sort_reverse = None, False
+        self._search_text = None  # 每行小写拼接文本，首次过滤时生成
+        self._filter_job = None
+        self._filter_generation = 0  # 每次过滤加一，后台过滤完成时丢弃已过时的结果
+
+        self.frame = ttk.Frame(parent)
+        toolbar = ttk.Frame(self.frame)
+        toolbar.pack(fill=tk.X)
+        ttk.Label(toolbar, text="过滤:").pack(side=tk.LEFT)
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add('write', lambda *args: self._schedule_filter())
+        self.filter_entry = ttk.Entry(toolbar, textvariable=self.filter_var, width=30)
+        self.filter_entry.pack(side=tk.LEFT, padx=5)
+        column_button = ttk.Menubutton(toolbar, text="显示列")
+        column_menu = tk.Menu(column_button, tearoff=False)
+        self.column_vars = {}
+        for field, title, _ in columns:
+            var = self.column_vars[field] = tk.BooleanVar(value=True)
+            column_menu.add_checkbutton(label=title, variable=var, command=self._update_columns)
+        column_button['menu'] = column_menu
+        column_button.pack(side=tk.LEFT, padx=5)
+        self.count_label = ttk.Label(toolbar, text="")
+        self.count_label.pack(side=tk.LEFT, padx=5)
+
+        body = ttk.Frame(self.frame)
+        body.pack(fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(body, columns=self.fields, show='headings', height=height, selectmode='browse')
+        for field, title, width in columns:
+            self.tree.heading(field, text=title, command=lambda f=field: self.sort_by(f))
+            self.tree.column(field, width=width, stretch=False)
+        self.scrollbar = ttk.Scrollbar(body, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.tree.bind(sequence, self._on_wheel)
+        self.tree.bind('<Configure>', lambda event: self._render())
+
+    @property
+    def page_size(self):
+        return int(self.tree['height'])
+
+    def set_rows(self, rows):
+        """设置全部行：可迭代对象转换为列表；支持len和下标访问的对象(如RibTable)直接使用，
+        若还提供 search(text)/sort_keys(field) 则过滤和排序交给它处理，search在后台线程中执行"""
+        if hasattr(rows, '__len__') and hasattr(rows, '__getitem__'):
+            self.rows = rows
+        else:
+            self.rows = [tuple(row) for row in rows]
+        self._search_text = None
+        self._apply()
+
+    def selected_row(self):
+        """当前选中的行(原始行数据)，未选中时返回None"""
+        selection = self.tree.selection()
+        if not selection:
+            return None
+        return self.rows[self.view[self.offset + self.tree.index(selection[0])]]
+
+    def _schedule_filter(self):
+        if self._filter_job:
+            self.frame.after_cancel(self._filter_job)
+        self._filter_job = self.frame.after(self.filter_delay, self._apply)
+
+    def _apply(self):
+        """重新计算过滤和排序后的行号并回到第一页"""
+        self._filter_job = None
+        self._filter_generation += 1
+        text = self.filter_var.get().strip().lower()
+        if text and hasattr(self.rows, 'search'):
+            # 全表路由等大表在后台线程过滤，输入时界面不卡顿
+            generation, rows = self._filter_generation, self.rows
+            self.count_label.config(text="过滤中...")
+
+            def work():
+                try:
+                    view = rows.search(text)
+                    self.frame.after(0, lambda: self._show_view(view, generation))
+                except Exception:
+                    pass  # 过滤期间表格已关闭或窗口已销毁
+            threading.Thread(target=work, daemon=True).start()
+            return
+        if text:
+            if self._search_text is None:
+                self._search_text = ['\t'.join(row).lower() for row in self.rows]
+            view = [i for i, row_text in enumerate(self._search_text) if text in row_text]
+        else:
+            view = list(range(len(self.rows)))
+        self._show_view(view, self._filter_generation)
+
+    def _show_view(self, view, generation):
+        if generation != self._filter_generation:
+            return  # 之后又有新的过滤
+        self.view = view
+        if self.sort_field:
+            self._sort_view()
+        self.offset = 0
+        self._render()
+
+    def sort_by(self, field):
+        """点击列标题排序，再次点击同一列时反向"""
+        self.sort_reverse = not self.sort_reverse if field == self.sort_field else False
+        self.sort_field = field
+        self._sort_view()
+        self.offset = 0
+        self._render()
+
+    def _sort_view(self):
+        index = self.fields.index(self.sort_field)
+
+        def key(value):
+            # 数字按数值、网段按地址和掩码排序，其余按文本
+            number = value.split(' ', 1)[0]
+            if number.replace('.', '', 1).isdigit():
+                return 0, float(number), value
+            if '/' in value:
+                try:
+                    return 1, prefix_key(value), value
+                except ValueError:
+                    pass
+            return 2, 0, value
+
+        keys = self.rows.sort_keys(self.sort_field) if hasattr(self.rows, 'sort_keys') else None
+        if keys is None:
+            keys = [key(row[index]) for row in self.rows]
+        self.view.sort(key=keys.__getitem__, reverse=self.sort_reverse)
+        for field, title, _ in self.columns:
+            mark = (' ▼' if self.sort_reverse else ' ▲') if field == self.sort_field else ''
+            self.tree.heading(field, text=title + mark)
+
+    def _update_columns(self):
+        shown = [field for field in self.fields if self.column_vars[field].get()]
+        self.tree['displaycolumns'] = shown or self.fields[:1]
+
+    def _render(self):
+        total, page = len(self.view), self.page_size
+        self.offset = max(0, min(self.offset, total - page))
+        self.tree.delete(*self.tree.get_children())
+        for i in self.view[self.offset:self.offset + page]:
+            self.tree.insert('', tk.END, values=self.rows[i])
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + page) / total))
+        else:
+            self.scrollbar.set(0, 1)
+        self.count_label.config(text=f"{total}/{len(self.rows)} 行")
+
+    def _scroll_to(self, offset):
+        offset = max(0, min(int(offset), len(self.view) - self.page_size))
+        if offset != self.offset:
+            self.offset = offset
+            self._render()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self._scroll_to(float(amount) * len(self.view))
+        elif action == 'scroll':
+            step = self.page_size if unit == 'pages' else 1
+            self._scroll_to(self.offset + int(amount) * step)
+
+    def _on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self._scroll_to(self.offset - 3)
+        else:
+            self._scroll_to(self.offset + 3)
+        return 'break'
+
 
 class JuniperRouteQueryApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Juniper_Route_Mutil_ISP_ManTools V1.0")
         self.root.geometry("900x860")  # 增大窗口尺寸
+        # 关闭窗口时先清理再销毁；退出按钮结束mainloop后由主程序调用shutdown()
+        self.root.protocol("WM_DELETE_WINDOW", self.close_window)
+        self._shut_down = False
 
         # 设备数据存储
         self.devices = None
+        self.inventory = InventoryIndex({})  # 设备/线路索引，加载设备信息时重建
         self.current_device_info = None
-        self.current_ssh_session = None  # 当前SSH会话
-        self.current_shell = None  # 当前shell通道
-
+        self.current_device_name = None
+        # 会话日志由后台线程写入，不阻塞界面
+        self.session_logger = AsyncSessionLogger()
+        # 输出缓冲，文本框创建后再绑定；在此之前的输出先在队列中等待
+        self.output = BufferedTextOutput(root, on_flush=self.log_to_file)
+        self.ssh_pool = SSHConnectionPool(log=self.append_output)  # 按设备复用的SSH会话
+        self.command_queues = {}  # 设备名 -> DeviceCommandQueue，每台设备一个独占shell通道的工作线程
+        # 性能分析报告写出后提示路径；设置了环境变量时启动即开启
+        profiler.on_report = lambda path: self.append_output(f"\n📊 性能分析报告: {path}\n")
+        if os.environ.get(profile_env_var):
+            profiler.enable()
+
+        self.config_model = None  # 当前标签页显示的配置模型
+        self.config_cache = {}  # 设备名 -> {'commit_id': 最近提交标识, 'saved_at': 获取时间, 'model': ConfigModel}
+        self.snapshot_store = ConfigSnapshotStore()  # 配置快照，程序重启后选择设备即可显示
         self.line_prefix_list_dict = {}
         self.line_selected_prefix = None  # Currently selected prefix name
         self.line_selected_ips = []  # Currently selected IPs
@@ -53,6 +374,9 @@ class JuniperRouteQueryApp:
             self.file_path.set(self.default_excel)
             self.load_devices()
 
+        # 定期导出各阶段耗时(Prometheus文本和JSONL)
+        self.root.after(metrics_export_interval * 1000, self.export_metrics)
+
         if not os.path.exists(self.default_command_txt):
             # 创建一个空文件
             with open(self.default_command_txt, "w") as file:
@@ -83,6 +407,7 @@ class JuniperRouteQueryApp:
             font=('Consolas', 9),
         )
         self.output_text.pack(fill=tk.BOTH, expand=True)
+        self.output.attach(self.output_text)
 
         # 状态栏
         self.status_var = tk.StringVar()
@@ -90,9 +415,6 @@ class JuniperRouteQueryApp:
         ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN).pack(fill=tk.X, padx=layout_padx,
                                                                                   pady=layout_pady)
 
-        # 查询状态
-        self.query_in_progress = False
-
     def read_cmd_predefined_commands(self, file_path="commands.txt"):
         """从本地文件读取预定义命令列表"""
         try:
@@ -145,6 +467,13 @@ class JuniperRouteQueryApp:
             ttk.Button(file_frame, text="浏览设备文件", command=self.browse_file).grid(row=0, column=1, padx=5)
             ttk.Button(file_frame, text="加载设备信息", command=self.load_devices).grid(row=0, column=2, padx=5)
             ttk.Button(file_frame, text="退出", command=self.root.quit).grid(row=0, column=3,padx=5)
+            ttk.Button(file_frame, text="查找设备/线路(Ctrl+F)",
+                       command=self.open_device_picker).grid(row=0, column=4, padx=5)
+            self.root.bind('<Control-f>', lambda event: self.open_device_picker())
+            ttk.Button(file_frame, text="耗时统计", command=self.show_metrics).grid(row=0, column=5, padx=5)
+            self.profile_var = tk.BooleanVar(value=profiler.enabled)
+            ttk.Checkbutton(file_frame, text="性能分析", variable=self.profile_var,
+                            command=self.toggle_profiling).grid(row=0, column=6, padx=5)
             # 设备选择部分
             select_frame = ttk.LabelFrame(tab, text="****选择设备和线路***", padding=5)
             select_frame.pack(fill=tk.X, padx=layout_padx, pady=layout_pady)
@@ -164,6 +493,26 @@ class JuniperRouteQueryApp:
             self.line_ip_label = ttk.Label(select_frame, text="", foreground="blue", width=20)
             self.line_ip_label.grid(row=0, column=5, sticky=tk.W, padx=5)
 
+            # 结构化查询模式：使用 | display xml 获取并解析输出
+            self.structured_mode = tk.BooleanVar(value=False)
+            ttk.Checkbutton(select_frame, text="结构化输出(XML)",
+                            variable=self.structured_mode).grid(row=0, column=6, sticky=tk.W, padx=5)
+            ttk.Button(select_frame, text="取消排队任务",
+                       command=self.cancel_pending_queries).grid(row=0, column=7, sticky=tk.W, padx=5)
+            # 配置标签页数据的状态：快照(待校验)/已是最新
+            self.config_freshness = tk.StringVar(value="")
+            ttk.Label(select_frame, textvariable=self.config_freshness,
+                      foreground="gray").grid(row=0, column=8, sticky=tk.W, padx=5)
+
+            # 网段搜索：在已获取的配置中查找覆盖或重叠该地址的prefix-list、term、静态路由和黑洞路由
+            search_frame = ttk.LabelFrame(tab, text="****配置网段搜索****", padding=5)
+            search_frame.pack(fill=tk.X, padx=layout_padx, pady=layout_pady)
+            ttk.Label(search_frame, text="地址/网段:").grid(row=0, column=0, sticky=tk.W)
+            self.prefix_search_entry = ttk.Entry(search_frame, width=30)
+            self.prefix_search_entry.grid(row=0, column=1, sticky=tk.W, padx=5)
+            self.prefix_search_entry.bind("<Return>", lambda event: self.search_config_prefix())
+            ttk.Button(search_frame, text="搜索", command=self.search_config_prefix).grid(row=0, column=2, padx=5)
+
             # 分割线
             ttk.Separator(tab, orient=tk.HORIZONTAL).pack(fill=tk.X, pady=10)
             # 创建Notebook用于多标签页
@@ -179,6 +528,9 @@ class JuniperRouteQueryApp:
             # 3. 接收路由查询标签页
             self.create_receive_route_tab()
 
+            # 4. 路由查询结果列表
+            self.create_route_grid_tab()
+
         if tab_name == "常用命令下发":
 
             # 自定义命令相关
@@ -203,6 +555,8 @@ class JuniperRouteQueryApp:
             ttk.Button(cmd_custom_command_frame, text="手工巡检", command=self.manual_inspection).grid(row=0, column=4,
                                                                                                    padx=5)
             ttk.Button(cmd_custom_command_frame, text="保存结果", command=self.save_result).grid(row=0, column=5, padx=5)
+            ttk.Button(cmd_custom_command_frame, text="全网巡检", command=self.fleet_inspection).grid(row=0, column=6,
+                                                                                                 padx=5)
 
 
             # 创建选择和显示区域的框架
@@ -297,6 +651,9 @@ class JuniperRouteQueryApp:
             ttk.Button(self.line_action_frame,
                        text="增加地址段",
                        command=self.line_add_new_ips).pack(pady=5, fill=tk.X)
+            ttk.Button(self.line_action_frame,
+                       text="从文件批量导入",
+                       command=lambda: self.bulk_import_prefixes('line')).pack(pady=5, fill=tk.X)
 
             # Bind selection events
             self.line_name_listbox.bind("<<ListboxSelect>>", self.line_on_prefix_select)
@@ -367,6 +724,9 @@ class JuniperRouteQueryApp:
             ttk.Button(self.outside_action_frame,
                        text="增加源地址段",
                        command=self.outside_add_new_ips).pack(pady=5, fill=tk.X)
+            ttk.Button(self.outside_action_frame,
+                       text="从文件批量导入",
+                       command=lambda: self.bulk_import_prefixes('outside')).pack(pady=5, fill=tk.X)
 
             # Bind selection events
             self.outside_name_listbox.bind("<<ListboxSelect>>", self.outside_on_prefix_select)
@@ -436,6 +796,9 @@ class JuniperRouteQueryApp:
             ttk.Button(self.route_action_frame,
                        text="增加新路由段",
                        command=self.route_add_new_ips).pack(pady=5, fill=tk.X)
+            ttk.Button(self.route_action_frame,
+                       text="从文件批量导入",
+                       command=lambda: self.bulk_import_prefixes('route')).pack(pady=5, fill=tk.X)
 
             # Bind selection events
             self.route_name_listbox.bind("<<ListboxSelect>>", self.route_on_prefix_select)
@@ -529,55 +892,13 @@ class JuniperRouteQueryApp:
             output_frame = ttk.LabelFrame(tab, text=about_text, padding="10")
             output_frame.pack(fill=tk.BOTH, expand=True, pady=5)
 
-
-
     def line_fetch_prefix_list_config(self):
         """Fetch current prefix-list configuration from device"""
         if not self.validate_input():
             return
 
-        # 使用更可靠的命令格式，确保获取完整配置
-        command = "show configuration policy-options | display set | match prefix-list|no-more"
-        self.current_callback = self.line_process_prefix_list_config  # 明确设置回调
-        self.start_query(command)
-
-    def line_process_prefix_list_config(self, output):
-        """Process the prefix-list configuration output"""
-        try:
-            pattern = r"set policy-options prefix-list (\S+) (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/\d{1,2})"
-            self.line_prefix_list_dict = {}
-            self.line_selected_prefix = None  # 重置当前选择
-            self.line_selected_ips = []
-
-            for line in output.splitlines():
-                line = line.strip()
-                if not line:
-                    continue
-
-                match = re.match(pattern, line)
-                if match:
-                    prefix_name = match.group(1)
-                    ip_address = match.group(2)
-                    if prefix_name in self.line_prefix_list_dict:
-                        if ip_address not in self.line_prefix_list_dict[prefix_name]:
-                            self.line_prefix_list_dict[prefix_name].append(ip_address)
-                    else:
-                        self.line_prefix_list_dict[prefix_name] = [ip_address]
-
-            # 调试：打印解析结果
-            # print("解析结果:")
-            # for name, ips in self.line_prefix_list_dict.items():
-            #     print(f"{name}: {', '.join(ips)}")
-
-            # 更新UI显示
-            self.line_update_prefix_list_ui()
-
-
-        except Exception as e:
-            messagebox.showerror("错误",
-                                 f"处理配置时出错：{str(e)}\n" +
-                                 "请检查raw_output.txt查看原始输出")
-
+        # 一次获取完整配置，同时刷新全部配置管理标签页
+        self.fetch_all_config()
 
     def line_update_prefix_list_ui(self):
         """更新prefix-list的UI显示"""
@@ -639,11 +960,9 @@ class JuniperRouteQueryApp:
             return
 
         # Generate delete commands
-        commands = []
-        for ip in self.line_selected_ips:
-            if ip != "1.1.1.1/32":  # Skip the default IP
-                cmd = f"delete policy-options prefix-list {self.line_selected_prefix} {ip}"
-                commands.append(cmd)
+        commands = prefix_list_commands(
+            "delete", self.line_selected_prefix,
+            [ip for ip in self.line_selected_ips if ip != "1.1.1.1/32"])  # Skip the default IP
 
         if not commands:
             messagebox.showinfo("提示", "没有有效的IP地址需要删除")
@@ -653,9 +972,6 @@ class JuniperRouteQueryApp:
         self.line_display_commands(commands)
         self.execute_config_commands(commands)
 
-        # Refresh with proper timing
-        self.root.after(3000, lambda: self.line_refresh_prefix_list())
-
     def line_add_new_ips(self):
         """Add new IP addresses to prefix-list"""
         if not self.line_selected_prefix:
@@ -667,52 +983,108 @@ class JuniperRouteQueryApp:
             messagebox.showwarning("警告", "请输入要添加的IP地址")
             return
 
-        # Validate IP format
-        ip_pattern = r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/\d{1,2}$"
-        line_valid_ips = [ip for ip in new_ips if re.match(ip_pattern, ip.strip())]
+        # Validate IP format: 地址、掩码长度和主机位都必须合法，prefix-list同时支持IPv4和IPv6
+        line_valid_ips, invalid_ips = split_prefixes(new_ips)
 
-        if not line_valid_ips:
-            messagebox.showwarning("警告", "没有有效的IP地址格式 (应为 x.x.x.x/x)")
+        if invalid_ips or not line_valid_ips:
+            messagebox.showwarning("警告", "存在无效的网段 (应为 x.x.x.x/x 且主机位为0):\n" + "\n".join(invalid_ips[:10]))
             return
 
         # Generate set commands
-        commands = [f"set policy-options prefix-list {self.line_selected_prefix} {ip}"
-                    for ip in line_valid_ips]
+        commands = prefix_list_commands("set", self.line_selected_prefix, line_valid_ips)
 
         # Display commands and execute
         self.line_display_commands(commands)
         self.execute_config_commands(commands)
 
-        # Clear input and refresh display with proper timing
+        # Clear input; the display is updated from the committed delta
         self.line_ip_text.delete("1.0", tk.END)
-        self.root.after(3000, lambda: self.line_refresh_prefix_list())  # 增加延迟确保配置生效
-
-    def line_refresh_prefix_list(self):
-        """完整的配置刷新流程"""
-        try:
-            # 1. 保存当前状态
-            state = self.line_save_current_state()
 
-            # 2. 显示加载状态
-            self.status_var.set("正在刷新配置...")
+    def bulk_import_prefixes(self, tab):
+        """从文件批量导入网段到公网线路prefix-list、强制线路term或路由发布，tab为 line/outside/route。
+        去掉已配置的网段并合并相邻/重叠网段后，只下发最少的set/delete命令"""
+        selected = getattr(self, f"{tab}_selected_prefix")
+        if tab != 'route' and not selected:
+            messagebox.showwarning("警告", "请先选择prefix-list" if tab == 'line' else "请先选择term")
+            return
+        file_path = filedialog.askopenfilename(
+            title="选择要导入的网段文件(每行一个)",
+            filetypes=(("文本文件", "*.txt"), ("所有文件", "*.*"))
+        )
+        if not file_path:
+            return
 
-            # 3. 获取最新配置
-            self.line_fetch_prefix_list_config()
+        start_time = time.time()
+        try:
+            new_prefixes, invalid = read_prefix_file(file_path, versions=(4, 6) if tab == 'line' else (4,))
+        except OSError as e:
+            messagebox.showerror("错误", f"读取文件失败: {str(e)}")
+            return
+        if invalid:
+            self.append_output(f"\n⚠ 导入文件中 {len(invalid)} 行无效，已跳过:\n" + "\n".join(invalid[:50]) + "\n")
+        if not new_prefixes:
+            messagebox.showwarning("警告", "文件中没有有效的网段")
+            return
 
-            # 4. 等待配置加载完成
-            self.root.after(1500, lambda: self.line_restore_state_after_refresh(state))
+        if tab == 'route':
+            # 只与同一下一跳的路由合并，其他静态路由只用于去重
+            routes = self.route_prefix_list_dict
+            existing = [prefix for prefix, next_hops in routes.items() if next_hops == [route_next_hop]]
+            new_prefixes = [prefix for prefix in new_prefixes if prefix not in routes]
+        else:
+            existing = getattr(self, f"{tab}_prefix_list_dict").get(selected, [])
+
+        plain_set, _ = plan_prefix_import(existing, new_prefixes, aggregate=False)
+        to_set, to_delete = plan_prefix_import(existing, new_prefixes)
+        answer = messagebox.askyesnocancel(
+            "批量导入",
+            f"有效网段 {len(new_prefixes)} 条，无效 {len(invalid)} 行，其中 {len(new_prefixes) - len(plain_set)} 条已配置。\n"
+            f"仅去重: set {len(plain_set)} 条\n"
+            f"合并相邻/重叠网段: set {len(to_set)} 条, delete {len(to_delete)} 条\n\n"
+            "是否合并网段？(是=合并 否=仅去重 取消=不导入)\n"
+            "注意: prefix-list和静态路由合并后匹配/发布的网段会变为聚合网段"
+        )
+        if answer is None:
+            return
+        if not answer:
+            to_set, to_delete = plain_set, []
+        if not to_set and not to_delete:
+            messagebox.showinfo("提示", "所有网段均已配置，无需下发")
+            return
 
-        except Exception as e:
-            pass
+        if tab == 'line':
+            commands = prefix_list_commands("set", selected, to_set) + prefix_list_commands("delete", selected, to_delete)
+        elif tab == 'outside':
+            commands = (firewall_source_commands("set", selected, to_set)
+                        + firewall_source_commands("delete", selected, to_delete))
+        else:
+            commands = [command for ip in to_set for command in static_route_commands(ip)]
+            commands += [delete_static_route_command(ip) for ip in to_delete]
+
+        # 按导入后的预期配置先自检一次生效验证：下发后同样的检查在commit confirmed的回滚时间内执行，
+        # 结果应为空，且耗时需远小于回滚时间
+        removed = set(to_delete)
+        final = [prefix for prefix in existing if prefix not in removed] + list(to_set)
+        if tab == 'line':
+            expected = prefix_list_commands("set", selected, final)
+        elif tab == 'outside':
+            expected = firewall_source_commands("set", selected, final)
+        else:
+            expected = [command for ip in final for command in static_route_commands(ip)]
+        verify_start = time.time()
+        unapplied = find_unapplied_statements(commands, "\n".join(expected))
+        verify_time = time.time() - verify_start
+        if unapplied or verify_time > config_verify_budget:
+            reason = (f"{len(unapplied)}条命令与预期配置不一致: {unapplied[0]}" if unapplied
+                      else f"生效验证耗时 {verify_time:.1f}秒，超过 {config_verify_budget}秒")
+            messagebox.showerror("错误", f"批量导入自检失败，未下发:\n{reason}")
+            return
 
-    def line_save_current_state(self):
-        """保存当前UI状态"""
-        return {
-            'line_selected_prefix': self.line_selected_prefix,
-            'line_selected_ips': self.line_selected_ips.copy(),
-            'scroll_position': self.line_name_listbox.yview(),
-            'ip_scroll_position': self.line_ip_listbox.yview()
-        }
+        self.append_output(f"\n批量导入: 读取并合并耗时 {time.time() - start_time:.2f}秒，"
+                           f"下发 set {len(to_set)} 条, delete {len(to_delete)} 条，"
+                           f"生效验证自检 {verify_time:.2f}秒\n")
+        getattr(self, f"{tab}_display_commands")(commands)
+        self.execute_config_commands(commands)
 
     def line_restore_state_after_refresh(self, state):
         """从保存的状态恢复UI"""
@@ -737,138 +1109,75 @@ class JuniperRouteQueryApp:
             self.bh_cmd_output.insert(tk.END, f"恢复状态时出错: {str(e)}")
             self.status_var.set("部分状态恢复失败")
 
-    def line_restore_selection_after_refresh(self, line_last_selected):
-        """刷新后恢复之前的选中状态"""
-        try:
-            if line_last_selected and line_last_selected in self.line_prefix_list_dict:
-                items = self.line_name_listbox.get(0, tk.END)
-                if line_last_selected in items:
-                    index = items.index(line_last_selected)
-                    self.line_name_listbox.selection_clear(0, tk.END)
-                    self.line_name_listbox.selection_set(index)
-                    self.line_name_listbox.see(index)
-                    self.line_on_prefix_select(None)  # 触发IP列表更新
-            self.status_var.set("配置已刷新")
-        except Exception as e:
-            self.bh_cmd_output.insert(tk.END, f"恢复选择状态时出错: {str(e)}")
-
     def execute_config_commands(self, commands):
-        """更可靠的配置执行流程"""
+        """配置下发作为最高优先级任务进入设备队列，由队列线程在同一shell通道中依次执行"""
         if not self.validate_input():
-            return False
-
-        try:
-            self.status_var.set("正在应用配置...")
-
-            # 使用exclusive模式防止其他会话干扰
-            full_commands = ["configure exclusive"] + commands + ["commit", "exit"]
-
-            # 执行命令并等待完成
-            for cmd in full_commands:
-                self.start_query(cmd)
-                # 根据命令类型调整等待时间
-                delay = 1.0 if "commit" in cmd else 0.5
-                time.sleep(delay)
-
-            # 验证配置是否生效
-            if not self.verify_config_applied(commands):
-                raise Exception("配置可能未完全应用")
-
-            self.status_var.set("配置已提交")
-            return True
-        except Exception as e:
-            self.status_var.set(f"配置失败: {str(e)}")
-            messagebox.showerror("错误", f"配置应用失败: {str(e)}")
-            return False
+            return None
 
-    def verify_config_applied(self, commands):
-        """验证配置是否已应用"""
-        # 这里可以添加具体的验证逻辑
-        # 例如检查特定配置是否存在
-        time.sleep(1)  # 给设备一点时间应用配置
-        return True  # 简化实现，实际应根据需要实现
+        self.status_var.set("正在应用配置...")
+        device_name = self.current_device_name
+        future = self.get_command_queue().submit(
+            lambda session: self.apply_config_job(session, commands),
+            PRIORITY_CONFIG
+        )
 
-    def commit_config_changes(self):
-        """Commit configuration changes"""
-        if not self.validate_input():
-            return
+        def done(future):
+            if future.cancelled():
+                self.status_var.set("配置下发已取消")
+                return
+            error = future.exception()
+            if error:
+                self.status_var.set(f"配置失败: {str(error)}")
+                messagebox.showerror("错误", f"配置应用失败: {str(error)}")
+                # 设备上的实际状态不确定，重新获取配置
+                if device_name == self.current_device_name:
+                    self.fetch_all_config(force=True)
+            else:
+                # 提交任务已验证配置生效，直接把本次修改应用到本地配置模型，无需重新获取
+                result = future.result()
+                self.apply_config_delta(device_name, commands, result)
+                self.status_var.set(f"配置已提交，耗时 {sum(elapsed for _, elapsed in result['timings']):.1f}秒")
+
+        future.add_done_callback(lambda f: self.root.after(0, lambda: done(f)))
+        return future
+
+    def apply_config_delta(self, device_name, commands, result):
+        """把已提交的set/delete命令应用到设备的缓存配置模型，并更新缓存的提交标识。
+        提交前设备上已有其他人的提交时，本地模型不完整，改为重新获取"""
+        cached = self.config_cache.get(device_name)
+        if cached and cached['commit_id'] and cached['commit_id'] == result['base_commit_id']:
+            cached['model'].apply_commands(commands)
+            cached['commit_id'] = result['commit_id']
+            cached['saved_at'] = time.time()
+            cached['stale'] = False
+            self.snapshot_store.save(device_name, cached['commit_id'], cached['model'], cached['saved_at'])
+            if device_name == self.current_device_name:
+                self.apply_config_model(cached['model'])
+                self.show_config_freshness(device_name, cached)
+        else:
+            self.config_cache.pop(device_name, None)
+            self.snapshot_store.delete(device_name)
+            if device_name == self.current_device_name:
+                self.fetch_all_config(force=True)
 
-        commands = ["commit"]
-        self.execute_config_commands(commands)
+    def apply_config_job(self, session, commands):
+        """在队列线程中执行：载入、检查、确认提交并验证配置，输出回显到输出窗口"""
+        return apply_config(session['cli'], commands, log=self.append_output)
 
     def line_display_commands(self, commands):
         """Display commands in the output area"""
         self.line_cmd_output.config(state='normal')
         self.line_cmd_output.insert(tk.END, "\n将要执行的命令:\n")
-        for cmd in commands:
-            self.line_cmd_output.insert(tk.END, f"{cmd}\n")
+        self.line_cmd_output.insert(tk.END, "".join(f"{cmd}\n" for cmd in commands))
         self.line_cmd_output.see(tk.END)
         self.line_cmd_output.config(state='disabled')
 
-    def line_smart_refresh(self):
-        """智能刷新方法，处理各种情况"""
-        try:
-            # 1. 检查当前状态
-            if not self.validate_input():
-                return False
-
-            # 2. 保存当前状态
-            state = self.line_save_current_state()
-
-            # 3. 尝试获取最新配置
-            attempts = 0
-            max_attempts = 3
-            while attempts < max_attempts:
-                try:
-                    self.line_fetch_prefix_list_config()
-                    self.line_restore_state_after_refresh(state)
-                    return True
-                except Exception as e:
-                    attempts += 1
-                    self.bh_cmd_output.insert(tk.END, f"刷新尝试 {attempts}/{max_attempts} 失败: {str(e)}")
-                    time.sleep(1)  # 等待设备恢复
-
-            raise Exception(f"经过 {max_attempts} 次尝试后刷新失败")
-
-        except Exception as e:
-            self.status_var.set(f"刷新失败: {str(e)}")
-            messagebox.showwarning("刷新警告", str(e))
-            return False
-
-    def line_smart_refresh_after_delete(self):
-        """删除操作后的智能刷新"""
-        try:
-            # 保存当前选中的prefix-name
-            line_last_selected = self.line_selected_prefix
-
-            # 完全重新加载配置
-            self.line_fetch_prefix_list_config()
-
-            # 尝试恢复选中状态
-            if line_last_selected:
-                items = self.line_name_listbox.get(0, tk.END)
-                if line_last_selected in items:
-                    index = items.index(line_last_selected)
-                    self.line_name_listbox.selection_set(index)
-                    self.line_on_prefix_select()
-
-            self.status_var.set("删除操作完成，配置已刷新")
-
-        except Exception as e:
-            messagebox.showwarning("刷新警告",
-                                   f"自动刷新失败: {str(e)}\n"
-                                   "请手动点击'获取当前配置'按钮")
-
-
-
     def cmd_on_command_select(self, event):
         """当自定义命令被选择时触发"""
         selected_command = self.cmd_custom_command_entry.get()
         self.status_var.set(f"选择的命令: {selected_command}")
 
     def run_custom_command(self):
-        if self.query_in_progress:
-            return
         if not self.validate_input():
             return
 
@@ -886,10 +1195,6 @@ class JuniperRouteQueryApp:
 
     def manual_inspection(self):
         """手工巡检功能"""
-        if self.query_in_progress:
-            messagebox.showwarning("警告", "当前有查询正在进行，请稍后再试")
-            return
-
         if not self.validate_input():
             return
 
@@ -913,86 +1218,138 @@ class JuniperRouteQueryApp:
         if not file_path:
             return  # 用户取消了保存
 
-        # 准备巡检命令
+        # 准备巡检命令(show命令走exec通道，无需关闭分页)
         inspection_commands = self.cmd_predefined_commands.copy()
-        inspection_commands.insert(0, "set cli screen-length 0")  # 禁用分页显示
-        inspection_commands.append("set cli screen-length 24")  # 恢复分页显示
 
-        # 创建线程执行巡检
-        threading.Thread(
-            target=self.execute_inspection,
-            args=(inspection_commands, file_path),
-            daemon=True
-        ).start()
+        # 巡检作为低优先级任务进入设备队列，不会打断配置下发
+        self.status_var.set("巡检排队中...")
+        self.get_command_queue().submit(
+            lambda session: self.execute_inspection(session, inspection_commands, file_path),
+            PRIORITY_POLL
+        )
 
-    def execute_inspection(self, commands, file_path):
-        """执行巡检命令并保存结果"""
+    def execute_inspection(self, session, commands, file_path):
+        """执行巡检命令并保存结果，多条命令在同一连接的多个通道上并发执行"""
         try:
-            self.query_in_progress = True
-            self.status_var.set("巡检中...")
+            self.root.after(0, lambda: self.status_var.set("巡检中..."))
 
-            # 确保SSH会话已建立
-            if not self.establish_ssh_session():
-                raise Exception("无法建立SSH连接")
+            self.append_output(f"\n🔍 开始设备巡检，共 {len(commands)} 条命令...\n")
+            start_time = time.time()
+            done = []
 
-            shell = self.current_shell
+            def on_result(index, cmd, result):
+                done.append(index)
+                mark = "⚠" if isinstance(result, Exception) else "✅"
+                self.append_output(f"{mark} ({len(done)}/{len(commands)}) {cmd}\n")
+
+            outputs = run_inspection(session, commands, on_result=on_result)
+
+            # 按原命令顺序输出并保存结果
             results = []
+            for cmd, output in zip(commands, outputs):
+                if isinstance(output, Exception):
+                    output = f"⚠ 执行失败: {str(output)}\n"
+                results.append(f"\n✅ 执行命令: {cmd}\n{output}")
+            self.append_output("".join(results))
 
-            self.append_output("\n🔍 开始设备巡检...\n")
-
-            for cmd in commands:
-                if not cmd:
-                    continue
-
-                self.append_output(f"\n✅ 执行命令: {cmd}\n")
-                shell.send(cmd + '\n')
-                time.sleep(1)  # 等待命令执行
-
-                # 读取输出
-                output = ""
-                start_time = time.time()
-                while time.time() - start_time < 10:  # 10秒超时
-                    if shell.recv_ready():
-                        data = shell.recv(65535).decode('utf-8', errors='ignore')
-                        output += data
-                        self.append_output(data)
-                        results.append(data)
-                    else:
-                        time.sleep(0.1)
-
-                # 如果是设置命令，不需要等待提示符
-                if not cmd.startswith("set cli"):
-                    # 等待提示符出现
-                    while True:
-                        if shell.recv_ready():
-                            data = shell.recv(65535).decode('utf-8', errors='ignore')
-                            output += data
-                            self.append_output(data)
-                            results.append(data)
-                            if '>' in data or '#' in data:
-                                break
-                        else:
-                            time.sleep(0.1)
-                            if '>' in output or '#' in output:
-                                break
-                            if time.time() - start_time > 10:  # 10秒超时
-                                break
-
-                time.sleep(0.5)  # 命令间短暂延迟
-
-            # 保存结果到文件
             with open(file_path, 'w', encoding='utf-8') as f:
                 f.write("\n".join(results))
 
-            self.append_output(f"\n✅ 巡检完成，结果已保存到: {file_path}\n")
-            messagebox.showinfo("完成", f"巡检完成，结果已保存到:\n{file_path}")
+            self.append_output(f"\n✅ 巡检完成，耗时 {time.time() - start_time:.1f} 秒，结果已保存到: {file_path}\n")
+            self.root.after(0, lambda: messagebox.showinfo("完成", f"巡检完成，结果已保存到:\n{file_path}"))
 
         except Exception as e:
-            self.append_output(f"\n⚠ 巡检过程中出错: {str(e)}\n")
-            messagebox.showerror("错误", f"巡检过程中出错:\n{str(e)}")
+            msg = str(e)
+            self.append_output(f"\n⚠ 巡检过程中出错: {msg}\n")
+            self.root.after(0, lambda msg=msg: messagebox.showerror("错误", f"巡检过程中出错:\n{msg}"))
         finally:
-            self.query_in_progress = False
-            self.status_var.set("就绪")
+            self.root.after(0, lambda: self.status_var.set("就绪"))
+
+    def fleet_inspection(self):
+        """全网巡检：并行巡检设备文件中的全部设备"""
+        if not self.devices:
+            messagebox.showwarning("警告", "请先加载设备信息")
+            return
+
+        if not self.cmd_predefined_commands:
+            messagebox.showwarning("警告", "没有可用的预定义命令")
+            return
+
+        if not messagebox.askyesno("确认",
+                                   f"确定要对全部 {len(self.devices)} 台设备执行巡检吗？\n"
+                                   f"每台设备执行 {len(self.cmd_predefined_commands)} 条命令，"
+                                   f"同时巡检 {min(fleet_max_workers, len(self.devices))} 台"):
+            return
+
+        out_dir = filedialog.askdirectory(title="选择巡检结果保存目录")
+        if not out_dir:
+            return
+
+        devices = dict(self.devices)
+        commands = self.cmd_predefined_commands.copy()
+
+        # 巡检进度窗口
+        window = tk.Toplevel(self.root)
+        window.title("全网巡检进度")
+        window.geometry("700x400")
+        tree = ttk.Treeview(window, columns=("status", "progress", "elapsed"), show="tree headings")
+        tree.heading("#0", text="设备名")
+        tree.heading("status", text="状态")
+        tree.heading("progress", text="进度")
+        tree.heading("elapsed", text="耗时(秒)")
+        tree.column("#0", width=200)
+        tree.column("status", width=250)
+        tree.column("progress", width=100, anchor=tk.CENTER)
+        tree.column("elapsed", width=100, anchor=tk.CENTER)
+        tree.pack(fill=tk.BOTH, expand=True, padx=layout_padx, pady=layout_pady)
+        for device_name in devices:
+            tree.insert("", tk.END, iid=device_name, text=device_name,
+                        values=("等待中", f"0/{len(commands)}", ""))
+
+        threading.Thread(
+            target=self.execute_fleet_inspection,
+            args=(devices, commands, out_dir, tree),
+            daemon=True
+        ).start()
+
+    def execute_fleet_inspection(self, devices, commands, out_dir, tree):
+        """使用有界线程池并行巡检多台设备，每台设备一个结果文件，最后生成汇总"""
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        start_time = time.time()
+        self.root.after(0, lambda: self.status_var.set(f"全网巡检中... 0/{len(devices)}"))
+
+        def update_row(device_name, status, progress, elapsed=""):
+            def helper():
+                if tree.winfo_exists():
+                    tree.item(device_name, values=(status, progress, elapsed))
+            self.root.after(0, helper)
+
+        results = []
+        with ThreadPoolExecutor(max_workers=fleet_max_workers) as executor:
+            futures = [executor.submit(profiler.run, "fleet_inspection", name, inspect_device,
+                                       name, info, commands, out_dir, stamp, update_row)
+                       for name, info in devices.items()]
+            for future in as_completed(futures):
+                results.append(future.result())
+                done = len(results)
+                self.root.after(0, lambda done=done: self.status_var.set(f"全网巡检中... {done}/{len(devices)}"))
+
+        # 汇总文件
+        results.sort(key=lambda r: r['device'])
+        failed = [r for r in results if r['status'] != "完成"]
+        summary_path = os.path.join(out_dir, f"fleet_inspection_summary_{stamp}.txt")
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            f.write(f"巡检时间: {stamp}\n")
+            f.write(f"设备总数: {len(results)}  成功: {len(results) - len(failed)}  失败: {len(failed)}\n")
+            f.write(f"总耗时: {time.time() - start_time:.1f}秒\n\n")
+            for r in results:
+                f.write(f"{r['device']}\t{r['ip']}\t{r['status']}\t命令 {r['done']}/{r['total']}\t"
+                        f"{r['elapsed']:.1f}秒\t{r['file']}\n")
+
+        self.append_output(f"\n✅ 全网巡检完成: 成功 {len(results) - len(failed)} 台，失败 {len(failed)} 台，"
+                           f"汇总已保存到: {summary_path}\n")
+        self.root.after(0, lambda: self.status_var.set("全网巡检完成"))
+        self.root.after(0, lambda: messagebox.showinfo("完成", f"全网巡检完成，汇总已保存到:\n{summary_path}"))
 
     def create_route_table_tab(self):
         """创建路由表查询标签页"""
@@ -1027,6 +1384,8 @@ class JuniperRouteQueryApp:
 
         ttk.Button(query_frame, text="普通查询", command=self.advertise_normal_query).grid(row=0, column=2, padx=5)
         ttk.Button(query_frame, text="扩展查询", command=self.advertise_extensive_query).grid(row=0, column=3, padx=5)
+        ttk.Button(query_frame, text="全线路对比",
+                   command=lambda: self.isp_matrix_query(self.advertise_ip_entry.get())).grid(row=0, column=4, padx=5)
 
     def create_receive_route_tab(self):
         """创建接收路由查询标签页"""
@@ -1044,11 +1403,157 @@ class JuniperRouteQueryApp:
 
         ttk.Button(query_frame, text="普通查询", command=self.receive_normal_query).grid(row=0, column=2, padx=5)
         ttk.Button(query_frame, text="扩展查询", command=self.receive_extensive_query).grid(row=0, column=3, padx=5)
+        # 全表导入：接收该线路的整张IPv4 BGP表并按列保存，结果在查询结果列表中浏览
+        ttk.Button(query_frame, text="全表导入", command=self.receive_full_table_ingest).grid(row=0, column=4, padx=5)
+        ttk.Button(query_frame, text="打开全表文件", command=self.open_rib_file).grid(row=0, column=5, padx=5)
+        ttk.Button(query_frame, text="全线路对比",
+                   command=lambda: self.isp_matrix_query(self.receive_ip_entry.get())).grid(row=0, column=6, padx=5)
+
+    def isp_matrix_query(self, ip_range):
+        """对设备的全部线路同时查询该网段的接收和发布路由，结果汇总到一张线路对比表"""
+        if not self.current_device_info:
+            messagebox.showerror("错误", "检查到多台设备，请选择设备")
+            return
+        ip_range = ip_range.strip()
+        if not ip_range:
+            messagebox.showerror("错误", "请输入要查询的IP段")
+            return
+
+        lines = self.current_device_info['lines']
+        if not lines:
+            messagebox.showwarning("警告", "该设备没有线路信息")
+            return
+        commands = isp_matrix_commands(ip_range, lines)
+
+        window = tk.Toplevel(self.root)
+        window.title(f"全线路对比 - {self.current_device_name} {ip_range}")
+        window.geometry("1000x300")
+        columns = (("line_ip", "线路IP", 110), ("received", "接收", 60), ("receive_as_path", "接收AS path", 220),
+                   ("local_pref", "Local-pref", 75), ("med", "MED", 55), ("advertised", "发布", 60),
+                   ("advertise_as_path", "发布AS path", 220))
+        tree = ttk.Treeview(window, columns=[name for name, _, _ in columns], show="tree headings")
+        tree.heading("#0", text="线路")
+        tree.column("#0", width=120)
+        for name, title, width in columns:
+            tree.heading(name, text=title)
+            tree.column(name, width=width, anchor=tk.W if 'as_path' in name else tk.CENTER)
+        tree.pack(fill=tk.BOTH, expand=True, padx=layout_padx, pady=layout_pady)
+        for i, line in enumerate(lines):
+            tree.insert("", tk.END, iid=str(i), text=line['line_name'],
+                        values=(line['line_ip'], "查询中", "", "", "", "查询中", ""))
+
+        self.status_var.set(f"全线路对比查询中，共 {len(commands)} 条命令...")
+        self.get_command_queue().submit(lambda session: self.isp_matrix_job(session, commands, tree),
+                                        PRIORITY_QUERY)
+
+    def isp_matrix_job(self, session, commands, tree):
+        """在队列线程中执行：全部命令分配到同一连接的多个exec通道并发执行，每条结果到达时更新对应单元格"""
+        start_time = time.time()
+
+        def on_result(index, command, result):
+            if isinstance(result, Exception):
+                self.append_output(f"\n⚠ {command}: {str(result)}\n")
+            cells = isp_matrix_cells(index, result)
+
+            def update():
+                if tree.winfo_exists():
+                    for name, value in cells.items():
+                        tree.set(str(index // 2), name, value)
+            self.root.after(0, update)
+
+        try:
+            run_inspection(session, commands, max_channels=min(len(commands), isp_matrix_max_channels),
+                           on_result=on_result)
+        finally:
+            elapsed = time.time() - start_time
+            self.root.after(0, lambda: self.status_var.set(f"全线路对比完成，耗时 {elapsed:.1f}秒"))
+
+    def receive_full_table_ingest(self):
+        """导入当前线路的整张接收路由表，边接收边解析，保存到 rib_store_dir 下的全表文件"""
+        if not self.validate_input():
+            return
+
+        line_ip = self.get_selected_line_ip()
+        device_name = self.current_device_name
+        command = rib_table_command(line_ip)
+        path = os.path.join(rib_store_dir, f"{device_name}_{line_ip}.rib")
+        meta = {'device': device_name, 'line': self.line_combo.get(), 'line_ip': line_ip, 'command': command,
+                'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        command_queue = self.get_command_queue()
+        self.status_var.set("全表导入排队中..." if command_queue.busy else "全表导入中...")
+        command_queue.submit(lambda session: self.rib_ingest_job(session, command, path, meta), PRIORITY_QUERY)
+
+    def rib_ingest_job(self, session, command, path, meta):
+        """在队列线程中执行：不保留原始输出，路由行分块交给解析进程，完成后保存并显示"""
+        self.output.clear()
+        self.output.write(f"执行命令: {command}\n")
+        self.root.after(0, lambda: self.status_var.set("全表导入中..."))
+        start_time = time.time()
+        progress = {'reported': 0}
+
+        def on_progress(count):
+            if count - progress['reported'] >= 100000:
+                progress['reported'] = count
+                self.append_output(f"已解析 {count} 条路由，耗时 {time.time() - start_time:.1f}秒\n")
+
+        try:
+            table = ingest_rib(session['cli'], command, meta, on_progress=on_progress)
+            self.append_output(f"\n已解析 {len(table)} 条路由，正在保存到 {path}...\n")
+            self.root.after(0, lambda: self.status_var.set("全表保存中..."))
+            table.save(path)
+            self.append_output(f"\n✅全表导入完成，耗时 {time.time() - start_time:.1f}秒: {table.summary()}\n"
+                               f"已保存到 {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)\n")
+            self.root.after(0, lambda: self.show_rib_table(table))
+            return table
+        finally:
+            # 保存和显示都结束后才标记完成；失败原因由report_queue_failure统一显示
+            self.root.after(0, self.query_complete)
+
+    def open_rib_file(self):
+        """打开之前保存的全表文件，直接映射到内存后显示"""
+        file_path = filedialog.askopenfilename(
+            title="选择全表文件",
+            initialdir=rib_store_dir if os.path.isdir(rib_store_dir) else None,
+            filetypes=(("全表文件", "*.rib"), ("所有文件", "*.*"))
+        )
+        if not file_path:
+            return
+        try:
+            table = RibTable.load(file_path)
+        except Exception as e:
+            messagebox.showerror("错误", f"打开全表文件失败: {str(e)}")
+            return
+        meta = table.meta
+        self.append_output(f"\n打开全表文件 {file_path}: {meta.get('device', '')} {meta.get('line', '')} "
+                           f"{meta.get('time', '')}, {table.summary()}\n")
+        self.show_rib_table(table)
+
+    def show_rib_table(self, table):
+        """在查询结果列表中显示全表，之前打开的全表文件映射随之释放"""
+        previous, self.rib_table = self.rib_table, table
+        self.route_grid.set_rows(table)
+        self.notebook.select(self.route_grid_tab)
+        if previous is not None:
+            previous.close()
+        self.status_var.set(f"全表: {table.summary()}")
+
+    def create_route_grid_tab(self):
+        """创建路由查询结果列表标签页，支持排序、过滤和选择显示的列"""
+        self.route_grid_tab = ttk.Frame(self.notebook)
+        self.notebook.add(self.route_grid_tab, text="查询结果列表")
+        self.rib_table = None  # 当前在列表中显示的全表
+        self.route_grid = VirtualTreeview(self.route_grid_tab, [
+            ('active', '活动', 40), ('prefix', '前缀', 140), ('protocol', '协议', 60), ('preference', '优先级', 55),
+            ('next_hop', '下一跳', 120), ('interface', '接口', 100), ('as_path', 'AS path', 200),
+            ('local_pref', 'Local-pref', 75), ('med', 'MED', 55), ('age', 'Age', 110),
+            ('communities', 'Communities', 200),
+        ], height=12)
+        self.route_grid.frame.pack(fill=tk.BOTH, expand=True, padx=layout_padx, pady=layout_pady)
 
     def browse_file(self):
         filename = filedialog.askopenfilename(
             title="选择设备信息文件",
-            filetypes=(("Excel文件", "*.xlsx"), ("所有文件", "*.*")),
+            filetypes=(("Excel文件", "*.xlsx"), ("CSV文件", "*.csv"), ("所有文件", "*.*")),
             initialfile=self.default_excel
         )
         if filename:
@@ -1061,6 +1566,7 @@ class JuniperRouteQueryApp:
 
         try:
             self.devices = self.read_device_info(self.file_path.get())
+            self.inventory = InventoryIndex(self.devices or {})
             if self.devices:
                 # 获取去重后的设备名称列表
                 device_names = list(self.devices.keys())
@@ -1089,36 +1595,7 @@ class JuniperRouteQueryApp:
 
     def read_device_info(self, excel_file):
         try:
-            df = pd.read_excel(excel_file)
-            # 检查必要列是否存在
-            required_columns = ['设备名称', '设备IP', '设备登陆方式', '设备登陆端口', '用户名', '密码', '线路名称',
-                                '线路IP']
-            for col in required_columns:
-                if col not in df.columns:
-                    messagebox.showerror("错误", f"Excel文件中缺少必要的列: {col}")
-                    return None
-
-            # 将数据转换为字典列表，按设备名称分组
-            devices = {}
-            for _, row in df.iterrows():
-                device_name = row['设备名称']
-                if device_name not in devices:
-                    devices[device_name] = {
-                        'ip': row['设备IP'],
-                        'login_method': row['设备登陆方式'],
-                        'port': int(row['设备登陆端口']),
-                        'username': row['用户名'],
-                        'password': row['密码'],
-                        'lines': []  # 存储该设备的所有线路
-                    }
-
-                # 添加线路信息
-                devices[device_name]['lines'].append({
-                    'line_name': row['线路名称'],
-                    'line_ip': row['线路IP']
-                })
-
-            return devices
+            return load_device_file(excel_file)
         except Exception as e:
             messagebox.showerror("错误", f"读取Excel文件出错: {str(e)}")
             return None
@@ -1126,10 +1603,8 @@ class JuniperRouteQueryApp:
     def on_device_select(self, event=None):
         device_name = self.device_combo.get()
         if device_name in self.devices:
-            # 如果设备已更改，关闭当前SSH会话
-            if self.current_device_info and self.current_device_info['ip'] != self.devices[device_name]['ip']:
-                self.close_ssh_session()
-
+            # 切换设备时不关闭会话，之前设备的会话保留在连接池中复用
+            self.current_device_name = device_name
             self.current_device_info = self.devices[device_name]
             lines = [line['line_name'] for line in self.current_device_info['lines']]
             self.line_combo['values'] = lines
@@ -1139,17 +1614,60 @@ class JuniperRouteQueryApp:
                 self.line_combo.current(0)
                 self.on_line_select()
 
+            self.load_config_snapshot(device_name)
             self.status_var.set(f"已选择设备: {device_name} (共{len(lines)}条线路)")
 
     def on_line_select(self, event=None):
         if not self.current_device_info or not self.line_combo.get():
             return
 
-        selected_line = self.line_combo.get()
-        for line in self.current_device_info['lines']:
-            if line['line_name'] == selected_line:
-                self.line_ip_label.config(text=line['line_ip'])
-                break
+        line = self.inventory.line(self.current_device_name, self.line_combo.get())
+        if line:
+            self.line_ip_label.config(text=line['line_ip'])
+
+    def open_device_picker(self):
+        """设备/线路查找窗口：输入设备名、线路名、IP、站点或运营商的任意部分即时过滤，双击或回车选中"""
+        if not len(self.inventory):
+            messagebox.showwarning("警告", "请先加载设备信息")
+            return
+        window = tk.Toplevel(self.root)
+        window.title(f"查找设备/线路 (共{len(self.inventory.devices)}台设备, {len(self.inventory)}条线路)")
+        window.geometry("820x420")
+        picker = VirtualTreeview(window, [
+            ('device', '设备名', 150), ('line', '线路名', 150), ('line_ip', '线路IP', 130),
+            ('device_ip', '设备IP', 130), ('site', '站点', 110), ('isp', '运营商', 110),
+        ], height=15, filter_delay=80)
+        picker.frame.pack(fill=tk.BOTH, expand=True, padx=layout_padx, pady=layout_pady)
+        picker.set_rows(self.inventory)
+
+        def choose(event=None):
+            row = picker.selected_row()
+            if row is None:
+                return
+            window.destroy()
+            self.select_device_line(row[0], row[1])
+
+        def focus_results(event=None):
+            children = picker.tree.get_children()
+            if children:
+                picker.tree.focus_set()
+                picker.tree.selection_set(children[0])
+                picker.tree.focus(children[0])
+
+        picker.tree.bind('<Double-1>', choose)
+        picker.tree.bind('<Return>', choose)
+        picker.filter_entry.bind('<Down>', focus_results)
+        picker.filter_entry.bind('<Return>', lambda event: (focus_results(), choose()))
+        window.bind('<Escape>', lambda event: window.destroy())
+        picker.filter_entry.focus_set()
+
+    def select_device_line(self, device_name, line_name):
+        """选中设备和线路，与在下拉框中依次选择相同"""
+        if device_name != self.current_device_name:
+            self.device_combo.set(device_name)
+            self.on_device_select()
+        self.line_combo.set(line_name)
+        self.on_line_select()
 
     def validate_input(self):
         if not self.current_device_info:
@@ -1163,66 +1681,35 @@ class JuniperRouteQueryApp:
         return True
 
     def get_selected_line_ip(self):
-        selected_line = self.line_combo.get()
-        for line in self.current_device_info['lines']:
-            if line['line_name'] == selected_line:
-                return line['line_ip']
-        return ''
+        line = self.inventory.line(self.current_device_name, self.line_combo.get())
+        return line['line_ip'] if line else ''
 
     def close_ssh_session(self):
-        """关闭当前SSH会话"""
-        if self.current_ssh_session:
-            try:
-                if self.current_shell:
-                    self.current_shell.close()
-                    self.current_shell = None
-                self.current_ssh_session.close()
-                self.current_ssh_session = None
+        """关闭当前设备的SSH会话"""
+        try:
+            if self.current_device_name and self.ssh_pool.close(self.current_device_name):
                 self.append_output("\n🚨SSH会话已关闭\n")
-            except Exception as e:
-                self.append_output(f"⚠ 关闭SSH会话时出错: {str(e)}\n")
-
-    def establish_ssh_session(self):
-        """建立SSH会话"""
-        if self.current_ssh_session and self.current_ssh_session.get_transport() and self.current_ssh_session.get_transport().is_active():
-            return True  # 会话已存在且活跃
+        except Exception as e:
+            self.append_output(f"⚠ 关闭SSH会话时出错: {str(e)}\n")
 
+    def establish_ssh_session(self, device_name=None):
+        """从连接池获取设备的SSH会话，会话失效时自动重连；失败时返回None"""
+        device_name = device_name or self.current_device_name
         try:
-            self.append_output(f"正在连接设备 {self.current_device_info['ip']}:{self.current_device_info['port']}...\n")
-
-            # 创建SSH客户端
-            self.current_ssh_session = paramiko.SSHClient()
-            self.current_ssh_session.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-            # 连接设备
-            self.current_ssh_session.connect(
-                hostname=self.current_device_info['ip'],
-                port=self.current_device_info['port'],
-                username=self.current_device_info['username'],
-                password=self.current_device_info['password'],
-                timeout=10
-            )
-
-            # 获取shell
-            self.current_shell = self.current_ssh_session.invoke_shell()
-            self.append_output(f"\n✅ 已成功连接到设备: {self.current_device_info['ip']}\n")
-            # self.current_shell.recv(65535)
-            return True
+            return self.ssh_pool.acquire(device_name, self.devices[device_name])
         except paramiko.AuthenticationException:
             self.append_output("\n🔒 认证失败：用户名或密码错误\n")
-            return False
+            return None
         except paramiko.SSHException as e:
             self.append_output(f"\n🚨 SSH连接异常：{str(e)}\n")
-            return False
+            return None
         except Exception as e:
             self.append_output(f"SSH连接失败: {str(e)}\n")
-            self.close_ssh_session()
-            return False
+            self.ssh_pool.close(device_name)
+            return None
 
     # 路由表查询功能
     def route_table_query(self):
-        if self.query_in_progress:
-            return
         if not self.validate_input():
             return
 
@@ -1231,12 +1718,14 @@ class JuniperRouteQueryApp:
             messagebox.showerror("错误", "请输入要查询的IP段")
             return
 
-        command = f'show route {ip_range}|no-more'
-        self.start_query(command)
+        if self.structured_mode.get():
+            self.start_route_records_query(route_query_command(ip_range, structured=True))
+            return
+
+        command = route_query_command(ip_range)
+        self.start_route_text_query(command)
 
     def route_table_extensive_query(self):
-        if self.query_in_progress:
-            return
         if not self.validate_input():
             return
 
@@ -1245,13 +1734,11 @@ class JuniperRouteQueryApp:
             messagebox.showerror("错误", "请输入要查询的IP段")
             return
 
-        command = f'show route {ip_range} extensive|no-more'
+        command = route_query_command(ip_range, extensive=True)
         self.start_query(command)
 
     # 发布路由查询功能
     def advertise_normal_query(self):
-        if self.query_in_progress:
-            return
         if not self.validate_input():
             return
 
@@ -1261,12 +1748,14 @@ class JuniperRouteQueryApp:
             messagebox.showerror("错误", "请输入要查询的IP段")
             return
 
-        command = f'show route {ip_range} advertising-protocol bgp {line_ip}|no-more'
-        self.start_query(command)
+        if self.structured_mode.get():
+            self.start_route_records_query(route_query_command(ip_range, line_ip, 'advertising', structured=True))
+            return
+
+        command = route_query_command(ip_range, line_ip, 'advertising')
+        self.start_route_text_query(command)
 
     def advertise_extensive_query(self):
-        if self.query_in_progress:
-            return
         if not self.validate_input():
             return
 
@@ -1276,13 +1765,11 @@ class JuniperRouteQueryApp:
             messagebox.showerror("错误", "请输入要查询的IP段")
             return
 
-        command = f'show route {ip_range} advertising-protocol bgp {line_ip} extensive|no-more'
+        command = route_query_command(ip_range, line_ip, 'advertising', extensive=True)
         self.start_query(command)
 
     # 接收路由查询功能
     def receive_normal_query(self):
-        if self.query_in_progress:
-            return
         if not self.validate_input():
             return
 
@@ -1292,12 +1779,14 @@ class JuniperRouteQueryApp:
             messagebox.showerror("错误", "请输入要查询的IP段")
             return
 
-        command = f'show route {ip_range} receive-protocol bgp {line_ip}|no-more'
-        self.start_query(command)
+        if self.structured_mode.get():
+            self.start_route_records_query(route_query_command(ip_range, line_ip, 'receive', structured=True))
+            return
+
+        command = route_query_command(ip_range, line_ip, 'receive')
+        self.start_route_text_query(command)
 
     def receive_extensive_query(self):
-        if self.query_in_progress:
-            return
         if not self.validate_input():
             return
 
@@ -1307,92 +1796,318 @@ class JuniperRouteQueryApp:
             messagebox.showerror("错误", "请输入要查询的IP段")
             return
 
-        command = f'show route {ip_range} receive-protocol bgp {line_ip} extensive|no-more'
+        command = route_query_command(ip_range, line_ip, 'receive', extensive=True)
         self.start_query(command)
 
-    def start_query(self, command):
-        self.output_text.config(state='normal')
-        self.output_text.delete(1.0, tk.END)
-        self.output_text.insert(tk.END, f"执行命令: {command}\n")
-        self.output_text.see(tk.END)
-        self.output_text.config(state='disabled')
+    def start_query(self, command, parser=None, callback=None, priority=PRIORITY_QUERY):
+        """把查询提交到当前设备的命令队列，返回Future。前面有任务时排队等待，开始执行时才清空输出"""
+        command_queue = self.get_command_queue()
+        self.status_var.set("查询排队中..." if command_queue.busy else "查询中...")
+
+        def job(session):
+            self.output.clear()
+            self.output.write(f"执行命令: {command}\n")
+            self.root.after(0, lambda: self.status_var.set("查询中..."))
+            return self.execute_ssh_command(session, command, parser, callback)
+
+        return command_queue.submit(job, priority)
+
+    def get_command_queue(self, device_name=None):
+        """返回设备的命令队列，不存在时创建"""
+        device_name = device_name or self.current_device_name
+        command_queue = self.command_queues.get(device_name)
+        if command_queue is None:
+            command_queue = DeviceCommandQueue(
+                device_name,
+                connect=lambda: self.establish_ssh_session(device_name),
+                on_failure=lambda e: self.report_queue_failure(device_name, e),
+                release=self.ssh_pool.release
+            )
+            self.command_queues[device_name] = command_queue
+        return command_queue
+
+    def cancel_pending_queries(self):
+        """取消当前设备队列中尚未开始的任务"""
+        command_queue = self.command_queues.get(self.current_device_name)
+        cancelled = command_queue.cancel_pending() if command_queue else 0
+        self.status_var.set(f"已取消 {cancelled} 个排队任务")
+
+    def report_queue_failure(self, device_name, error):
+        """队列任务失败时显示原因；超时或传输层出错时通道状态未知，关闭该设备会话，下一个任务会重新连接"""
+        if isinstance(error, CliTimeoutError):
+            message = f"⚠ 命令执行超时({error.timeout}秒)，未检测到设备提示符"
+        elif isinstance(error, ET.ParseError):
+            message = f"⚠ XML解析失败: {str(error)}"
+        else:
+            message = f"⚠ 发生错误: {str(error)}"
+        self.append_output(f"\n{message}\n")
+        self.root.after(0, lambda: self.status_var.set(f"{device_name}: {message}"))
+        # 配置错误、数据库被锁定、XML解析失败等情况通道仍停在提示符，继续复用会话
+        if isinstance(error, (CliTimeoutError, paramiko.SSHException, OSError, EOFError)):
+            self.ssh_pool.close(device_name)
+
+    def start_route_records_query(self, command):
+        """结构化路由查询，结果格式化为表格显示"""
+        self.start_query(command, parser=JunosXmlStream(parse_route_element), callback=self.show_route_records)
+
+    def start_route_text_query(self, command):
+        """文本路由查询，原始输出照常显示，解析出的路由同时填入查询结果列表"""
+        self.start_query(command, parser=RouteTextParser(), callback=self.show_route_grid)
+
+    def fetch_all_config(self, force=False):
+        """获取完整配置并单遍解析，结果同时填充公网线路、强制线路、路由发布、黑洞路由四个标签页。
+        设备最近一次提交未变化时直接使用缓存，force为True时总是重新获取"""
+        structured = self.structured_mode.get()
+        device_name = self.current_device_name
+        command_queue = self.get_command_queue()
+        self.status_var.set("获取配置排队中..." if command_queue.busy else "正在获取配置...")
+
+        def job(session):
+            # 开始执行时才清空输出，不影响排在前面的任务
+            self.output.clear()
+            self.root.after(0, lambda: self.status_var.set("正在获取配置..."))
+            return self.fetch_config_job(session, device_name, structured, force)
+
+        future = command_queue.submit(job, PRIORITY_QUERY)
+
+        def done(future):
+            # 失败原因已由report_queue_failure显示
+            if future.cancelled():
+                self.status_var.set("就绪")
+            elif future.exception() is None:
+                self.status_var.set("✅配置获取完成")
+
+        future.add_done_callback(lambda f: self.root.after(0, lambda: done(f)))
+        return future
+
+    def fetch_config_job(self, session, device_name, structured=False, force=False):
+        """在队列线程中执行：先比较最近提交记录，有变化时才边接收边解析配置，返回ConfigModel"""
+        start_time = time.time()
+        commit_id = read_commit_id(session['cli'])
+        cached = self.config_cache.get(device_name)
+        if not force and commit_id and cached and cached['commit_id'] == commit_id:
+            # 快照或缓存与设备一致，无需重新下载
+            model = cached['model']
+            cached['saved_at'] = time.time()
+            cached['stale'] = False
+            self.append_output(f"\n✅配置未变化(最近提交: {commit_id})，使用缓存: {model.summary()}\n")
+        else:
+            model = download_config(session['cli'], structured, log=self.append_output)
+            cached = self.config_cache[device_name] = {'commit_id': commit_id, 'saved_at': time.time(), 'model': model}
+            self.append_output(f"\n✅配置获取完成，耗时 {time.time() - start_time:.2f}秒: {model.summary()}\n")
+        # 在队列线程中预先建好网段索引，界面上的网段搜索无需等待
+        model.prefix_index()
+        if commit_id:
+            self.snapshot_store.save(device_name, commit_id, model, cached['saved_at'])
+
+        def show():
+            if device_name == self.current_device_name:
+                self.apply_config_model(model)
+                self.show_config_freshness(device_name, cached)
+
+        self.root.after(0, show)
+        return model
+
+    def load_config_snapshot(self, device_name):
+        """选择设备时立即用缓存或本地快照填充配置标签页，并在后台比对设备最近的提交"""
+        cached = self.config_cache.get(device_name)
+        if cached is None:
+            cached = self.snapshot_store.load(device_name)
+            if cached is None:
+                self.config_freshness.set("配置: 未获取")
+                return
+            self.config_cache[device_name] = cached
+        cached['stale'] = True
+        self.apply_config_model(cached['model'])
+        self.show_config_freshness(device_name, cached)
+
+        structured = self.structured_mode.get()
+        future = self.get_command_queue(device_name).submit(
+            lambda session: self.fetch_config_job(session, device_name, structured),
+            PRIORITY_POLL
+        )
+
+        def done(future):
+            if device_name != self.current_device_name or future.cancelled():
+                return
+            if future.exception() is not None:
+                self.config_freshness.set("配置: 快照(校验失败)")
 
-        self.query_in_progress = True
-        self.status_var.set("查询中...")
+        future.add_done_callback(lambda f: self.root.after(0, lambda: done(f)))
 
-        # 在新线程中执行SSH命令
-        threading.Thread(
-            target=self.execute_ssh_command,
-            args=(command,),
-            daemon=True
-        ).start()
+    def show_config_freshness(self, device_name, cached):
+        """在设备选择栏显示配置标签页数据是快照(待校验)还是已与设备一致"""
+        saved_at = datetime.fromtimestamp(cached['saved_at']).strftime('%m-%d %H:%M')
+        if cached.get('stale'):
+            self.config_freshness.set(f"配置: 快照 {saved_at}(校验中)")
+        else:
+            self.config_freshness.set(f"配置: 最新 {saved_at}")
+
+    def apply_config_model(self, model):
+        """把配置模型填充到四个配置管理标签页，保留各标签页原来的选择"""
+        self.config_model = model
+        tab_configs = {
+            'line': model.prefix_lists,
+            'outside': model.firewall_filters.get(fbf_filter_name, {}),
+            'route': model.static_routes,
+            'bh': {prefix: {'discard': None} for prefix in model.discard_routes},
+        }
+        for tab, config in tab_configs.items():
+            state = self.save_tab_state(tab)
+            setattr(self, f"{tab}_prefix_list_dict", {name: list(values) for name, values in config.items()})
+            setattr(self, f"{tab}_selected_prefix", None)
+            setattr(self, f"{tab}_selected_ips", [])
+            getattr(self, f"{tab}_update_prefix_list_ui")()
+            getattr(self, f"{tab}_restore_state_after_refresh")(state)
+        self.status_var.set("配置已刷新")
+
+    def search_config_prefix(self):
+        """在当前设备的配置中查找覆盖、最长匹配以及被包含的网段"""
+        query = self.prefix_search_entry.get().strip()
+        if not query:
+            return
+        if self.config_model is None:
+            messagebox.showwarning("警告", "请先获取设备配置")
+            return
+        try:
+            index = self.config_model.prefix_index()
+            covering = index.covering(query)
+            more_specifics = index.more_specifics(query)
+        except ValueError:
+            messagebox.showerror("错误", f"无效的地址或网段: {query}")
+            return
+
+        lines = [f"\n网段搜索: {query} (配置中共{index.count}个网段)"]
+        if covering:
+            longest = covering[-1][0]
+            lines.append("覆盖该网段的配置(从粗到细):")
+            lines.extend(f"  {'*' if prefix == longest else ' '} {prefix:<20} {kind:<12} {name}"
+                         for prefix, (kind, name) in covering)
+        if more_specifics:
+            lines.append(f"包含在该网段内的配置({len(more_specifics)}条):")
+            lines.extend(f"    {prefix:<20} {kind:<12} {name}" for prefix, (kind, name) in more_specifics)
+        if not covering and not more_specifics:
+            lines.append("没有与该网段重叠的配置")
+        self.append_output("\n".join(lines) + "\n")
+        self.status_var.set(f"网段搜索: 覆盖 {len(covering)} 条, 包含 {len(more_specifics)} 条")
+
+    def save_tab_state(self, tab):
+        """保存配置管理标签页的选择和滚动位置，tab为 line/outside/route/bh"""
+        return {
+            f'{tab}_selected_prefix': getattr(self, f"{tab}_selected_prefix", None),
+            f'{tab}_selected_ips': list(getattr(self, f"{tab}_selected_ips", [])),
+            'scroll_position': getattr(self, f"{tab}_name_listbox").yview(),
+            'ip_scroll_position': getattr(self, f"{tab}_ip_listbox").yview()
+        }
 
-    def execute_ssh_command(self, command):
+    def execute_ssh_command(self, session, command, parser=None, callback=None):
+        """在队列线程中执行查询命令，返回输出(结构化模式下返回记录列表)"""
         try:
-            # 确保SSH会话已建立
-            if not self.establish_ssh_session():
-                raise Exception("⚠ 无法建立SSH连接")
-
-            # 获取shell
-            shell = self.current_shell
-
-            # 发送命令
-            # self.append_output(f"执行命令: {command}\n")
-            shell.send(command + '\n')
-            time.sleep(2)
-
-            # 读取输出
-            output = ""
-            while True:
-                if shell.recv_ready():
-                    data = shell.recv(65535).decode('utf-8', errors='ignore')
-                    output += data
-                    output = output.replace('\r', '')
-                    self.append_output(data)
-
-                    # 检查命令是否结束
-                    if '>' in data or '#' in data:
-                        break
-                else:
-                    break
+            if isinstance(parser, RouteTextParser):
+                # 文本模式：照常回显原始输出，同时逐行解析为路由记录
+                session['cli'].run(command, on_data=self.append_output, on_line=parser.add_line)
+                records = parser.finish()
+                self.append_output(f"\n✅查询完成，解析到 {len(records)} 条路由。\n")
+                self.root.after(0, lambda: callback(records))
+                return records
+
+            if parser:
+                # 结构化模式：数据到达时增量解析，不回显原始XML
+                records = []
+                output = session['cli'].run(command, on_data=lambda data: records.extend(parser.feed(data)))
+                if not parser.started:
+                    # 设备未返回XML(如命令错误)，显示原始输出
+                    self.append_output(output)
+                    raise Exception("⚠ 设备未返回XML格式输出")
+                self.append_output(f"\n✅查询完成，解析到 {len(records)} 条记录。\n")
+                self.root.after(0, lambda: callback(records))
+                return records
+
+            # 发送命令并读取输出，直到设备提示符重新出现
+            output = session['cli'].run(command, on_data=self.append_output)
 
             self.append_output("\n✅查询完成。\n")
             # 执行回调
-            if hasattr(self, 'current_callback') and callable(self.current_callback):
-                self.root.after(0, lambda: self.current_callback(output))
+            if callable(callback):
+                self.root.after(0, lambda: callback(output))
+            return output
 
-        except Exception as e:
-            self.append_output(f"\n⚠ 发生错误: {str(e)}\n")
-            self.close_ssh_session()
         finally:
-            self.query_complete()
+            # 失败原因由report_queue_failure统一显示
+            timing = session['cli'].last_timing
+            self.root.after(0, lambda: self.query_complete(timing))
+
+    def show_route_records(self, records):
+        """显示结构化路由查询结果"""
+        self.show_route_grid(records)
+        if not records:
+            self.append_output("未查询到路由\n")
+            return
+        self.append_output(format_route_records(records))
+
+    def show_route_grid(self, records):
+        """把路由记录填入查询结果列表并切换到该标签页"""
+        self.route_grid.set_rows(
+            ('*' if r.active else '', r.prefix, r.protocol, r.preference, r.next_hop, r.interface,
+             r.as_path, r.local_pref, r.med, r.age, ' '.join(r.communities))
+            for r in records
+        )
+        if records:
+            self.notebook.select(self.route_grid_tab)
+        self.status_var.set(f"查询完成，共 {len(records)} 条路由")
 
     def append_output(self, text):
-        # 使用after方法确保GUI更新在主线程中执行
-        self.root.after(0, lambda: self._append_output_helper(text))
-
-    def _append_output_helper(self, text):
-        self.output_text.config(state='normal')
-        self.output_text.insert(tk.END, text)
-        self.output_text.see(tk.END)
-        self.output_text.config(state='disabled')
-        # 将文本追加到日志文件
-        self.log_to_file(text)
+        # 写入输出缓冲，由主线程定时合并刷新到文本框并写入日志
+        self.output.write(text)
 
-    def query_complete(self):
-        self.query_in_progress = False
-        self.status_var.set("✅查询完成")
+    def query_complete(self, timing=None):
+        if not timing:
+            self.status_var.set("✅查询完成")
+            return
+        first_byte = f"首字节 {timing['first_byte']:.2f}秒, " if timing['first_byte'] is not None else ""
+        self.status_var.set(f"✅查询完成: {first_byte}总计 {timing['total']:.2f}秒, "
+                            f"{timing['bytes'] / 1024:.0f}KB, 解析 {timing['parse']:.2f}秒")
+
+    def export_metrics(self):
+        """在后台线程导出耗时记录，不阻塞界面"""
+        threading.Thread(target=spans.export, daemon=True).start()
+        self.root.after(metrics_export_interval * 1000, self.export_metrics)
+
+    def show_metrics(self):
+        """显示最近的各阶段耗时记录，可按设备、阶段或命令过滤和按耗时排序"""
+        window = tk.Toplevel(self.root)
+        window.title("耗时统计")
+        window.geometry("900x450")
+        grid = VirtualTreeview(window, [
+            ('time', '时间', 130), ('device', '设备', 120), ('span', '阶段', 90), ('command', '命令', 300),
+            ('seconds', '耗时(秒)', 80), ('bytes', '字节数', 80), ('status', '状态', 60),
+        ], height=18)
+        grid.frame.pack(fill=tk.BOTH, expand=True, padx=layout_padx, pady=layout_pady)
+        grid.set_rows(
+            (datetime.fromtimestamp(r['time']).strftime('%m-%d %H:%M:%S'), r['device'] or '', r['span'],
+             r['command'] or '', f"{r['seconds']:.3f}", str(r.get('bytes', '')), r['status'])
+            for r in spans.recent(limit=metrics_ring_size)
+        )
+        ttk.Label(window, text=f"定期导出到 {metrics_prometheus_file} 和 {metrics_jsonl_file}",
+                  foreground="gray").pack(anchor=tk.W, padx=layout_padx)
+
+    def toggle_profiling(self):
+        """开启后每次查询/巡检生成CPU和内存分析报告；关闭时另出界面主线程的报告(Python 3.11及以下)"""
+        if self.profile_var.get():
+            profiler.enable()
+            self.append_output(f"\n📊 性能分析已开启，报告保存在 {profile_dir} 目录\n")
+        else:
+            profiler.disable()
 
     def log_to_file(self, text):
-        try:
-            with open('query_log.txt', 'a', encoding='utf-8') as log_file:
-                log_file.write(text)
-        except Exception as e:
-            self.append_output(f"⚠ 日志写入失败: {str(e)}\n")
+        # 只放入日志队列，由后台线程写盘
+        self.session_logger.write(text)
 
     def save_result(self):
         """保存查询结果到文件"""
-        if not self.output_text.get(1.0, tk.END).strip():
+        # 文本框可能已被裁剪，保存完整输出
+        result = self.output.full_text()
+        if not result.strip():
             messagebox.showwarning("⚠️ 警告", "⚠ 没有查询结果可保存")
             return
 
@@ -1409,14 +2124,29 @@ class JuniperRouteQueryApp:
         if file_path:
             try:
                 with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(self.output_text.get(1.0, tk.END))
+                    f.write(result)
                 messagebox.showinfo("成功", f"✅ 结果已保存到:\n{file_path}")
             except Exception as e:
                 messagebox.showerror("错误", f"⚠ 保存文件时出错:\n{str(e)}")
 
-    def __del__(self):
-        """析构函数，确保程序退出时关闭SSH连接"""
-        self.close_ssh_session()
+    def close_window(self):
+        self.shutdown()
+        self.root.destroy()
+
+    def shutdown(self):
+        """程序退出时关闭SSH连接、写出剩余输出和日志、性能分析报告、耗时记录，可重复调用"""
+        if self._shut_down:
+            return
+        self._shut_down = True
+        for command_queue in self.command_queues.values():
+            command_queue.shutdown()
+        self.ssh_pool.close_all()
+        # 关闭性能分析时输出的报告路径要在输出关闭前写入
+        profiler.disable()
+        self.output.close()
+        self.snapshot_store.close()
+        self.session_logger.close()
+        spans.export()
 
     def cmd_on_prefix_select(self, event):
         """处理cmd_prefix-list选择事件"""
@@ -1443,36 +2173,8 @@ class JuniperRouteQueryApp:
         if not self.validate_input():
             return
 
-        command = "show configuration firewall filter inside-outside-fbf|display set |no-more "
-        self.current_callback = self.outside_process_prefix_list_config
-        self.start_query(command)
-
-    def outside_process_prefix_list_config(self, output):
-        """Process term configuration (route)"""
-        try:
-            pattern = r"set firewall filter inside-outside-fbf term (\S+) from source-address (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/\d{1,2})"
-            self.outside_prefix_list_dict = {}
-            self.outside_selected_prefix = None
-            self.outside_selected_ips = []
-
-            for line in output.splitlines():
-                line = line.strip()
-                if not line:
-                    continue
-                match = re.match(pattern, line)
-                if match:
-                    term_name = match.group(1)
-                    source_address = match.group(2)
-                    if term_name in self.outside_prefix_list_dict:
-                        if source_address not in self.outside_prefix_list_dict[term_name]:
-                            self.outside_prefix_list_dict[term_name].append(source_address)
-                    else:
-                        self.outside_prefix_list_dict[term_name] = [source_address]
-
-            self.outside_update_prefix_list_ui()
-
-        except Exception as e:
-            messagebox.showerror("错误", f"处理配置时出错：{str(e)}")
+        # 一次获取完整配置，同时刷新全部配置管理标签页
+        self.fetch_all_config()
 
     def outside_update_prefix_list_ui(self):
         """Update term UI (route)"""
@@ -1525,11 +2227,8 @@ class JuniperRouteQueryApp:
             messagebox.showwarning("警告", "每个term必须至少保留一个IP地址")
             return
 
-        commands = []
-        for ip in self.outside_selected_ips:
-            if ip != "1.1.1.1/32":
-                cmd = f"delete  firewall filter inside-outside-fbf term  {self.outside_selected_prefix} from source-address  {ip}"
-                commands.append(cmd)
+        commands = firewall_source_commands(
+            "delete", self.outside_selected_prefix, [ip for ip in self.outside_selected_ips if ip != "1.1.1.1/32"])
 
         if not commands:
             messagebox.showinfo("提示", "没有有效的IP地址需要删除")
@@ -1537,7 +2236,6 @@ class JuniperRouteQueryApp:
 
         self.outside_display_commands(commands)
         self.execute_config_commands(commands)
-        self.root.after(3000, lambda: self.outside_refresh_prefix_list())
 
     def outside_add_new_ips(self):
         """Add new IPs (route)"""
@@ -1546,49 +2244,25 @@ class JuniperRouteQueryApp:
             return
 
         new_ips = self.outside_ip_text.get("1.0", tk.END).strip().splitlines()
-        ip_pattern = r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/\d{1,2}$"
-        valid_ips = [ip for ip in new_ips if re.match(ip_pattern, ip.strip())]
+        valid_ips, invalid_ips = split_prefixes(new_ips, versions=(4,))
 
-        if not valid_ips:
-            messagebox.showwarning("警告", "无效的IP地址格式")
+        if invalid_ips or not valid_ips:
+            messagebox.showwarning("警告", "无效的IP地址格式:\n" + "\n".join(invalid_ips[:10]))
             return
 
-        commands = [f"set firewall filter inside-outside-fbf  term {self.outside_selected_prefix} from source-address {ip}" for ip in valid_ips]
+        commands = firewall_source_commands("set", self.outside_selected_prefix, valid_ips)
         self.outside_display_commands(commands)
         self.execute_config_commands(commands)
         self.outside_ip_text.delete("1.0", tk.END)
-        self.root.after(3000, lambda: self.outside_refresh_prefix_list())
-
-    def outside_refresh_prefix_list(self):
-        """Refresh configuration (route)"""
-        try:
-            state = {
-                'outside_selected_prefix': self.outside_selected_prefix,
-                'outside_selected_ips': self.outside_selected_ips.copy(),
-                'scroll_position': self.outside_name_listbox.yview(),
-                'ip_scroll_position': self.outside_ip_listbox.yview()
-            }
-            self.status_var.set("正在刷新配置...")
-            self.outside_fetch_prefix_list_config()
-            self.root.after(1500, lambda: self.outside_restore_state_after_refresh(state))
-        except Exception as e:
-            self.status_var.set(f"刷新失败: {str(e)}")
 
     def outside_display_commands(self, commands):
         """Display commands (route)"""
         self.outside_cmd_output.config(state='normal')
         self.outside_cmd_output.insert(tk.END, "\n将要执行的命令:\n")
-        for cmd in commands:
-            self.outside_cmd_output.insert(tk.END, f"{cmd}\n")
+        self.outside_cmd_output.insert(tk.END, "".join(f"{cmd}\n" for cmd in commands))
         self.outside_cmd_output.see(tk.END)
         self.outside_cmd_output.config(state='disabled')
 
-    def outside_commit_config_changes(self):
-        """Commit configuration (route)"""
-        commands = ["commit"]
-        self.execute_config_commands(commands)
-
-
     def outside_restore_state_after_refresh(self, state):
         """从保存的状态恢复UI"""
         try:
@@ -1613,50 +2287,13 @@ class JuniperRouteQueryApp:
             self.bh_cmd_output.insert(tk.END, f"恢复状态时出错: {str(e)}")
             self.status_var.set("部分状态恢复失败")
 
-
     def route_fetch_prefix_list_config(self):
         """Fetch current router-list configuration (route)"""
         if not self.validate_input():
             return
 
-        command = "show configuration routing-options static |display set |no-more "
-        self.current_callback = self.route_process_prefix_list_config
-        self.start_query(command)
-
-    def route_process_prefix_list_config(self, output):
-        """Process router-list configuration (route)"""
-        try:
-            pattern = r"""
-            ^set\ routing-options\ static\ route\s+      # 固定开头
-            (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/\d{1,2})  # 目标IP段
-            .*?                                         # 中间任意内容
-            (?:next-hop|qualified-next-hop)\s+          # 两种下一跳类型
-            (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})       # 下一跳IP
-            """
-            # 编译正则表达式（带注释模式）
-            regex = re.compile(pattern, re.VERBOSE)
-            self.route_prefix_list_dict = {}
-            self.route_selected_prefix = None
-            self.route_selected_ips = []
-
-            for line in output.splitlines():
-                line = line.strip()
-                if not line:
-                    continue
-                match =regex.search(line)
-                if match:
-                    prefix_name = match.group(1)
-                    ip_address = match.group(2)
-                    if prefix_name in self.route_prefix_list_dict:
-                        if ip_address not in self.route_prefix_list_dict[prefix_name]:
-                            self.route_prefix_list_dict[prefix_name].append(ip_address)
-                    else:
-                        self.route_prefix_list_dict[prefix_name] = [ip_address]
-
-            self.route_update_prefix_list_ui()
-
-        except Exception as e:
-            messagebox.showerror("错误", f"处理配置时出错：{str(e)}")
+        # 一次获取完整配置，同时刷新全部配置管理标签页
+        self.fetch_all_config()
 
     def route_update_prefix_list_ui(self):
         """Update router-list UI (route)"""
@@ -1703,9 +2340,7 @@ class JuniperRouteQueryApp:
             return
 
 
-        commands = []
-        cmd = f"delete  routing-options static route {self.route_selected_prefix} "
-        commands.append(cmd)
+        commands = [delete_static_route_command(self.route_selected_prefix)]
 
         if not commands:
             messagebox.showinfo("提示", "没有有效的路由段需要删除")
@@ -1713,59 +2348,32 @@ class JuniperRouteQueryApp:
 
         self.route_display_commands(commands)
         self.execute_config_commands(commands)
-        self.root.after(3000, lambda: self.route_refresh_prefix_list())
 
     def route_add_new_ips(self):
 
         new_ips = self.route_ip_text.get("1.0", tk.END).strip().splitlines()
-        ip_pattern = r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/\d{1,2}$"
-        valid_ips = [ip for ip in new_ips if re.match(ip_pattern, ip.strip())]
+        valid_ips, invalid_ips = split_prefixes(new_ips, versions=(4,))
 
-        if not valid_ips:
-            messagebox.showwarning("警告", "无效的路由段格式")
+        if invalid_ips or not valid_ips:
+            messagebox.showwarning("警告", "无效的路由段格式:\n" + "\n".join(invalid_ips[:10]))
             return
 
         commands = []
         for ip in valid_ips:
-            # 此处命令以实际为准，可以只有一条，也可以添加tag、as-path、community等静态路由属性。
-            commands.append(f"set routing-options static route {ip} next-hop 192.168.1.1")
-            commands.append(f"set routing-options static route {ip} tag 888")
+            commands.extend(static_route_commands(ip))
 
         self.route_display_commands(commands)
         self.execute_config_commands(commands)
         self.route_ip_text.delete("1.0", tk.END)
-        self.root.after(3000, lambda: self.route_refresh_prefix_list())
-
-    def route_refresh_prefix_list(self):
-        """Refresh configuration (route)"""
-        try:
-            state = {
-                'route_selected_prefix': self.route_selected_prefix,
-                'route_selected_ips': self.route_selected_ips.copy(),
-                'scroll_position': self.route_name_listbox.yview(),
-                'ip_scroll_position': self.route_ip_listbox.yview()
-            }
-            self.status_var.set("正在刷新配置...")
-            self.route_fetch_prefix_list_config()
-            self.root.after(1500, lambda: self.route_restore_state_after_refresh(state))
-        except Exception as e:
-            self.status_var.set(f"刷新失败: {str(e)}")
 
     def route_display_commands(self, commands):
         """Display commands (route)"""
         self.route_cmd_output.config(state='normal')
         self.route_cmd_output.insert(tk.END, "\n将要执行的命令:\n")
-        for cmd in commands:
-            self.route_cmd_output.insert(tk.END, f"{cmd}\n")
+        self.route_cmd_output.insert(tk.END, "".join(f"{cmd}\n" for cmd in commands))
         self.route_cmd_output.see(tk.END)
         self.route_cmd_output.config(state='disabled')
 
-    def route_commit_config_changes(self):
-        """Commit configuration (route)"""
-        commands = ["commit"]
-        self.execute_config_commands(commands)
-
-
     def route_restore_state_after_refresh(self, state):
         """从保存的状态恢复UI"""
         try:
@@ -1794,36 +2402,8 @@ class JuniperRouteQueryApp:
         if not self.validate_input():
             return
 
-        command = 'show configuration routing-options|display set |match "discard"|no-more '
-        self.current_callback = self.bh_process_prefix_list_config
-        self.start_query(command)
-
-    def bh_process_prefix_list_config(self, output):
-        """Process BHr-list configuration (BH)"""
-        try:
-            pattern = r"set routing-options static route (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/\d{1,2}) (discard)"
-            self.bh_prefix_list_dict = {}
-            self.bh_selected_prefix = None
-            self.bh_selected_ips = []
-
-            for line in output.splitlines():
-                line = line.strip()
-                if not line:
-                    continue
-                match = re.match(pattern, line)
-                if match:
-                    prefix_name = match.group(1)
-                    ip_address = match.group(2)
-                    if prefix_name in self.bh_prefix_list_dict:
-                        if ip_address not in self.bh_prefix_list_dict[prefix_name]:
-                            self.bh_prefix_list_dict[prefix_name].append(ip_address)
-                    else:
-                        self.bh_prefix_list_dict[prefix_name] = [ip_address]
-
-            self.bh_update_prefix_list_ui()
-
-        except Exception as e:
-            messagebox.showerror("错误", f"处理配置时出错：{str(e)}")
+        # 一次获取完整配置，同时刷新全部配置管理标签页
+        self.fetch_all_config()
 
     def bh_update_prefix_list_ui(self):
         """Update BHr-list UI (BH)"""
@@ -1870,9 +2450,7 @@ class JuniperRouteQueryApp:
             return
 
 
-        commands = []
-        cmd = f"delete  routing-options static route  {self.bh_selected_prefix} "
-        commands.append(cmd)
+        commands = [delete_static_route_command(self.bh_selected_prefix)]
 
         if not commands:
             messagebox.showinfo("提示", "没有有效的路由段需要删除")
@@ -1880,62 +2458,35 @@ class JuniperRouteQueryApp:
 
         self.bh_display_commands(commands)
         self.execute_config_commands(commands)
-        self.root.after(3000, lambda: self.bh_refresh_prefix_list())
 
     def bh_add_new_ips(self):
 
         new_ips = self.bh_ip_text.get("1.0", tk.END).strip().splitlines()
-        ip_pattern = r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/\d{1,2}$"
-        valid_ips = [ip for ip in new_ips if re.match(ip_pattern, ip.strip())]
+        valid_ips, invalid_ips = split_prefixes(new_ips, versions=(4,))
 
         commands = []
-        if not valid_ips:
-            messagebox.showwarning("警告", "无效的路由段格式")
+        if invalid_ips or not valid_ips:
+            messagebox.showwarning("警告", "无效的路由段格式:\n" + "\n".join(invalid_ips[:10]))
             return
         for ip in valid_ips:
-            if '/32' not in ip:
+            if not ip.endswith('/32'):
                 messagebox.showwarning("警告", "只能是32位地址")
                 return
             else:
-                # 黑洞路由功能自定义，可以添加指定的tag、community等属性。
-                commands.append(f"set routing-options static route {ip} discard")
-                commands.append(f"set routing-options static route {ip} tag description")
+                commands.extend(discard_route_commands(ip))
 
         self.bh_display_commands(commands)
         self.execute_config_commands(commands)
         self.bh_ip_text.delete("1.0", tk.END)
-        self.root.after(3000, lambda: self.bh_refresh_prefix_list())
-
-    def bh_refresh_prefix_list(self):
-        """Refresh configuration (BH)"""
-        try:
-            state = {
-                'bh_selected_prefix': self.bh_selected_prefix,
-                'bh_selected_ips': self.bh_selected_ips.copy(),
-                'scroll_position': self.bh_name_listbox.yview(),
-                'ip_scroll_position': self.bh_ip_listbox.yview()
-            }
-            self.status_var.set("正在刷新配置...")
-            self.bh_fetch_prefix_list_config()
-            self.root.after(1500, lambda: self.bh_restore_state_after_refresh(state))
-        except Exception as e:
-            self.status_var.set(f"刷新失败: {str(e)}")
 
     def bh_display_commands(self, commands):
         """Display commands (BH)"""
         self.bh_cmd_output.config(state='normal')
         self.bh_cmd_output.insert(tk.END, "\n将要执行的命令:\n")
-        for cmd in commands:
-            self.bh_cmd_output.insert(tk.END, f"{cmd}\n")
+        self.bh_cmd_output.insert(tk.END, "".join(f"{cmd}\n" for cmd in commands))
         self.bh_cmd_output.see(tk.END)
         self.bh_cmd_output.config(state='disabled')
 
-    def bh_commit_config_changes(self):
-        """Commit configuration (BH)"""
-        commands = ["commit"]
-        self.execute_config_commands(commands)
-
-
     def bh_restore_state_after_refresh(self, state):
         """从保存的状态恢复UI"""
         try:
@@ -1960,6 +2511,17 @@ class JuniperRouteQueryApp:
             self.status_var.set("部分状态恢复失败")
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = JuniperRouteQueryApp(root)
-    root.mainloop()
\ No newline at end of file
+    # 全表导入使用进程池，打包为exe时需要
+    multiprocessing.freeze_support()
+
+    cli_args = build_arg_parser().parse_args()
+    if is_headless(cli_args):
+        run_headless(cli_args)
+    else:
+        root = tk.Tk()
+        app = JuniperRouteQueryApp(root)
+        try:
+            root.mainloop()
+        finally:
+            # 显式清理，不依赖解释器退出时的垃圾回收时机
+            app.shutdown()
@@ -0,0 +1,2984 @@
+'''
+Juniper多线路由管理工具的引擎：SSH会话、命令队列、输出解析、配置模型、命令生成、设备文件读取和定时巡检。
+不依赖tkinter，图形界面和脚本、定时任务共用这里的代码。paramiko在第一次使用时才导入，
+只做解析或查询历史的脚本无需等待加载。
+'''
+import argparse
+import array
+import atexit
+import bisect
+import codecs
+import cProfile
+import csv
+import gc
+import glob
+import gzip
+import hashlib
+import importlib
+import io
+import ipaddress
+import itertools
+import json
+import mmap
+import multiprocessing
+import queue
+import os
+import pstats
+import re
+import shutil
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+import xml.etree.ElementTree as ET
+import zipfile
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+
+class _LazyModule:
+    """第一次访问属性时才导入的模块"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+paramiko = _LazyModule('paramiko')
+
+# CLI读取参数
+cli_command_timeout = 120  # 单条命令最长等待时间(秒)，超时未见提示符即视为失败
+cli_login_timeout = 15  # 登录后等待首个提示符的时间(秒)
+cli_poll_interval = 0.05  # 通道无数据时的轮询间隔(秒)
+
+# SSH连接池参数
+ssh_connect_timeout = 10  # TCP连接及认证超时(秒)
+ssh_keepalive_interval = 30  # transport保活报文间隔(秒)
+ssh_idle_timeout = 600  # 会话空闲超过该时间(秒)后自动关闭
+ssh_max_sessions = 8  # 同时保持的最大会话数，超出时关闭最久未使用的会话
+
+# 配置下发参数
+config_commit_confirmed_minutes = 5  # commit confirmed的自动回滚时间(分钟)，验证通过后再commit确认；为0时直接commit
+config_load_batch_lines = 200  # load set terminal时每批写入的配置行数
+config_verify_budget = 30  # 批量导入前按预期配置自检生效验证的耗时上限(秒)，需远小于自动回滚时间
+fbf_filter_name = "inside-outside-fbf"  # 强制线路使用的firewall filter名称，请自行修改
+route_next_hop = "192.168.1.1"  # 路由发布使用的下一跳，批量导入时只与该下一跳的静态路由合并
+
+# 会话日志参数
+log_file_path = "query_log.txt"
+log_max_bytes = 20 * 1024 * 1024  # 日志文件达到该大小后轮转
+log_rotate_daily = True  # 日期变化后轮转
+log_backup_count = 30  # 保留的历史压缩日志数量
+log_queue_size = 10000  # 日志队列容量，队列满时丢弃新日志，不阻塞界面和SSH读取线程
+log_flush_interval = 1.0  # 写入线程批量写盘的最长间隔(秒)
+
+# 配置快照：每台设备最近一次解析的配置连同提交标识保存在本地，选择设备时立即显示并在后台校验
+config_snapshot_db = "config_snapshots.db"
+
+# 设备信息文件编译后的缓存目录，文件大小、修改时间或内容变化时重新读取
+inventory_cache_dir = "inventory_cache"
+
+# 定时巡检参数：无界面运行，结果写入SQLite(WAL模式)历史库
+inspection_schedule_file = "inspection_schedule.txt"  # 每行: 分 时 日 月 周 命令组 [设备1,设备2|*]
+inspection_db = "inspection_history.db"
+inspection_retention_days = 90  # 历史结果保留天数，为0时不清理
+
+# 全表导入参数：receive-protocol整张BGP表按列保存为内存映射文件
+rib_store_dir = "rib"  # 全表文件保存目录
+rib_chunk_lines = 20000  # 每个解析任务的行数
+rib_parse_workers = max(1, (os.cpu_count() or 2) - 1)  # 解析进程数
+rib_ingest_timeout = 1800  # 全表输出的最长等待时间(秒)
+
+# 耗时统计参数：连接、认证、命令发送、首字节、提示符、解析、提交等阶段耗时保存在内存环形缓冲中，定期导出
+metrics_ring_size = 20000  # 内存中保留的最近耗时记录数
+metrics_prometheus_file = "metrics.prom"  # Prometheus文本格式(node_exporter textfile collector可直接采集)
+metrics_jsonl_file = "metrics.jsonl"  # 每条耗时记录一行JSON，追加写入
+metrics_export_interval = 60  # 图形界面定期导出的间隔(秒)
+
+# 性能分析参数：设置环境变量 JUNIPER_PROFILE=1 或在界面勾选"性能分析"后，每次任务生成CPU和内存分析报告
+profile_env_var = "JUNIPER_PROFILE"
+profile_dir = "profiles"  # 报告(.txt)和pstats数据(.prof)保存目录
+profile_top_functions = 30  # 报告中列出的热点函数数量
+profile_top_allocations = 20  # 报告中列出的内存分配位置数量
+profile_trace_frames = 10  # tracemalloc记录的调用栈深度
+
+# 全网巡检同时巡检的最大设备数
+fleet_max_workers = 8
+# 单个SSH连接上同时打开的exec通道数(只读show命令并发执行)
+exec_max_channels = 4
+# 全线路对比查询同时打开的exec通道数，每条线路各有接收、发布两条命令；设备拒绝更多通道时退回shell执行
+isp_matrix_max_channels = 12
+
+# 设备命令队列的任务优先级，数值越小越先执行
+PRIORITY_CONFIG = 0  # 配置下发
+PRIORITY_QUERY = 10  # 手工查询
+PRIORITY_POLL = 20  # 巡检等批量轮询
+
+# 登录后用于识别首个提示符的通用正则，如 user@router> / user@router# / user@router%
+GENERIC_PROMPT_PATTERN = re.compile(r'(?:^|\n)([\w.\-]+@[\w.\-]+)[>#%] ?$')
+# 载入/提交配置时的错误输出，如 error: ... / syntax error / load complete (1 errors)
+CONFIG_ERROR_PATTERN = re.compile(r'error:|syntax error|\(\d+ errors?\)')
+# show system commit 的第0条(最近一次提交)，如 0   2025-05-06 11:35:53 CST by admin via cli
+COMMIT_ID_PATTERN = re.compile(r'^\s*0\s+(\d{4}-\d{2}-\d{2} .+)$', re.MULTILINE)
+# 分页提示，如 ---(more)--- / ---(more 45%)---
+MORE_PATTERN = re.compile(r'---\(more(?: \d+%)?\)---')
+
+
+class SpanRecorder:
+    """各阶段耗时记录：每条记录包含阶段名、设备、命令、耗时和状态，保存在有界环形缓冲中；
+    另外按(阶段, 设备)累计次数、总耗时、最大耗时和接收字节数，导出为Prometheus文本格式"""
+
+    def __init__(self, size=metrics_ring_size):
+        self.records = deque(maxlen=size)
+        self.totals = {}  # (阶段, 设备) -> [次数, 总耗时, 最大耗时, 失败次数]
+        self.bytes_received = {}  # 设备 -> 接收字节数
+        self.lock = threading.Lock()
+        self._sequence = 0
+        self._exported = 0  # 已追加到JSONL文件的最后一条记录序号
+
+    def record(self, span, seconds, device=None, command=None, status='ok', **fields):
+        record = {'time': time.time(), 'span': span, 'device': device, 'command': command,
+                  'seconds': round(seconds, 6), 'status': status}
+        record.update(fields)
+        key = (span, device or '')
+        with self.lock:
+            self._sequence += 1
+            record['seq'] = self._sequence
+            self.records.append(record)
+            totals = self.totals.get(key)
+            if totals is None:
+                totals = self.totals[key] = [0, 0.0, 0.0, 0]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+            if status != 'ok':
+                totals[3] += 1
+            if 'bytes' in fields:
+                self.bytes_received[device or ''] = self.bytes_received.get(device or '', 0) + fields['bytes']
+
+    def span(self, span, device=None, command=None):
+        """计时上下文：with spans.span('auth', 设备名): ...，异常时状态记为error"""
+        return _Span(self, span, device, command)
+
+    def recent(self, device=None, span=None, limit=100):
+        """最近的记录(新的在前)，可按设备和阶段过滤"""
+        with self.lock:
+            records = list(self.records)
+        return [r for r in reversed(records)
+                if (device is None or r['device'] == device) and (span is None or r['span'] == span)][:limit]
+
+    def export_jsonl(self, path=metrics_jsonl_file):
+        """把上次导出之后的新记录追加到JSONL文件，返回写入的条数"""
+        with self.lock:
+            records = [r for r in self.records if r['seq'] > self._exported]
+            if records:
+                self._exported = records[-1]['seq']
+        if records:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(r, ensure_ascii=False) + '\n' for r in records)
+        return len(records)
+
+    def export_prometheus(self, path=metrics_prometheus_file):
+        """按Prometheus文本格式写出累计值，先写临时文件再替换，采集端不会读到半个文件"""
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+        with self.lock:
+            totals = sorted(self.totals.items())
+            bytes_received = sorted(self.bytes_received.items())
+        lines = [
+            '# HELP juniper_span_seconds 各阶段耗时(秒)：连接、认证、命令发送、首字节、提示符、解析、提交等',
+            '# TYPE juniper_span_seconds summary',
+        ]
+        for (span, device), (count, total, _, _) in totals:
+            labels = f'span="{label(span)}",device="{label(device)}"'
+            lines.append(f'juniper_span_seconds_count{{{labels}}} {count}')
+            lines.append(f'juniper_span_seconds_sum{{{labels}}} {total:.6f}')
+        lines += ['# HELP juniper_span_seconds_max 各阶段最大耗时(秒)', '# TYPE juniper_span_seconds_max gauge']
+        lines += [f'juniper_span_seconds_max{{span="{label(span)}",device="{label(device)}"}} {maximum:.6f}'
+                  for (span, device), (_, _, maximum, _) in totals]
+        lines += ['# HELP juniper_span_errors_total 各阶段失败次数', '# TYPE juniper_span_errors_total counter']
+        lines += [f'juniper_span_errors_total{{span="{label(span)}",device="{label(device)}"}} {errors}'
+                  for (span, device), (_, _, _, errors) in totals]
+        lines += ['# HELP juniper_bytes_received_total 命令输出接收字节数', '# TYPE juniper_bytes_received_total counter']
+        lines += [f'juniper_bytes_received_total{{device="{label(device)}"}} {count}'
+                  for device, count in bytes_received]
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, path)
+
+    def export(self, prometheus_path=metrics_prometheus_file, jsonl_path=metrics_jsonl_file):
+        """同时导出两种格式，写入失败不影响调用方"""
+        try:
+            self.export_jsonl(jsonl_path)
+            self.export_prometheus(prometheus_path)
+        except OSError:
+            pass
+
+
+class _Span:
+    def __init__(self, recorder, span, device, command):
+        self.recorder, self.span, self.device, self.command = recorder, span, device, command
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        status = 'ok' if exc_type is None else ('timeout' if issubclass(exc_type, CliTimeoutError) else 'error')
+        self.recorder.record(self.span, time.time() - self.start, self.device, self.command, status)
+
+
+spans = SpanRecorder()  # 进程内共用的耗时记录
+
+
+def record_command_spans(device, command, channel, started, sent, pipeline, status):
+    """记录一条命令的各阶段耗时：send(发送)、first_byte(发送后到首个数据块)、prompt(发送后到输出结束)、
+    parse(逐行回调即解析耗时)，prompt记录同时带有接收字节数"""
+    finished = time.time()
+    spans.record('send', sent - started, device, command, status, channel=channel)
+    if pipeline.first_data is not None:
+        spans.record('first_byte', pipeline.first_data - sent, device, command, status, channel=channel)
+    spans.record('prompt', finished - sent, device, command, status, channel=channel, bytes=pipeline.bytes)
+    if pipeline.on_line:
+        spans.record('parse', pipeline.callback_time, device, command, status, channel=channel)
+
+
+# Python 3.12起cProfile基于sys.monitoring，一个Profile采样整个进程的所有线程，且同一时间只能启用一个
+_process_wide_profile = sys.version_info >= (3, 12)
+
+
+def _job_name(func):
+    """任务函数的名称，如 JuniperRouteQueryApp.start_query.<locals>.<lambda> -> JuniperRouteQueryApp.start_query"""
+    return getattr(func, '__qualname__', type(func).__name__).split('.<locals>')[0]
+
+
+class Profiler:
+    """性能分析开关：开启后每次任务(查询、巡检、配置下发等)在执行线程中用cProfile采样，
+    任务派生的exec通道线程通过bind()计入同一次任务；tracemalloc比较任务前后的内存分配。
+    每次任务结束写出报告(热点函数、主要分配位置)和可用pstats/snakeviz打开的.prof文件。
+    开启时的调用线程(图形界面为Tk主线程，界面刷新、写日志在此执行)持续采样，关闭时单独出报告。
+    Python 3.12起cProfile采样整个进程：不再单独采样主线程，每次任务的报告包括同时运行的所有线程，
+    与其他任务重叠时只有先开始的任务有CPU数据"""
+
+    def __init__(self, report_dir=profile_dir):
+        self.report_dir = report_dir
+        self.enabled = False
+        self.on_report = None  # 每份报告写出后以报告路径调用
+        self._local = threading.local()  # 当前线程所属的任务
+        self._main_profile = None
+        self._main_thread = None
+        self._main_snapshot = None
+        self._main_started = None
+        self._owns_tracemalloc = False  # tracemalloc由本对象启动时，关闭时才停止
+
+    def enable(self, main_thread=True):
+        if self.enabled:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(profile_trace_frames)
+            self._owns_tracemalloc = True
+        self.enabled = True
+        if main_thread and not _process_wide_profile:
+            self._main_thread = threading.get_ident()
+            self._main_started = time.time()
+            self._main_snapshot = tracemalloc.take_snapshot()
+            self._main_profile = self._start_profile()
+
+    def disable(self):
+        """关闭分析，返回主线程报告的路径(未采样主线程时为None)"""
+        if not self.enabled:
+            return None
+        self.enabled = False
+        path = None
+        if self._main_thread is not None:
+            profiles = []
+            if self._main_profile is not None:
+                self._main_profile.disable()
+                profiles.append(self._main_profile)
+            path = self._write_report('main_thread', None, profiles, time.time() - self._main_started,
+                                      self._main_snapshot)
+            self._main_profile = self._main_thread = self._main_snapshot = None
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
+        return path
+
+    def run(self, name, device, func, *args, **kwargs):
+        """执行一次任务，开启分析时为其生成报告；已在任务中或在持续采样的主线程中时直接执行"""
+        if (not self.enabled or getattr(self._local, 'run', None) is not None
+                or threading.get_ident() == self._main_thread):
+            return func(*args, **kwargs)
+        run = {'profiles': [], 'lock': threading.Lock()}
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        start = time.time()
+        self._local.run = run
+        try:
+            return self._profiled(run, func, args, kwargs)
+        finally:
+            self._local.run = None
+            self._write_report(name, device, run['profiles'], time.time() - start, snapshot)
+
+    def bind(self, func):
+        """在任务中提交给其他线程的函数，执行时计入当前任务"""
+        run = getattr(self._local, 'run', None)
+        if run is None:
+            return func
+
+        def wrapper(*args, **kwargs):
+            self._local.run = run
+            try:
+                return self._profiled(run, func, args, kwargs)
+            finally:
+                self._local.run = None
+        return wrapper
+
+    def _profiled(self, run, func, args, kwargs):
+        profile = self._start_profile()
+        if profile is None:
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            with run['lock']:
+                run['profiles'].append(profile)
+
+    @staticmethod
+    def _start_profile():
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12起同一时间只能有一个cProfile采样，其他任务已在采样时跳过
+            return None
+        return profile
+
+    def _write_report(self, name, device, profiles, elapsed, snapshot):
+        """写出文本报告和合并后的.prof文件，返回报告路径；写入失败时返回None"""
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]
+        base = os.path.join(self.report_dir, re.sub(r'[\\/:*?"<>|\s]', '_', f"{stamp}_{device or ''}_{name}"))
+        out = io.StringIO()
+        if not profiles:
+            scope = "未采样(其他任务正在采样)"
+        elif _process_wide_profile:
+            scope = "整个进程(包括同时运行的其他线程)"
+        else:
+            scope = f"{len(profiles)}个线程"
+        out.write(f"任务: {name}\n设备: {device or ''}\n耗时: {elapsed:.3f}秒\nCPU采样范围: {scope}\n\n")
+        try:
+            os.makedirs(self.report_dir, exist_ok=True)
+            if profiles:
+                stats = pstats.Stats(profiles[0], stream=out)
+                for profile in profiles[1:]:
+                    stats.add(profile)
+                stats.dump_stats(base + '.prof')
+                out.write("热点函数(按累计耗时):\n")
+                stats.sort_stats('cumulative').print_stats(profile_top_functions)
+                out.write("热点函数(按自身耗时):\n")
+                stats.sort_stats('tottime').print_stats(profile_top_functions)
+            if snapshot is not None and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                out.write(f"内存: 当前 {current / 1024 / 1024:.1f}MB, 峰值 {peak / 1024 / 1024:.1f}MB\n")
+                filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                           tracemalloc.Filter(False, '<frozen importlib._bootstrap>')]
+                diff = tracemalloc.take_snapshot().filter_traces(filters).compare_to(
+                    snapshot.filter_traces(filters), 'lineno')
+                out.write("主要内存分配(任务前后的差值，包括同时运行的其他线程):\n")
+                out.writelines(f"  {stat}\n" for stat in diff[:profile_top_allocations])
+            with open(base + '.txt', 'w', encoding='utf-8') as f:
+                f.write(out.getvalue())
+        except OSError:
+            return None
+        if self.on_report:
+            self.on_report(base + '.txt')
+        return base + '.txt'
+
+
+profiler = Profiler()  # 进程内共用的性能分析开关
+
+
+class CliTimeoutError(Exception):
+    """在截止时间内未检测到设备提示符"""
+
+    def __init__(self, command, timeout, output):
+        super().__init__(f"命令 {command!r} 在 {timeout} 秒内未返回提示符")
+        self.command = command
+        self.timeout = timeout
+        self.output = output
+
+
+class ChunkPipeline:
+    """SSH读取数据的累积管道：以增量UTF-8解码器处理每个recv数据块(跨块的多字节字符不会被截断或丢弃)，
+    解码后的文本只追加到列表中，完整的行在到达时立即交给 on_line，整体开销与输出大小成线性关系"""
+
+    def __init__(self, on_data=None, on_line=None, keep=True):
+        self.on_data = on_data
+        self.on_line = on_line
+        self.keep = keep  # 为False时不保留输出，只交给回调处理(如全表导入)
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._chunks = []
+        self._partial = []  # 尚未遇到换行符的行片段
+        self.bytes = 0  # 收到的字节数
+        self.first_data = None  # 收到首个数据块的时间
+        self.callback_time = 0.0  # on_line回调(逐行解析)的累计耗时
+
+    def decode(self, data, final=False):
+        """把一个字节块解码为文本(去掉\r)，不足一个字符的尾部字节留到下一块"""
+        if data:
+            self.bytes += len(data)
+            if self.first_data is None:
+                self.first_data = time.time()
+        return self._decoder.decode(data, final).replace('\r', '')
+
+    def append(self, text):
+        """追加已解码的文本，按行切分交给 on_line"""
+        if not text:
+            return
+        if self.keep:
+            self._chunks.append(text)
+        if self.on_data:
+            self.on_data(text)
+        if self.on_line:
+            if '\n' not in text:
+                self._partial.append(text)
+                return
+            start = time.time()
+            self._partial.append(text)
+            lines = ''.join(self._partial).split('\n')
+            self._partial = [lines.pop()]
+            for line in lines:
+                self.on_line(line)
+            self.callback_time += time.time() - start
+
+    def feed(self, data):
+        """解码并追加一个字节块，返回解码后的文本"""
+        text = self.decode(data)
+        self.append(text)
+        return text
+
+    def finish(self):
+        """输出结束：解码剩余字节，并把最后一个不完整的行交给 on_line"""
+        self.append(self.decode(b'', final=True))
+        if self.on_line and self._partial:
+            line = ''.join(self._partial)
+            self._partial = []
+            if line:
+                self.on_line(line)
+
+    def text(self):
+        return ''.join(self._chunks)
+
+
+class CliSession:
+    """invoke_shell通道封装：登录后学习设备真实提示符，命令以提示符重新出现作为结束标志"""
+
+    # 只在输出末尾的窗口内匹配提示符，避免每个数据块都扫描完整输出
+    tail_window = 512
+
+    def __init__(self, shell, poll_interval=cli_poll_interval, device=None):
+        self.shell = shell
+        self.poll_interval = poll_interval
+        self.device = device  # 耗时记录中的设备名
+        self.prompt = None
+        self.prompt_re = GENERIC_PROMPT_PATTERN
+        self.last_timing = None  # 最近一条命令的耗时，供界面显示
+
+    def learn_prompt(self, timeout=cli_login_timeout):
+        """读取登录横幅直到出现首个提示符，并据此生成该设备专用的提示符正则"""
+        self._read_until_prompt(None, timeout, ChunkPipeline())
+        self.prompt_re = re.compile(r'(?:^|\n)' + re.escape(self.prompt) + r'[>#%] ?$')
+        return self.prompt
+
+    def run(self, command, timeout=cli_command_timeout, on_data=None, on_line=None, keep_output=True):
+        """发送命令并持续读取，直到提示符出现或超过截止时间，返回完整输出。
+        on_data在每个数据块到达时调用，on_line在每个完整行到达时调用；keep_output为False时不保留输出，返回空字符串"""
+        pipeline = ChunkPipeline(on_data, on_line, keep_output)
+        started = time.time()
+        self.shell.send(command + '\n')
+        return self._timed_read(command, timeout, pipeline, started, time.time())
+
+    def run_input(self, command, lines, timeout=cli_command_timeout, on_data=None,
+                  batch_lines=config_load_batch_lines):
+        """发送需要多行输入的命令(如 load set terminal)，分批写入输入行，以Ctrl-D结束后读取到提示符为止"""
+        pipeline = ChunkPipeline(on_data)
+        started = time.time()
+        self.shell.send(command + '\n')
+        for start in range(0, len(lines), batch_lines):
+            self.shell.sendall('\n'.join(lines[start:start + batch_lines]) + '\n')
+            # 每批写入后读走回显，避免通道窗口被占满
+            while self.shell.recv_ready():
+                pipeline.feed(self.shell.recv(65535))
+        self.shell.send('\x04')
+        return self._timed_read(command, timeout, pipeline, started, time.time())
+
+    def _timed_read(self, command, timeout, pipeline, started, sent):
+        status = 'error'
+        try:
+            output = self._read_until_prompt(command, timeout, pipeline)
+            status = 'ok'
+            return output
+        except CliTimeoutError:
+            status = 'timeout'
+            raise
+        finally:
+            record_command_spans(self.device, command, 'shell', started, sent, pipeline, status)
+            self.last_timing = {'first_byte': pipeline.first_data - sent if pipeline.first_data else None,
+                                'total': time.time() - started, 'bytes': pipeline.bytes,
+                                'parse': pipeline.callback_time}
+
+    def _read_until_prompt(self, command, timeout, pipeline):
+        deadline = time.time() + timeout
+        tail = ''
+        callback_error = None
+        while True:
+            if self.shell.recv_ready():
+                data = pipeline.decode(self.shell.recv(65535))
+                tail = (tail + data)[-self.tail_window:]
+
+                # 分页时发送空格继续输出，并去掉分页提示
+                if MORE_PATTERN.search(tail):
+                    self.shell.send(' ')
+                    data = MORE_PATTERN.sub('', data)
+                    tail = MORE_PATTERN.sub('', tail)
+
+                try:
+                    pipeline.append(data)
+                except Exception as e:
+                    # 回调(如XML解析)出错时停止回调，继续读到提示符，通道保持干净可继续复用
+                    callback_error = e
+                    pipeline.on_data = pipeline.on_line = None
+
+                match = self.prompt_re.search(tail)
+                if match:
+                    if self.prompt is None:
+                        self.prompt = match.group(1)
+                    break
+            elif self.shell.closed or self.shell.exit_status_ready():
+                raise Exception("⚠ 设备已关闭SSH通道")
+            else:
+                time.sleep(self.poll_interval)
+
+            if time.time() > deadline:
+                raise CliTimeoutError(command, timeout, pipeline.text())
+
+        if callback_error is None:
+            try:
+                pipeline.finish()
+            except Exception as e:
+                callback_error = e
+        if callback_error is not None:
+            raise callback_error
+        # 分页提示被recv边界截断时单块替换不到，最后整体再去除一次
+        return MORE_PATTERN.sub('', pipeline.text())
+
+
+def read_commit_id(cli):
+    """读取设备最近一次提交记录(时间、用户、方式)作为配置版本标识，读取失败时返回None"""
+    output = cli.run('show system commit | match "^0 " | no-more')
+    match = COMMIT_ID_PATTERN.search(output)
+    return ' '.join(match.group(1).split()) if match else None
+
+
+def connect_device(device_info, log=None, device_name=None):
+    """登录设备并打开shell通道，返回包含client/shell/cli的会话信息。
+    TCP连接、SSH协商及认证、打开shell、识别提示符分别记录耗时，device_name为记录中的设备名(默认设备IP)"""
+    log = log or (lambda text: None)
+    device = device_name or str(device_info['ip'])
+    log(f"正在连接设备 {device_info['ip']}:{device_info['port']}...\n")
+    with spans.span('connect', device):
+        sock = socket.create_connection((device_info['ip'], device_info['port']), timeout=ssh_connect_timeout)
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    try:
+        with spans.span('auth', device):
+            client.connect(
+                hostname=device_info['ip'],
+                port=device_info['port'],
+                username=device_info['username'],
+                password=device_info['password'],
+                timeout=ssh_connect_timeout,
+                sock=sock
+            )
+    except Exception:
+        client.close()
+        sock.close()
+        raise
+    try:
+        client.get_transport().set_keepalive(ssh_keepalive_interval)
+        with spans.span('shell_open', device):
+            shell = client.invoke_shell()
+        cli = CliSession(shell, device=device)
+        try:
+            with spans.span('login', device):
+                prompt = cli.learn_prompt()
+            log(f"识别到设备提示符: {prompt}\n")
+        except CliTimeoutError:
+            # 未识别到提示符时继续使用通用提示符正则
+            log("⚠ 未识别到设备提示符，使用通用提示符匹配\n")
+    except Exception:
+        client.close()
+        raise
+
+    log(f"\n✅ 已成功连接到设备: {device_info['ip']}\n")
+    return {
+        'client': client,
+        'shell': shell,
+        'cli': cli,
+        'device': device,
+        'last_used': time.time()
+    }
+
+
+def run_exec_command(client, command, timeout=cli_command_timeout, poll_interval=cli_poll_interval,
+                     on_data=None, on_line=None, device=None):
+    """在同一连接上新开exec通道执行一条命令，命令结束(退出状态返回)后返回完整输出"""
+    started = time.time()
+    channel = client.get_transport().open_session(timeout=ssh_connect_timeout)
+    pipeline = ChunkPipeline(on_data, on_line)
+    sent, status = started, 'error'
+    try:
+        channel.exec_command(command)
+        sent = time.time()
+        deadline = time.time() + timeout
+        while True:
+            if channel.recv_ready():
+                pipeline.feed(channel.recv(65535))
+            elif channel.recv_stderr_ready():
+                pipeline.feed(channel.recv_stderr(65535))
+            elif channel.exit_status_ready():
+                break
+            elif time.time() > deadline:
+                status = 'timeout'
+                raise CliTimeoutError(command, timeout, pipeline.text())
+            else:
+                time.sleep(poll_interval)
+        pipeline.finish()
+        status = 'ok'
+        return pipeline.text()
+    finally:
+        channel.close()
+        record_command_spans(device, command, 'exec', started, sent, pipeline, status)
+
+
+def is_read_only_command(command):
+    """只读的show命令可以放到独立exec通道并发执行"""
+    return command.strip().split(' ', 1)[0] == 'show'
+
+
+def run_inspection(session, commands, max_channels=exec_max_channels, on_result=None, timings=None):
+    """执行巡检命令：show命令分配到多个exec通道并发执行，其余命令在shell通道中依次执行。
+    返回与commands顺序一致的输出列表，失败的命令对应位置为异常对象；
+    timings为列表时按命令顺序填入每条命令的执行耗时(秒)"""
+    results = [None] * len(commands)
+    shell_indexes = [i for i, cmd in enumerate(commands) if not is_read_only_command(cmd)]
+    if timings is not None:
+        timings[:] = [0.0] * len(commands)
+
+    def timed(index, func, *args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if timings is not None:
+                timings[index] = time.time() - start
+
+    def finish(index, result):
+        results[index] = result
+        if on_result:
+            on_result(index, commands[index], result)
+
+    exec_indexes = [i for i in range(len(commands)) if i not in shell_indexes]
+    with ThreadPoolExecutor(max_workers=max_channels) as executor:
+        futures = {executor.submit(profiler.bind(timed), i, run_exec_command, session['client'], commands[i],
+                                   device=session.get('device')): i
+                   for i in exec_indexes}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                finish(index, future.result())
+            except (paramiko.ChannelException, paramiko.SSHException):
+                # 设备限制了exec通道数量时退回shell通道执行
+                shell_indexes.append(index)
+            except Exception as e:
+                finish(index, e)
+
+    for index in sorted(shell_indexes):
+        try:
+            finish(index, timed(index, session['cli'].run, commands[index]))
+        except CliTimeoutError as e:
+            # 超时后shell通道状态未知，后续命令不再执行
+            finish(index, e)
+            for rest in sorted(shell_indexes):
+                if results[rest] is None:
+                    finish(rest, e)
+            break
+        except Exception as e:
+            finish(index, e)
+
+    return results
+
+
+def config_verification_section(commands):
+    """计算一组set/delete命令共同所在的配置层级，用于一次性读取并验证"""
+    paths = [cmd.split()[1:] for cmd in commands]
+    if not paths:
+        return []
+    section = paths[0][:-1]
+    for path in paths[1:]:
+        common = 0
+        while common < len(section) and common < len(path) - 1 and section[common] == path[common]:
+            common += 1
+        section = section[:common]
+    return section
+
+
+def find_unapplied_statements(commands, display_set_output):
+    """对比 show configuration | display set 输出，返回未生效的set/delete命令。
+    每行配置按词拆出全部前缀放入集合，一条命令等于某行或是某行按词的前缀即视为存在，每条命令O(1)判断"""
+    configured = set()
+    for line in display_set_output.splitlines():
+        if line.startswith('set '):
+            configured.update(itertools.accumulate(line.split(), lambda prefix, word: f"{prefix} {word}"))
+    unapplied = []
+    for cmd in commands:
+        tokens = cmd.split()
+        present = 'set ' + ' '.join(tokens[1:]) in configured
+        if (tokens[0] == 'set' and not present) or (tokens[0] == 'delete' and present):
+            unapplied.append(cmd)
+    return unapplied
+
+
+class SSHConnectionPool:
+    """按设备名保存已登录的SSH会话，切换设备时直接复用，空闲超时或超过上限时关闭。
+    acquire() 租用会话，任务结束后调用 release() 归还；租用中的会话不会被回收或淘汰"""
+
+    def __init__(self, idle_timeout=ssh_idle_timeout, max_sessions=ssh_max_sessions, log=None):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.log = log or (lambda text: None)
+        self._entries = OrderedDict()  # 设备名 -> 会话信息，按最近使用排序
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+
+        # 后台线程定期关闭空闲会话
+        threading.Thread(target=self._reap_idle_sessions, daemon=True).start()
+
+    def acquire(self, device_name, device_info):
+        """租用设备可用的会话信息，会话不存在或传输层已断开时重新连接"""
+        with self._lock:
+            entry = self._entries.get(device_name)
+            if entry and self._is_usable(entry, device_info):
+                entry['last_used'] = time.time()
+                entry['leases'] += 1
+                self._entries.move_to_end(device_name)
+                return entry
+            if entry:
+                # 会话已失效或设备信息已变更，静默关闭后重连
+                self._close_entry(self._entries.pop(device_name))
+
+        entry = self._connect(device_name, device_info)
+        with self._lock:
+            stale = self._entries.pop(device_name, None)
+            if stale:
+                self._close_entry(stale)
+            self._entries[device_name] = entry
+            # 从最久未使用的开始淘汰，租用中的会话保留，全部租用时暂时超过上限
+            idle = [name for name, e in self._entries.items() if not e['leases']]
+            for evicted_name in idle[:max(0, len(self._entries) - self.max_sessions)]:
+                self._close_entry(self._entries.pop(evicted_name))
+                self.log(f"\n🚨会话数超过上限，已关闭设备 {evicted_name} 的SSH会话\n")
+        return entry
+
+    def release(self, entry):
+        """归还acquire()租用的会话，从此刻开始计算空闲时间"""
+        with self._lock:
+            entry['leases'] = max(0, entry['leases'] - 1)
+            entry['last_used'] = time.time()
+
+    def close(self, device_name):
+        """关闭指定设备的会话"""
+        with self._lock:
+            entry = self._entries.pop(device_name, None)
+        if entry:
+            self._close_entry(entry)
+            return True
+        return False
+
+    def close_all(self):
+        """关闭所有会话并停止空闲回收线程"""
+        self._closed.set()
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            self._close_entry(entry)
+
+    def _connect(self, device_name, device_info):
+        entry = connect_device(device_info, log=self.log, device_name=device_name)
+        entry['key'] = self._device_key(device_info)
+        entry['leases'] = 1
+        return entry
+
+    def _is_usable(self, entry, device_info):
+        transport = entry['client'].get_transport()
+        return (entry['key'] == self._device_key(device_info)
+                and transport is not None and transport.is_active()
+                and not entry['shell'].closed)
+
+    @staticmethod
+    def _device_key(device_info):
+        return (device_info['ip'], device_info['port'], device_info['username'], device_info['password'])
+
+    @staticmethod
+    def _close_entry(entry):
+        try:
+            entry['shell'].close()
+            entry['client'].close()
+        except Exception:
+            pass
+
+    def _reap_idle_sessions(self):
+        interval = max(1, min(self.idle_timeout / 4, 30))
+        while not self._closed.wait(interval):
+            now = time.time()
+            with self._lock:
+                idle = [name for name, entry in self._entries.items()
+                        if not entry['leases'] and now - entry['last_used'] > self.idle_timeout]
+                entries = [(name, self._entries.pop(name)) for name in idle]
+            for name, entry in entries:
+                self._close_entry(entry)
+                self.log(f"\n🚨设备 {name} 的SSH会话空闲超时，已关闭\n")
+
+
+class DeviceCommandQueue:
+    """单台设备的任务队列：一个工作线程独占该设备的shell通道，按优先级依次执行任务。
+    任务为 job(session) 形式的函数，session为连接池返回的会话信息，提交后返回Future"""
+
+    def __init__(self, device_name, connect, on_failure=None, release=None):
+        self.device_name = device_name
+        self.connect = connect  # 返回会话信息，无法连接时返回None
+        self.release = release  # 任务结束后以会话信息调用，归还连接池租用的会话
+        self.on_failure = on_failure  # 任务异常后调用，用于关闭可能已失效的会话
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()  # 同优先级按提交顺序执行
+        self._running = None
+        self._lock = threading.Lock()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, job, priority=PRIORITY_QUERY):
+        """提交任务，返回Future；任务未开始前可通过Future.cancel()取消"""
+        future = Future()
+        self._queue.put((priority, next(self._seq), job, future))
+        return future
+
+    def cancel_pending(self):
+        """取消所有尚未开始的任务，返回取消的数量"""
+        cancelled = 0
+        while True:
+            try:
+                _, _, job, future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None and future.cancel():
+                cancelled += 1
+        return cancelled
+
+    def shutdown(self):
+        """取消排队任务并在当前任务结束后停止工作线程"""
+        self.cancel_pending()
+        self._queue.put((float('inf'), next(self._seq), None, None))
+
+    @property
+    def busy(self):
+        """是否有正在执行或排队的任务"""
+        with self._lock:
+            return self._running is not None or not self._queue.empty()
+
+    def _worker(self):
+        while True:
+            _, _, job, future = self._queue.get()
+            if job is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue  # 已取消
+
+            with self._lock:
+                self._running = future
+            try:
+                future.set_result(profiler.run(_job_name(job), self.device_name, self._run_job, job))
+            except Exception as e:
+                if self.on_failure:
+                    self.on_failure(e)
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._running = None
+
+    def _run_job(self, job):
+        session = self.connect()
+        if session is None:
+            raise Exception("⚠ 无法建立SSH连接")
+        try:
+            return job(session)
+        finally:
+            if self.release:
+                self.release(session)
+
+
+class AsyncSessionLogger:
+    """后台线程写会话日志：调用方只把文本放入有界队列，写入线程批量写盘，
+    按大小或日期轮转，旧日志gzip压缩并只保留最近 backup_count 个"""
+
+    _STOP = object()
+
+    def __init__(self, path=log_file_path, max_bytes=log_max_bytes, rotate_daily=log_rotate_daily,
+                 backup_count=log_backup_count, queue_size=log_queue_size, flush_interval=log_flush_interval):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.dropped = 0  # 队列满时丢弃的日志条数
+        self.last_error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._opened_date = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, text):
+        """非阻塞写入，队列满时丢弃"""
+        try:
+            self._queue.put_nowait(text)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=5):
+        """写完队列中剩余的日志后关闭文件"""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                items = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = self._STOP in items
+            text = ''.join(item for item in items if item is not self._STOP)
+            try:
+                if text:
+                    self._write(text)
+            except Exception as e:
+                self.last_error = e
+            if stop:
+                if self._file:
+                    self._file.close()
+                    self._file = None
+                break
+
+    def _write(self, text):
+        if self._file is None:
+            self._open()
+        elif self._should_rotate():
+            self._rotate()
+        self._file.write(text)
+        self._file.flush()
+
+    def _open(self):
+        if os.path.exists(self.path):
+            self._opened_date = datetime.fromtimestamp(os.path.getmtime(self.path)).date()
+            if self._should_rotate():
+                self._rotate()
+                return
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._opened_date = datetime.now().date()
+
+    def _should_rotate(self):
+        if self.rotate_daily and self._opened_date != datetime.now().date():
+            return True
+        size = self._file.tell() if self._file else os.path.getsize(self.path)
+        return size >= self.max_bytes
+
+    def _rotate(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            rotated = f"{self.path}.{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+            os.replace(self.path, rotated)
+            # 压缩放到单独线程，不阻塞日志写入
+            threading.Thread(target=self._compress, args=(rotated,), daemon=True).start()
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._opened_date = datetime.now().date()
+
+    def _compress(self, rotated):
+        try:
+            with open(rotated, 'rb') as src, gzip.open(rotated + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+            backups = sorted(glob.glob(glob.escape(self.path) + '.*.gz'))
+            for old in backups[:-self.backup_count] if self.backup_count else []:
+                os.remove(old)
+        except Exception as e:
+            self.last_error = e
+
+
+# 结构化(| display xml)输出解析得到的记录类型
+RouteRecord = namedtuple('RouteRecord', ['prefix', 'active', 'protocol', 'preference', 'next_hop', 'interface',
+                                         'as_path', 'communities', 'local_pref', 'med', 'age'])
+PrefixListItem = namedtuple('PrefixListItem', ['name', 'prefix'])
+FirewallTermAddress = namedtuple('FirewallTermAddress', ['filter', 'term', 'address'])
+StaticRoute = namedtuple('StaticRoute', ['prefix', 'next_hops', 'discard'])
+
+
+def _local_tag(elem):
+    """去掉XML命名空间，如 {http://xml.juniper.net/...}rt -> rt"""
+    return elem.tag.rpartition('}')[2]
+
+
+def _child(elem, tag):
+    for child in elem:
+        if _local_tag(child) == tag:
+            return child
+    return None
+
+
+def _child_text(elem, tag, default=''):
+    child = _child(elem, tag)
+    if child is None or child.text is None:
+        return default
+    return child.text.strip()
+
+
+def _children_text(elem, tag, name_tag=None):
+    """返回所有同名子元素的文本；name_tag不为空时取子元素下 name_tag 的文本"""
+    values = []
+    for child in elem:
+        if _local_tag(child) == tag:
+            text = _child_text(child, name_tag) if name_tag else (child.text or '').strip()
+            if text:
+                values.append(text)
+    return values
+
+
+def parse_route_element(elem, stack):
+    """route-information中的 <rt> 元素 -> RouteRecord，每个rt-entry一条记录"""
+    if _local_tag(elem) != 'rt':
+        return []
+
+    prefix = _child_text(elem, 'rt-destination')
+    length = _child_text(elem, 'rt-prefix-length')
+    if length and '/' not in prefix:
+        prefix = f"{prefix}/{length}"
+
+    records = []
+    for entry in elem:
+        if _local_tag(entry) != 'rt-entry':
+            continue
+        # 优先取选中的下一跳(advertising/receive-protocol时只有一个nh)
+        next_hop, interface = '', ''
+        for nh in entry:
+            if _local_tag(nh) != 'nh':
+                continue
+            if not next_hop or _child(nh, 'selected-next-hop') is not None:
+                next_hop = _child_text(nh, 'to')
+                interface = _child_text(nh, 'via') or _child_text(nh, 'nh-local-interface')
+        communities = _child(entry, 'communities')
+        records.append(RouteRecord(
+            prefix=prefix,
+            active=_child_text(entry, 'active-tag') in ('*', '+'),
+            protocol=_child_text(entry, 'protocol-name'),
+            preference=_child_text(entry, 'preference'),
+            next_hop=next_hop,
+            interface=interface,
+            as_path=' '.join(_child_text(entry, 'as-path').split()),
+            communities=tuple(_children_text(communities, 'community')) if communities is not None else (),
+            local_pref=_child_text(entry, 'local-preference'),
+            med=_child_text(entry, 'med'),
+            age=_child_text(entry, 'age')
+        ))
+    return records
+
+
+ROUTE_TABLE_HEADER_PATTERN = re.compile(r'^\s*Prefix\s+Nexthop\b')
+ROUTE_TABLE_ROW_PATTERN = re.compile(r'^([*+\- ]?)\s*(\S+/\d+)\s+(\S+)(.*)$')
+
+
+def route_table_columns(header):
+    """advertising-protocol/receive-protocol表头 -> [(字段, 列位置)]，行需先expandtabs"""
+    return [(name, header.find(title)) for name, title in
+            (('med', 'MED'), ('local_pref', 'Lclpref'), ('as_path', 'AS path')) if title in header]
+
+
+def split_route_table_row(line, columns):
+    """拆分表格格式的一行路由，返回(是否活动, 前缀, 下一跳, MED, Lclpref, AS path)，不是路由行时返回None"""
+    match = ROUTE_TABLE_ROW_PATTERN.match(line)
+    if not match:
+        return None
+    fields = {'med': '', 'local_pref': ''}
+    rest, rest_start = match.group(4), match.start(4)
+    as_path = rest
+    if columns:
+        # 按每个字段起始位置最接近的表头列归类，第一个落在AS path列或不是数字的字段起都属于AS path
+        as_path = ''
+        for token in re.finditer(r'\S+', rest):
+            position = rest_start + token.start()
+            name = min(columns, key=lambda column: abs(column[1] - position))[0]
+            if name == 'as_path' or not token.group().isdigit():
+                as_path = rest[token.start():]
+                break
+            fields[name] = token.group()
+    return (match.group(1) in ('*', '+'), match.group(2), match.group(3),
+            fields['med'], fields['local_pref'], ' '.join(as_path.split()))
+
+
+class RouteTextParser:
+    """逐行解析 show route 的文本输出为RouteRecord，支持默认格式
+    (8.8.8.0/24 *[BGP/170] 3w2d 04:12:33, MED 0, localpref 100 / AS path / > to x via y)
+    和 advertising-protocol/receive-protocol 的表格格式(Prefix Nexthop MED Lclpref AS path)"""
+
+    ENTRY_PATTERN = re.compile(r'^(\S+/\d+)?\s+([*+\-]*)\[([\w-]+)/(\d+)(?:/-?\d+)?\]\s*(.*)$')
+    PREFIX_ONLY_PATTERN = re.compile(r'^(\S+/\d+)\s*$')
+    NEXT_HOP_PATTERN = re.compile(r'^\s+(>?)\s*(?:to (\S+)\s*)?via (\S+)')
+
+    def __init__(self):
+        self.records = []
+        self._entry = None  # 当前路由条目的字段
+        self._prefix = ''
+        self._columns = None  # 表格格式的 MED/Lclpref/AS path 列位置
+
+    def add_line(self, line):
+        line = line.rstrip()
+        if not line:
+            return
+        if self._columns is not None or ROUTE_TABLE_HEADER_PATTERN.match(line):
+            self._add_table_line(line)
+            return
+
+        match = self.ENTRY_PATTERN.match(line)
+        if match:
+            self._flush()
+            if match.group(1):
+                self._prefix = match.group(1)
+            self._entry = {
+                'prefix': self._prefix, 'active': '*' in match.group(2) or '+' in match.group(2),
+                'protocol': match.group(3), 'preference': match.group(4), 'next_hop': '', 'interface': '',
+                'as_path': '', 'communities': (), 'local_pref': '', 'med': '', 'age': ''
+            }
+            fields = match.group(5).split(', ')
+            self._entry['age'] = fields[0].strip()
+            for field in fields[1:]:
+                name, _, value = field.strip().partition(' ')
+                if name == 'MED':
+                    self._entry['med'] = value
+                elif name == 'localpref':
+                    self._entry['local_pref'] = value
+            return
+
+        match = self.PREFIX_ONLY_PATTERN.match(line)
+        if match:
+            # 较长的IPv6前缀单独占一行，路由条目在下一行
+            self._flush()
+            self._prefix = match.group(1)
+            return
+
+        if self._entry is None:
+            return
+        stripped = line.strip()
+        if stripped.startswith('AS path:'):
+            self._entry['as_path'] = ' '.join(stripped[8:].split(', ')[0].split())
+        elif stripped.startswith('Communities:'):
+            self._entry['communities'] = tuple(stripped[12:].split())
+        else:
+            match = self.NEXT_HOP_PATTERN.match(line)
+            if match and (not self._entry['next_hop'] and not self._entry['interface'] or match.group(1)):
+                self._entry['next_hop'] = match.group(2) or ''
+                self._entry['interface'] = match.group(3)
+            elif stripped in ('Discard', 'Reject', 'Receive') and not self._entry['next_hop']:
+                self._entry['next_hop'] = stripped
+
+    def _add_table_line(self, line):
+        line = line.expandtabs()
+        if ROUTE_TABLE_HEADER_PATTERN.match(line):
+            self._columns = route_table_columns(line)
+            return
+        row = split_route_table_row(line, self._columns)
+        if row is None:
+            if not line.startswith(' '):
+                # 新的路由表(如 inet6.0:)，等待下一个表头
+                self._columns = None
+            return
+        active, prefix, next_hop, med, local_pref, as_path = row
+        self.records.append(RouteRecord(
+            prefix=prefix, active=active, protocol='', preference='', next_hop=next_hop, interface='',
+            as_path=as_path, communities=(), local_pref=local_pref, med=med, age=''
+        ))
+
+    def _flush(self):
+        if self._entry is not None:
+            self.records.append(RouteRecord(**self._entry))
+            self._entry = None
+
+    def finish(self):
+        """输出结束，返回全部记录"""
+        self._flush()
+        return self.records
+
+
+RIB_MISSING = 0xFFFFFFFF  # MED/Lclpref为空时的取值
+
+
+def parse_rib_chunk(text, columns):
+    """在解析进程中执行：把一段表格格式的路由行转换为列数据，下一跳和AS path在块内编号。
+    返回的数组以bytes传回，避免逐个对象序列化"""
+    prefixes, lengths, flags = array.array('I'), array.array('B'), array.array('B')
+    next_hops, as_paths = array.array('I'), array.array('I')
+    meds, local_prefs = array.array('I'), array.array('I')
+    next_hop_ids, as_path_ids = {}, {}
+    skipped = 0
+    for line in text.split('\n'):
+        row = split_route_table_row(line.expandtabs(), columns)
+        if row is None:
+            continue
+        active, prefix, next_hop, med, local_pref, as_path = row
+        address, _, length = prefix.partition('/')
+        try:
+            key = int.from_bytes(socket.inet_aton(address), 'big')
+        except OSError:
+            # 只保存IPv4路由
+            skipped += 1
+            continue
+        prefixes.append(key)
+        lengths.append(int(length))
+        flags.append(1 if active else 0)
+        next_hops.append(next_hop_ids.setdefault(next_hop, len(next_hop_ids)))
+        as_paths.append(as_path_ids.setdefault(as_path, len(as_path_ids)))
+        meds.append(int(med) if med else RIB_MISSING)
+        local_prefs.append(int(local_pref) if local_pref else RIB_MISSING)
+    return {
+        'prefixes': prefixes.tobytes(), 'lengths': lengths.tobytes(), 'flags': flags.tobytes(),
+        'next_hops': next_hops.tobytes(), 'as_paths': as_paths.tobytes(),
+        'meds': meds.tobytes(), 'local_prefs': local_prefs.tobytes(),
+        'next_hop_table': list(next_hop_ids), 'as_path_table': list(as_path_ids), 'skipped': skipped,
+    }
+
+
+class RibTable:
+    """按列保存的IPv4 BGP全表：前缀为uint32+掩码长度，下一跳和AS path保存为字符串表中的编号，
+    每条路由约21字节。保存为文件后可用mmap直接映射各列，载入不需要解析"""
+
+    MAGIC = b'JRIB0001'
+    # 列名和array类型码
+    COLUMNS = (('prefixes', 'I'), ('lengths', 'B'), ('flags', 'B'), ('next_hops', 'I'),
+               ('as_paths', 'I'), ('meds', 'I'), ('local_prefs', 'I'))
+
+    def __init__(self, meta=None):
+        self.meta = meta or {}  # 设备、线路、命令、时间等说明信息
+        for name, typecode in self.COLUMNS:
+            setattr(self, name, array.array(typecode))
+        self.next_hop_table, self.as_path_table = [], []
+        self._next_hop_ids, self._as_path_ids = {}, {}
+        self.skipped = 0
+        self._mmap = None
+        self._prefix_text = None  # (全部前缀拼接的文本, 各行起始位置)，首次按前缀过滤时生成
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    @staticmethod
+    def _intern(values, ids, table):
+        """把块内字符串表合并到全表字符串表，返回块内编号到全表编号的映射"""
+        remap = []
+        for value in values:
+            index = ids.get(value)
+            if index is None:
+                index = ids[value] = len(table)
+                table.append(value)
+            remap.append(index)
+        return remap
+
+    def add_chunk(self, result):
+        """合并parse_rib_chunk的结果，把块内编号换成全表编号"""
+        remaps = {
+            'next_hops': self._intern(result['next_hop_table'], self._next_hop_ids, self.next_hop_table),
+            'as_paths': self._intern(result['as_path_table'], self._as_path_ids, self.as_path_table),
+        }
+        for name, typecode in self.COLUMNS:
+            column = array.array(typecode)
+            column.frombytes(result[name])
+            if name in remaps:
+                column = map(remaps[name].__getitem__, column)
+            getattr(self, name).extend(column)
+        self.skipped += result['skipped']
+        self._prefix_text = None
+
+    def prefix(self, i):
+        return f"{socket.inet_ntoa(struct.pack('!I', self.prefixes[i]))}/{self.lengths[i]}"
+
+    def __getitem__(self, i):
+        """第i条路由，字段顺序与查询结果列表一致"""
+        med, local_pref = self.meds[i], self.local_prefs[i]
+        return ('*' if self.flags[i] & 1 else '', self.prefix(i), 'BGP', '',
+                self.next_hop_table[self.next_hops[i]], '', self.as_path_table[self.as_paths[i]],
+                '' if local_pref == RIB_MISSING else str(local_pref), '' if med == RIB_MISSING else str(med), '', '')
+
+    def sort_keys(self, field):
+        """查询结果列表按列排序时使用的键，直接由列数据得到"""
+        if field == 'prefix':
+            return [key << 6 | length for key, length in zip(self.prefixes, self.lengths)]
+        if field in ('next_hop', 'as_path'):
+            ids, table = ((self.next_hops, self.next_hop_table) if field == 'next_hop'
+                          else (self.as_paths, self.as_path_table))
+            rank = [0] * len(table)
+            for position, index in enumerate(sorted(range(len(table)), key=table.__getitem__)):
+                rank[index] = position
+            return [rank[i] for i in ids]
+        if field == 'med':
+            return self.meds
+        if field == 'local_pref':
+            return self.local_prefs
+        if field == 'active':
+            return self.flags
+        # 其余列在全表中取值相同，保持原顺序
+        return bytes(len(self))
+
+    def search(self, text):
+        """过滤：下一跳、AS path或前缀包含text的路由行号。字符串表很小，先在表中匹配再按编号筛选；
+        前缀在拼接好的全部前缀文本中查找，不逐行格式化"""
+        text = text.lower()
+        next_hop_match = {i for i, value in enumerate(self.next_hop_table) if text in value.lower()}
+        as_path_match = {i for i, value in enumerate(self.as_path_table) if text in value.lower()}
+        matched = set()
+        if next_hop_match or as_path_match:
+            matched.update(i for i, (next_hop, as_path) in enumerate(zip(self.next_hops, self.as_paths))
+                           if next_hop in next_hop_match or as_path in as_path_match)
+        if text and all(c in '0123456789./' for c in text):
+            matched.update(self._search_prefixes(text))
+        return sorted(matched)
+
+    def _search_prefixes(self, text):
+        if self._prefix_text is None:
+            octets = [str(value) for value in range(256)]
+            lines = [f"{octets[key >> 24]}.{octets[key >> 16 & 255]}.{octets[key >> 8 & 255]}.{octets[key & 255]}"
+                     f"/{length}\n" for key, length in zip(self.prefixes, self.lengths)]
+            starts = array.array('Q', itertools.accumulate(map(len, lines), initial=0))
+            self._prefix_text = (''.join(lines), starts)
+        blob, starts = self._prefix_text
+        rows = []
+        position = blob.find(text)
+        while position >= 0:
+            row = bisect.bisect_right(starts, position) - 1
+            rows.append(row)
+            # 同一行只记录一次，从下一行开始继续查找
+            position = blob.find(text, starts[row + 1])
+        return rows
+
+    def summary(self):
+        return (f"{len(self)}条路由, 下一跳{len(self.next_hop_table)}个, AS path {len(self.as_path_table)}种"
+                + (f", 跳过非IPv4路由{self.skipped}条" if self.skipped else ""))
+
+    def save(self, path):
+        """写入文件：魔数、头部长度、JSON头部(说明信息、字符串表、各列位置)，之后是按8字节对齐的各列原始数据"""
+        columns, offset = [], 0
+        for name, typecode in self.COLUMNS:
+            size = len(getattr(self, name)) * array.array(typecode).itemsize
+            columns.append([name, typecode, offset, size])
+            offset += (size + 7) // 8 * 8
+        header = json.dumps({
+            'meta': self.meta, 'byteorder': sys.byteorder, 'count': len(self), 'skipped': self.skipped,
+            'next_hop_table': self.next_hop_table, 'as_path_table': self.as_path_table, 'columns': columns,
+        }, ensure_ascii=False).encode('utf-8')
+        header += b' ' * (-(len(self.MAGIC) + 8 + len(header)) % 8)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.MAGIC + struct.pack('<Q', len(header)) + header)
+            for name, _, _, size in columns:
+                f.write(getattr(self, name).tobytes())
+                f.write(b'\0' * (-size % 8))
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """用mmap映射文件，各列直接作为memoryview使用，载入耗时与路由条数无关"""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(cls.MAGIC)] != cls.MAGIC:
+            mapped.close()
+            raise Exception(f"不是全表文件: {path}")
+        start = len(cls.MAGIC) + 8
+        header_length = struct.unpack('<Q', mapped[len(cls.MAGIC):start])[0]
+        header = json.loads(mapped[start:start + header_length].decode('utf-8'))
+        data_start = start + header_length
+        table = cls(header['meta'])
+        view = memoryview(mapped)
+        for name, typecode, offset, size in header['columns']:
+            column = view[data_start + offset:data_start + offset + size].cast(typecode)
+            if header['byteorder'] != sys.byteorder:
+                # 在字节序不同的机器上生成的文件，复制后转换
+                column = array.array(typecode, column)
+                column.byteswap()
+            setattr(table, name, column)
+        table.next_hop_table, table.as_path_table = header['next_hop_table'], header['as_path_table']
+        table.skipped = header['skipped']
+        table._mmap, table._view = mapped, view
+        return table
+
+    def close(self):
+        """释放文件映射"""
+        if self._mmap is None:
+            return
+        for name, typecode in self.COLUMNS:
+            column = getattr(self, name)
+            if isinstance(column, memoryview):
+                column.release()
+            setattr(self, name, array.array(typecode))
+        self._prefix_text = None
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._mmap = None
+
+
+class RibIngest:
+    """全表导入：逐行接收表格格式的路由输出，每rib_chunk_lines行交给进程池解析，按提交顺序合并到RibTable。
+    进程池无法使用时在当前线程解析"""
+
+    def __init__(self, table, chunk_lines=rib_chunk_lines, workers=rib_parse_workers, on_progress=None):
+        self.table = table
+        self.chunk_lines = chunk_lines
+        self.workers = workers
+        self.on_progress = on_progress  # 每合并一块时以已解析的路由条数调用
+        self.columns = None
+        self.lines = []
+        self.pending = deque()
+        self.executor = None
+        try:
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        except (OSError, ValueError, NotImplementedError):
+            self.executor = None
+
+    def add_line(self, line):
+        if 'Nexthop' in line and ROUTE_TABLE_HEADER_PATTERN.match(line):
+            # 每个路由表都有自己的表头，列位置可能不同
+            self._submit()
+            self.columns = route_table_columns(line.expandtabs())
+            return
+        if self.columns is None:
+            return
+        self.lines.append(line)
+        if len(self.lines) >= self.chunk_lines:
+            self._submit()
+
+    def _submit(self):
+        if not self.lines:
+            return
+        text, self.lines = '\n'.join(self.lines), []
+        future = None
+        if self.executor is not None:
+            try:
+                future = self.executor.submit(parse_rib_chunk, text, self.columns)
+            except Exception:
+                self.executor = None
+        if future is None:
+            future = Future()
+            future.set_result(parse_rib_chunk(text, self.columns))
+        self.pending.append(future)
+        # 按顺序合并已完成的块；未完成的块过多时等待，限制内存中的输出量
+        while self.pending and (self.pending[0].done() or len(self.pending) > self.workers * 2):
+            self._merge(self.pending.popleft())
+
+    def _merge(self, future):
+        self.table.add_chunk(future.result())
+        if self.on_progress:
+            self.on_progress(len(self.table))
+
+    def finish(self):
+        """提交剩余行并等待全部解析完成，返回RibTable"""
+        self._submit()
+        try:
+            while self.pending:
+                self._merge(self.pending.popleft())
+        finally:
+            self.close()
+        return self.table
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+def parse_config_element(elem, stack):
+    """configuration中的 prefix-list / firewall filter term / static route 元素 -> 配置记录"""
+    tag = _local_tag(elem)
+    parent = stack[-2] if len(stack) > 1 else ''
+
+    if tag == 'prefix-list' and parent == 'policy-options':
+        name = _child_text(elem, 'name')
+        return [PrefixListItem(name, prefix) for prefix in _children_text(elem, 'prefix-list-item', 'name')]
+
+    if tag == 'term' and parent == 'filter':
+        from_elem = _child(elem, 'from')
+        if from_elem is None:
+            return []
+        return [FirewallTermAddress(stack.filter_name, _child_text(elem, 'name'), address)
+                for address in _children_text(from_elem, 'source-address', 'name')]
+
+    if tag == 'route' and parent == 'static':
+        next_hops = _children_text(elem, 'next-hop') + _children_text(elem, 'qualified-next-hop', 'name')
+        return [StaticRoute(_child_text(elem, 'name'), tuple(next_hops), _child(elem, 'discard') is not None)]
+
+    return []
+
+
+class _ElementStack(list):
+    """XML解析时的元素路径栈，额外记录当前firewall filter的名字"""
+    filter_name = ''
+
+
+class JunosXmlStream:
+    """把CLI输出中的 | display xml 文档增量喂给XMLPullParser，元素结束时立即转换为记录并释放，
+    不在内存中保留整个文档"""
+
+    END_TAG = '</rpc-reply>'
+    # 由handler处理后释放的元素，处理完后清空并从父元素上摘除
+    record_tags = ('rt', 'prefix-list', 'term', 'route')
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.parser = ET.XMLPullParser(events=('start', 'end'))
+        self.stack = _ElementStack()
+        self._elements = []  # 与stack对应的未结束元素，用于找到父元素
+        self.started = False
+        self.done = False
+        self._pending = ''
+        self._tail = ''
+
+    def feed(self, text):
+        """喂入一段CLI输出，返回本次新解析出的记录"""
+        if self.done:
+            return []
+        if not self.started:
+            # 跳过命令回显，从 <rpc-reply 开始解析
+            self._pending += text
+            start = self._pending.find('<rpc-reply')
+            if start < 0:
+                self._pending = self._pending[-len('<rpc-reply'):]
+                return []
+            text = self._pending[start:]
+            self._pending = ''
+            self.started = True
+
+        # 文档结束后的内容(设备提示符)不再交给解析器
+        combined = self._tail + text
+        end = combined.find(self.END_TAG)
+        if end >= 0:
+            text = text[:end + len(self.END_TAG) - len(self._tail)]
+            self.done = True
+        self._tail = combined[-len(self.END_TAG):]
+
+        self.parser.feed(text)
+        return self._read_events()
+
+    def _read_events(self):
+        records = []
+        for event, elem in self.parser.read_events():
+            tag = _local_tag(elem)
+            if event == 'start':
+                self.stack.append(tag)
+                self._elements.append(elem)
+                continue
+            if tag == 'name' and len(self.stack) > 1 and self.stack[-2] == 'filter':
+                self.stack.filter_name = (elem.text or '').strip()
+            records.extend(self.handler(elem, self.stack))
+            self._elements.pop()
+            if tag in self.record_tags:
+                # 只清空会在父元素上留下空的子元素，百万条路由时根元素仍持续增长
+                elem.clear()
+                if self._elements:
+                    self._elements[-1].remove(elem)
+            self.stack.pop()
+        return records
+
+
+class _GcPause:
+    """批量创建对象时暂停分代GC。多个线程可同时进入，由最后一个退出的线程恢复进入前的状态"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._was_enabled = False
+
+    def __enter__(self):
+        with self._lock:
+            if self._depth == 0:
+                self._was_enabled = gc.isenabled()
+                gc.disable()
+            self._depth += 1
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self._depth -= 1
+            if self._depth == 0 and self._was_enabled:
+                gc.enable()
+
+
+_gc_pause = _GcPause()
+
+
+class ConfigModel:
+    """设备配置的索引结构，由一次 show configuration | display set 单遍解析得到。
+    集合均使用dict(保持插入顺序，查重为O(1))"""
+
+    # 只有这些开头的行需要分词，其余行直接跳过
+    line_prefixes = ('set policy-options prefix-list ', 'set firewall ', 'set routing-options static route ')
+
+    def __init__(self):
+        self.prefix_lists = {}  # prefix-list名 -> {前缀: None}
+        self.firewall_filters = {}  # filter名 -> {term名: {源地址: None}}
+        self.static_routes = {}  # 前缀 -> {下一跳: None}
+        self.discard_routes = {}  # 黑洞路由前缀 -> None
+        self.line_count = 0
+        self._prefix_index = None  # 网段前缀树，首次查询时构建
+
+    def add_set_line(self, line):
+        """解析一行display set配置"""
+        self.line_count += 1
+        line = line.strip()
+        if not line.startswith(self.line_prefixes):
+            return
+        tokens = line.split()
+        head = tokens[1]
+
+        if head == 'policy-options':
+            # set policy-options prefix-list <名称> <前缀>
+            if len(tokens) == 5 and '/' in tokens[4]:
+                self.prefix_lists.setdefault(tokens[3], {})[tokens[4]] = None
+
+        elif head == 'firewall':
+            # set firewall [family inet] filter <filter> term <term> from source-address <地址>
+            offset = 4 if tokens[2] == 'family' else 2
+            if (len(tokens) > offset + 6 and tokens[offset] == 'filter' and tokens[offset + 2] == 'term'
+                    and tokens[offset + 4] == 'from' and tokens[offset + 5] == 'source-address'):
+                terms = self.firewall_filters.setdefault(tokens[offset + 1], {})
+                terms.setdefault(tokens[offset + 3], {})[tokens[offset + 6]] = None
+
+        elif len(tokens) > 5:
+            # set routing-options static route <前缀> next-hop|qualified-next-hop <下一跳> / discard
+            prefix, attribute = tokens[4], tokens[5]
+            if attribute in ('next-hop', 'qualified-next-hop') and len(tokens) > 6:
+                self.static_routes.setdefault(prefix, {})[tokens[6]] = None
+            elif attribute == 'discard':
+                self.discard_routes[prefix] = None
+
+    def apply_commands(self, commands):
+        """把已提交的set/delete命令应用到模型，与设备上的配置变化保持一致"""
+        self._prefix_index = None
+        for cmd in commands:
+            tokens = cmd.split()
+            if not tokens:
+                continue
+            if tokens[0] == 'set':
+                self.add_set_line(' '.join(tokens))
+            elif tokens[0] == 'delete':
+                self.delete_statement(tokens[1:])
+
+    def delete_statement(self, path):
+        """删除配置层级，path为去掉delete后的各个词"""
+        if len(path) >= 3 and path[:2] == ['policy-options', 'prefix-list']:
+            if len(path) == 3:
+                self.prefix_lists.pop(path[2], None)
+            else:
+                self.prefix_lists.get(path[2], {}).pop(path[3], None)
+
+        elif len(path) >= 3 and path[0] == 'firewall':
+            offset = 3 if path[1] == 'family' else 1
+            terms = self.firewall_filters.get(path[offset + 1], {}) if len(path) > offset + 1 else {}
+            if len(path) == offset + 2:
+                self.firewall_filters.pop(path[offset + 1], None)
+            elif len(path) == offset + 4:
+                terms.pop(path[offset + 3], None)
+            elif len(path) > offset + 6 and path[offset + 5] == 'source-address':
+                addresses = terms.get(path[offset + 3], {})
+                addresses.pop(path[offset + 6], None)
+                if not addresses:
+                    terms.pop(path[offset + 3], None)
+
+        elif len(path) >= 4 and path[:3] == ['routing-options', 'static', 'route']:
+            prefix = path[3]
+            if len(path) == 4:
+                self.static_routes.pop(prefix, None)
+                self.discard_routes.pop(prefix, None)
+            elif path[4] == 'discard':
+                self.discard_routes.pop(prefix, None)
+            elif path[4] in ('next-hop', 'qualified-next-hop') and len(path) > 5:
+                next_hops = self.static_routes.get(prefix, {})
+                next_hops.pop(path[5], None)
+                if not next_hops:
+                    self.static_routes.pop(prefix, None)
+
+    def add_record(self, record):
+        """加入一条结构化(XML)解析得到的配置记录"""
+        if isinstance(record, PrefixListItem):
+            self.prefix_lists.setdefault(record.name, {})[record.prefix] = None
+        elif isinstance(record, FirewallTermAddress):
+            self.firewall_filters.setdefault(record.filter, {}).setdefault(record.term, {})[record.address] = None
+        elif isinstance(record, StaticRoute):
+            if record.discard:
+                self.discard_routes[record.prefix] = None
+            for next_hop in record.next_hops:
+                self.static_routes.setdefault(record.prefix, {})[next_hop] = None
+
+    def to_dict(self):
+        """转换为可JSON序列化的dict，用于保存快照"""
+        return {
+            'prefix_lists': {name: list(values) for name, values in self.prefix_lists.items()},
+            'firewall_filters': {name: {term: list(addresses) for term, addresses in terms.items()}
+                                 for name, terms in self.firewall_filters.items()},
+            'static_routes': {prefix: list(next_hops) for prefix, next_hops in self.static_routes.items()},
+            'discard_routes': list(self.discard_routes),
+            'line_count': self.line_count,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """由to_dict的结果还原模型"""
+        model = cls()
+        model.prefix_lists = {name: dict.fromkeys(values) for name, values in data['prefix_lists'].items()}
+        model.firewall_filters = {name: {term: dict.fromkeys(addresses) for term, addresses in terms.items()}
+                                  for name, terms in data['firewall_filters'].items()}
+        model.static_routes = {prefix: dict.fromkeys(next_hops) for prefix, next_hops in data['static_routes'].items()}
+        model.discard_routes = dict.fromkeys(data['discard_routes'])
+        model.line_count = data['line_count']
+        return model
+
+    def prefix_index(self):
+        """返回配置中所有网段的前缀树，首次调用时构建，apply_commands后重建"""
+        if self._prefix_index is None:
+            self._prefix_index = self.build_prefix_index()
+        return self._prefix_index
+
+    def build_prefix_index(self):
+        """把prefix-list、firewall term、静态路由和黑洞路由中的网段放入一棵前缀树，条目为(类别, 名称)"""
+        index = PrefixTrie()
+        # 一次创建大量节点，暂停分代GC避免反复扫描整棵树；多台设备同时构建时共用同一计数
+        with _gc_pause:
+            self._fill_prefix_index(index)
+        return index
+
+    def _fill_prefix_index(self, index):
+
+        def add(prefix, entry):
+            # 设备上的配置已通过校验，不带掩码的主机地址按/32或/128处理
+            try:
+                index.insert(prefix, entry)
+            except ValueError:
+                pass
+
+        for name, prefixes in self.prefix_lists.items():
+            for prefix in prefixes:
+                add(prefix, ('prefix-list', name))
+        for filter_name, terms in self.firewall_filters.items():
+            for term, addresses in terms.items():
+                for address in addresses:
+                    add(address, ('firewall', f"{filter_name} term {term}"))
+        for prefix, next_hops in self.static_routes.items():
+            add(prefix, ('静态路由', 'next-hop ' + ' '.join(next_hops)))
+        for prefix in self.discard_routes:
+            add(prefix, ('黑洞路由', 'discard'))
+
+    @classmethod
+    def from_set_output(cls, output):
+        model = cls()
+        for line in output.splitlines():
+            model.add_set_line(line)
+        return model
+
+    def summary(self):
+        term_count = sum(len(terms) for terms in self.firewall_filters.values())
+        return (f"prefix-list {len(self.prefix_lists)}个, firewall term {term_count}个, "
+                f"静态路由 {len(self.static_routes)}条, 黑洞路由 {len(self.discard_routes)}条")
+
+
+class ConfigSnapshotStore:
+    """按设备保存配置快照的SQLite存储，模型以zlib压缩的JSON保存。
+    界面线程和队列线程共用一个连接，由锁串行访问"""
+
+    def __init__(self, path=config_snapshot_db):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshot ("
+                "device TEXT PRIMARY KEY, commit_id TEXT, saved_at REAL NOT NULL, data BLOB NOT NULL)"
+            )
+
+    def save(self, device_name, commit_id, model, saved_at=None):
+        data = zlib.compress(json.dumps(model.to_dict(), separators=(',', ':')).encode('utf-8'))
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO snapshot (device, commit_id, saved_at, data) VALUES (?, ?, ?, ?)",
+                (device_name, commit_id, saved_at or time.time(), data)
+            )
+
+    def load(self, device_name):
+        """返回 {'commit_id', 'saved_at', 'model'}，没有快照或快照损坏时返回None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT commit_id, saved_at, data FROM snapshot WHERE device = ?", (device_name,)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            model = ConfigModel.from_dict(json.loads(zlib.decompress(row[2]).decode('utf-8')))
+        except (zlib.error, ValueError, KeyError):
+            self.delete(device_name)
+            return None
+        return {'commit_id': row[0], 'saved_at': row[1], 'model': model}
+
+    def delete(self, device_name):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM snapshot WHERE device = ?", (device_name,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def split_prefixes(lines, versions=(4, 6)):
+    """把输入的多行网段分为有效(规范化后的字符串)和无效两组，忽略空行。
+    必须带掩码，地址、掩码长度越界或主机位不为0均视为无效"""
+    valid, invalid = [], []
+    for line in lines:
+        text = line.strip()
+        if not text:
+            continue
+        try:
+            if '/' not in text:
+                raise ValueError(text)
+            version, key, length = prefix_key(text, strict=True)
+        except ValueError:
+            invalid.append(text)
+            continue
+        if version in versions:
+            valid.append(format_prefix(version, key, length))
+        else:
+            invalid.append(text)
+    return valid, invalid
+
+
+def prefix_key(prefix, strict=False):
+    """把 地址/掩码(或主机地址) 转换为(版本, 网络地址整数, 掩码长度)，主机位清零，strict为True时主机位不为0视为无效；
+    用socket解析，比ipaddress快一个数量级，适合大量配置条目建索引"""
+    address, _, length = prefix.strip().partition('/')
+    try:
+        if ':' in address:
+            version, bits, key = 6, 128, int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+        else:
+            version, bits, key = 4, 32, int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+        length = int(length) if length else bits
+    except (OSError, ValueError):
+        raise ValueError(f"无效的网段: {prefix}")
+    network_key = key >> (bits - length) << (bits - length) if 0 <= length <= bits else None
+    if network_key is None or (strict and network_key != key):
+        raise ValueError(f"无效的网段: {prefix}")
+    return version, network_key, length
+
+
+def format_prefix(version, key, length):
+    """prefix_key的逆过程，格式与ipaddress一致"""
+    if version == 4:
+        return f"{socket.inet_ntop(socket.AF_INET, key.to_bytes(4, 'big'))}/{length}"
+    return f"{ipaddress.IPv6Address(key)}/{length}"
+
+
+def collapse_prefixes(keys, bits):
+    """合并同一地址族的网段：去掉被覆盖的网段，相邻的两个同长度网段合并为上一级，重复直到不能合并。
+    keys为[(网络地址整数, 掩码长度)]，返回合并后按地址排序的列表"""
+    stack = []
+    # 按地址排序后，覆盖某网段的网段一定排在它前面并位于栈顶
+    for key, length in sorted(set(keys)):
+        if stack:
+            top_key, top_length = stack[-1]
+            if top_length <= length and not (key ^ top_key) >> (bits - top_length):
+                continue
+        stack.append((key, length))
+        while len(stack) >= 2:
+            (key_a, length_a), (key_b, length_b) = stack[-2], stack[-1]
+            size = 1 << (bits - length_a) if length_a else 0
+            if length_a != length_b or not size or key_a & size or key_b != key_a + size:
+                break
+            stack[-2:] = [(key_a, length_a - 1)]
+    return stack
+
+
+def read_prefix_file(file_path, versions=(4, 6)):
+    """读取批量导入文件：每行取第一个字段(允许 ; , # 后的备注)，不带掩码的地址按主机地址处理。
+    返回(规范化后去重的网段列表, 无效行列表)"""
+    tokens = []
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            token = re.split(r'[\s;,#]', line.strip(), maxsplit=1)[0]
+            if token:
+                tokens.append(token if '/' in token else token + ('/128' if ':' in token else '/32'))
+    valid, invalid = split_prefixes(dict.fromkeys(tokens), versions)
+    return list(dict.fromkeys(valid)), invalid
+
+
+def plan_prefix_import(existing, new_prefixes, aggregate=True):
+    """计算批量导入需要下发的最少配置：与已有条目去重，aggregate为True时把已有和新增网段
+    一起合并相邻/重叠的网段。返回(需要set的网段, 需要delete的已有条目)"""
+    # 已有条目按规范化形式比较，如不带掩码的主机地址 1.1.1.1 等同于 1.1.1.1/32
+    canonical = {}
+    for prefix in existing:
+        try:
+            canonical[format_prefix(*prefix_key(prefix))] = prefix
+        except ValueError:
+            continue
+    if not aggregate:
+        return [prefix for prefix in dict.fromkeys(new_prefixes) if prefix not in canonical], []
+
+    keys = {4: [], 6: []}
+    for prefix in itertools.chain(canonical, new_prefixes):
+        version, key, length = prefix_key(prefix)
+        keys[version].append((key, length))
+    target = {format_prefix(version, key, length): None
+              for version, bits in ((4, 32), (6, 128)) for key, length in collapse_prefixes(keys[version], bits)}
+    to_set = [prefix for prefix in target if prefix not in canonical]
+    to_delete = [original for prefix, original in canonical.items() if prefix not in target]
+    return to_set, to_delete
+
+
+class _TrieNode:
+    __slots__ = ('key', 'length', 'children', 'entries')
+
+    def __init__(self, key, length):
+        self.key = key  # 网络地址的整数值
+        self.length = length  # 掩码长度
+        self.children = [None, None]
+        self.entries = None  # 该网段上的条目列表，中间分叉节点为None
+
+
+class PrefixTrie:
+    """IPv4/IPv6 路径压缩二叉前缀树(Patricia)，节点数不超过条目数的两倍，
+    最长匹配、覆盖和重叠查询只需沿掩码长度走一遍"""
+
+    def __init__(self):
+        self.roots = {4: _TrieNode(0, 0), 6: _TrieNode(0, 0)}
+        self.count = 0
+
+    @staticmethod
+    def _common_length(a, b, limit, bits):
+        """两个地址从高位起相同的位数，最多limit位"""
+        diff = (a ^ b) >> (bits - limit) if limit else 0
+        return limit - diff.bit_length()
+
+    def insert(self, prefix, entry):
+        version, key, length = prefix_key(str(prefix))
+        bits = 32 if version == 4 else 128
+        node = self.roots[version]
+        self.count += 1
+        while True:
+            if node.length == length:
+                if node.entries is None:
+                    node.entries = []
+                node.entries.append(entry)
+                return
+            bit = (key >> (bits - 1 - node.length)) & 1
+            child = node.children[bit]
+            if child is None:
+                leaf = node.children[bit] = _TrieNode(key, length)
+                leaf.entries = [entry]
+                return
+            if child.length <= length and not (key ^ child.key) >> (bits - child.length):
+                node = child
+                continue
+            common = self._common_length(child.key, key, min(child.length, length), bits)
+            # 在分叉处插入新节点，新网段本身就是分叉点时条目直接放在该节点上
+            mask = ((1 << common) - 1) << (bits - common)
+            fork = node.children[bit] = _TrieNode(key & mask, common)
+            fork.children[(child.key >> (bits - 1 - common)) & 1] = child
+            if common == length:
+                fork.entries = [entry]
+            else:
+                leaf = fork.children[(key >> (bits - 1 - common)) & 1] = _TrieNode(key, length)
+                leaf.entries = [entry]
+            return
+
+    def _walk(self, version, key, length):
+        """沿查询网段向下走，返回(覆盖查询网段的节点列表, 第一个比查询网段更具体的节点)"""
+        bits = 32 if version == 4 else 128
+        node = self.roots[version]
+        covering = []
+        while node is not None:
+            if node.length > length:
+                # 节点比查询网段更具体，前length位相同时其子树都落在查询网段内
+                if self._common_length(node.key, key, length, bits) == length:
+                    return covering, node
+                return covering, None
+            if self._common_length(node.key, key, node.length, bits) < node.length:
+                return covering, None
+            if node.entries:
+                covering.append(node)
+            if node.length == length:
+                return covering, node
+            node = node.children[(key >> (bits - 1 - node.length)) & 1]
+        return covering, None
+
+    @staticmethod
+    def _node_network(node, version):
+        address = ipaddress.IPv4Address(node.key) if version == 4 else ipaddress.IPv6Address(node.key)
+        return f"{address}/{node.length}"
+
+    def covering(self, prefix):
+        """包含查询网段(含相同网段)的所有条目，从粗到细排列，返回[(网段, 条目)]"""
+        version, key, length = prefix_key(str(prefix))
+        covering, _ = self._walk(version, key, length)
+        return [(self._node_network(node, version), entry) for node in covering for entry in node.entries]
+
+    def longest_match(self, prefix):
+        """最长匹配的条目列表，返回[(网段, 条目)]，无匹配时为空"""
+        version, key, length = prefix_key(str(prefix))
+        covering, _ = self._walk(version, key, length)
+        if not covering:
+            return []
+        node = covering[-1]
+        return [(self._node_network(node, version), entry) for entry in node.entries]
+
+    def more_specifics(self, prefix):
+        """落在查询网段内且比它更具体的所有条目，返回[(网段, 条目)]"""
+        version, key, length = prefix_key(str(prefix))
+        _, top = self._walk(version, key, length)
+        result = []
+        stack = [top] if top is not None else []
+        while stack:
+            node = stack.pop()
+            if node.entries and node.length > length:
+                result.extend((self._node_network(node, version), entry) for entry in node.entries)
+            stack.extend(child for child in reversed(node.children) if child is not None)
+        return result
+
+    def overlapping(self, network):
+        """与查询网段有重叠的所有条目(覆盖它的和它包含的)"""
+        return self.covering(network) + self.more_specifics(network)
+
+
+DEVICE_FILE_COLUMNS = ['设备名称', '设备IP', '设备登陆方式', '设备登陆端口', '用户名', '密码', '线路名称', '线路IP']
+# 可选列：设备所在站点、线路所属运营商，用于设备查找
+DEVICE_SITE_COLUMN = '站点'
+LINE_ISP_COLUMN = '运营商'
+
+
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+XLSX_PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+def _xlsx_column_index(letters):
+    """列字母对应的列号，如 A -> 0, AB -> 27"""
+    index = 0
+    for char in letters:
+        index = index * 26 + ord(char) - 64
+    return index - 1
+
+
+def _xlsx_number(text):
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def _xlsx_text(elem):
+    """共享字符串或内联字符串的文本：直接的<t>或富文本的<r><t>，不包括拼音注释<rPh>"""
+    return ''.join(t.text or '' for t in itertools.chain(elem.findall(XLSX_NS + 't'),
+                                                         elem.findall(f'{XLSX_NS}r/{XLSX_NS}t')))
+
+
+def read_xlsx_rows(file_path):
+    """流式读取xlsx第一个工作表，逐行返回单元格值列表(空单元格为None)。
+    只解析共享字符串和工作表XML，不依赖pandas/openpyxl"""
+    columns = {}  # 列字母 -> 列号
+    with zipfile.ZipFile(file_path) as book:
+        shared = []
+        if 'xl/sharedStrings.xml' in book.namelist():
+            with book.open('xl/sharedStrings.xml') as f:
+                root = None
+                for event, elem in ET.iterparse(f, events=('start', 'end')):
+                    if root is None:
+                        root = elem
+                    elif event == 'end' and elem.tag == XLSX_NS + 'si':
+                        shared.append(_xlsx_text(elem))
+                        root.remove(elem)  # 已读取的字符串从根元素上摘除，不再占用内存
+
+        # 工作簿中的第一个工作表，通过关系文件找到对应的XML
+        workbook = ET.fromstring(book.read('xl/workbook.xml'))
+        sheet_id = workbook.find(f'{XLSX_NS}sheets/{XLSX_NS}sheet').get(XLSX_REL_NS + 'id')
+        rels = ET.fromstring(book.read('xl/_rels/workbook.xml.rels'))
+        target = next(rel.get('Target') for rel in rels.iter(XLSX_PACKAGE_REL_NS + 'Relationship')
+                      if rel.get('Id') == sheet_id)
+        sheet_path = target.lstrip('/') if target.startswith('/') else 'xl/' + target
+
+        row_tag, cell_tag, value_tag, inline_tag = (XLSX_NS + tag for tag in ('row', 'c', 'v', 'is'))
+        with book.open(sheet_path) as f:
+            sheet_data = None
+            for event, elem in ET.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    if elem.tag == XLSX_NS + 'sheetData':
+                        sheet_data = elem
+                    continue
+                if elem.tag != row_tag:
+                    continue
+                row = []
+                for cell in elem.iterfind(cell_tag):
+                    cell_type = cell.get('t')
+                    if cell_type == 'inlineStr':
+                        value = _xlsx_text(cell.find(inline_tag))
+                    else:
+                        value = cell.findtext(value_tag)
+                        if value is None:
+                            continue
+                        if cell_type == 's':
+                            value = shared[int(value)]
+                        elif cell_type == 'b':
+                            value = value == '1'
+                        elif cell_type not in ('str', 'e'):
+                            value = _xlsx_number(value)
+                    ref = cell.get('r')
+                    if ref:
+                        letters = ref.rstrip('0123456789')
+                        column = columns.get(letters)
+                        if column is None:
+                            column = columns[letters] = _xlsx_column_index(letters)
+                    else:
+                        column = len(row)
+                    row.extend([None] * (column + 1 - len(row)))
+                    row[column] = value
+                # 已读取的行从sheetData上摘除，百万行的工作表也只占用一行的内存
+                sheet_data.remove(elem)
+                yield row
+
+
+def read_csv_rows(file_path):
+    """读取CSV格式的设备信息(UTF-8，可带BOM)，单元格均保留为字符串(如密码0123)，端口在编译时转换"""
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+        for row in csv.reader(f):
+            yield [value or None for value in row]
+
+
+def compile_inventory(rows):
+    """第一行为表头，单遍把设备/线路行按设备名称分组为 {设备名: {ip, port, ..., lines: [{line_name, line_ip}]}}"""
+    rows = iter(rows)
+    header = [str(value).strip() if value is not None else '' for value in next(rows, [])]
+    # 检查必要列是否存在
+    for col in DEVICE_FILE_COLUMNS:
+        if col not in header:
+            raise Exception(f"Excel文件中缺少必要的列: {col}")
+    (name_col, ip_col, method_col, port_col, user_col, password_col, line_name_col,
+     line_ip_col) = (header.index(col) for col in DEVICE_FILE_COLUMNS)
+    site_col = header.index(DEVICE_SITE_COLUMN) if DEVICE_SITE_COLUMN in header else None
+    isp_col = header.index(LINE_ISP_COLUMN) if LINE_ISP_COLUMN in header else None
+    width = len(header)
+
+    devices = {}
+    for row in rows:
+        if len(row) < width:
+            row = row + [None] * (width - len(row))
+        device_name = row[name_col]
+        if device_name is None or device_name == '':
+            continue  # 空行
+        device_name = str(device_name)
+        device = devices.get(device_name)
+        if device is None:
+            device = devices[device_name] = {
+                'ip': row[ip_col],
+                'login_method': row[method_col],
+                'port': int(row[port_col]),
+                # Excel中纯数字的用户名/密码读出为数值，paramiko只接受字符串
+                'username': _inventory_credential(row[user_col]),
+                'password': _inventory_credential(row[password_col]),
+                'lines': []  # 存储该设备的所有线路
+            }
+            if site_col is not None:
+                device['site'] = row[site_col]
+
+        # 添加线路信息
+        line = {
+            'line_name': row[line_name_col],
+            'line_ip': row[line_ip_col]
+        }
+        if isp_col is not None:
+            line['isp'] = row[isp_col]
+        device['lines'].append(line)
+    return devices
+
+
+def _inventory_credential(value):
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+def _file_digest(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_device_file(file_path, cache_dir=inventory_cache_dir):
+    """读取设备信息文件(xlsx或csv)，按设备名称分组返回 {设备名: {ip, port, ..., lines: [{line_name, line_ip}]}}。
+    编译结果缓存在cache_dir中，文件大小和修改时间不变时直接使用；修改时间变化但内容未变时也沿用缓存。
+    缓存包含明文登录密码，与设备文件同等敏感，目录和文件只对当前用户可读写"""
+    stat = os.stat(file_path)
+    cache_path = None
+    cached = None
+    if cache_dir:
+        name = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:16]
+        cache_path = os.path.join(cache_dir, f"{name}.json")
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = None
+        if cached and cached.get('size') == stat.st_size and cached.get('mtime_ns') == stat.st_mtime_ns:
+            return cached['devices']
+
+    digest = _file_digest(file_path)
+    if cached and cached.get('sha1') == digest:
+        devices = cached['devices']
+    elif file_path.lower().endswith('.csv'):
+        devices = compile_inventory(read_csv_rows(file_path))
+    else:
+        devices = compile_inventory(read_xlsx_rows(file_path))
+
+    if cache_path:
+        try:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            temp_path = cache_path + '.tmp'
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            # 以0600权限新建，不经过默认umask创建的可读状态
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump({'source': os.path.abspath(file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                           'sha1': digest, 'devices': devices}, f, ensure_ascii=False)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass  # 缓存写入失败不影响使用
+    return devices
+
+
+def _inventory_text(value):
+    return '' if value is None else str(value).strip()
+
+
+class InventoryIndex:
+    """设备清单索引：按设备名+线路名、线路IP、站点和运营商直接查找，并提供设备/线路的模糊搜索。
+    每条线路为一行 (设备名, 线路名, 线路IP, 设备IP, 站点, 运营商)，可直接作为VirtualTreeview的行集合"""
+
+    COLUMNS = ('device', 'line', 'line_ip', 'device_ip', 'site', 'isp')
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.rows = []
+        self.lines = {}  # (设备名, 线路名) -> 线路
+        self.by_line_ip = {}  # 线路IP -> [(设备名, 线路)]
+        self.by_site = {}  # 站点 -> [设备名]
+        self.by_isp = {}  # 运营商 -> [(设备名, 线路)]
+        for device_name, device in devices.items():
+            device_name = str(device_name)
+            site = _inventory_text(device.get('site'))
+            if site:
+                self.by_site.setdefault(site, []).append(device_name)
+            for line in device['lines']:
+                line_name, line_ip = _inventory_text(line['line_name']), _inventory_text(line['line_ip'])
+                isp = _inventory_text(line.get('isp'))
+                self.lines.setdefault((device_name, line_name), line)
+                self.by_line_ip.setdefault(line_ip, []).append((device_name, line))
+                if isp:
+                    self.by_isp.setdefault(isp, []).append((device_name, line))
+                self.rows.append((device_name, line_name, line_ip, _inventory_text(device['ip']), site, isp))
+        self._search_text = ['\t'.join(row).lower() for row in self.rows]
+        self._last_search = ('', None)  # 上一次的搜索词和结果，继续输入时只在上次结果中查找
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+    def line(self, device_name, line_name):
+        """设备的指定线路，不存在时返回None"""
+        return self.lines.get((str(device_name), _inventory_text(line_name)))
+
+    def search(self, text):
+        """模糊搜索，返回按匹配程度排序的行号。空格分隔的每个词都要匹配：
+        设备名以该词开头最优，其次为连续出现在任一列中，最后为按字符顺序出现在同一列中(如 bjct 匹配 bj-ctc)"""
+        text = text.strip().lower()
+        last_text, last_hits = self._last_search
+        candidates = last_hits if last_hits is not None and last_text and text.startswith(last_text) \
+            else range(len(self.rows))
+        terms = [(token, re.compile('[^\t]*?'.join(map(re.escape, token)))) for token in text.split()]
+        scored = []
+        for i in candidates:
+            row_text = self._search_text[i]
+            score = 0
+            for token, pattern in terms:
+                position = row_text.find(token)
+                if position > 0:
+                    score += 1
+                elif position < 0:
+                    if not pattern.search(row_text):
+                        break
+                    score += 2
+            else:
+                # 匹配程度相同时设备名短的在前，精确的设备名排在最前
+                scored.append((score, len(self.rows[i][0]), i))
+        scored.sort()
+        hits = [i for _, _, i in scored]
+        self._last_search = (text, hits)
+        return hits
+
+
+COMMAND_SET_PATTERN = re.compile(r'^#\s*\[([^\]]+)\]\s*$')
+
+
+def read_command_sets(file_path):
+    """读取commands.txt中的命令组：以 #[组名] 开始一个组，组名之前的命令属于default组，其余#开头的行为注释。
+    另外返回包含全部命令的all组"""
+    command_sets = OrderedDict()
+    name = 'default'
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            match = COMMAND_SET_PATTERN.match(line)
+            if match:
+                name = match.group(1).strip()
+                command_sets.setdefault(name, [])
+            elif line and not line.startswith('#'):
+                command_sets.setdefault(name, []).append(line)
+    command_sets['all'] = list(OrderedDict.fromkeys(itertools.chain.from_iterable(command_sets.values())))
+    return command_sets
+
+
+class CronSchedule:
+    """5段cron表达式(分 时 日 月 周)，支持 * 、*/n、a-b、a-b/n、a/n(即a-最大值/n) 和逗号列表，周日为0或7"""
+
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron表达式应为5段: {expression}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse_field(field, low, high) for field, (low, high) in zip(fields, self.RANGES))
+        self.weekdays = {day % 7 for day in weekdays}
+        # 日和周都有限制时按标准cron语义，满足其一即可
+        self.day_or_weekday = fields[2] != '*' and fields[4] != '*'
+
+    @staticmethod
+    def _parse_field(field, low, high):
+        values = set()
+        for part in field.split(','):
+            part, _, step = part.partition('/')
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(value) for value in part.split('-', 1))
+            else:
+                start = int(part)
+                end = high if step else start
+            if not (low <= start <= end <= high):
+                raise ValueError(f"cron字段超出范围: {field}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def matches(self, moment):
+        if moment.minute not in self.minutes or moment.hour not in self.hours or moment.month not in self.months:
+            return False
+        day_match = moment.day in self.days
+        weekday_match = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.day_or_weekday:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+
+def read_schedule(file_path):
+    """读取定时巡检计划，每行: 分 时 日 月 周 命令组 [设备列表]，设备列表以逗号分隔，省略或*表示全部设备"""
+    entries = []
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split()
+            if len(fields) < 6:
+                raise ValueError(f"{file_path} 第{number}行格式错误: {line}")
+            devices = fields[6] if len(fields) > 6 else '*'
+            entries.append({
+                'cron': CronSchedule(' '.join(fields[:5])),
+                'command_set': fields[5],
+                'devices': None if devices == '*' else devices.split(','),
+                'line': line,
+            })
+    return entries
+
+
+class InspectionStore:
+    """巡检历史库：每次巡检一条runs记录，每条命令一条results记录(输出zlib压缩)。
+    使用WAL模式，巡检线程写入时不阻塞查询；多个巡检线程共用一个连接，由锁串行写入"""
+
+    def __init__(self, path=inspection_db):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, started REAL NOT NULL, device TEXT NOT NULL,"
+                " ip TEXT, command_set TEXT, status TEXT, elapsed REAL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS results (run_id INTEGER NOT NULL, seq INTEGER NOT NULL, command TEXT,"
+                " status TEXT, elapsed REAL, output BLOB, PRIMARY KEY (run_id, seq))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS runs_device_started ON runs (device, started)")
+
+    def add_run(self, device_name, ip, command_set, started, status, elapsed, results):
+        """写入一次巡检，results为[(命令, 状态, 耗时, 输出)]，在一个事务中提交"""
+        with self.lock, self.conn:
+            run_id = self.conn.execute(
+                "INSERT INTO runs (started, device, ip, command_set, status, elapsed) VALUES (?, ?, ?, ?, ?, ?)",
+                (started, device_name, ip, command_set, status, elapsed)
+            ).lastrowid
+            self.conn.executemany(
+                "INSERT INTO results (run_id, seq, command, status, elapsed, output) VALUES (?, ?, ?, ?, ?, ?)",
+                ((run_id, seq, command, result_status, result_elapsed, zlib.compress(output.encode('utf-8')))
+                 for seq, (command, result_status, result_elapsed, output) in enumerate(results))
+            )
+        return run_id
+
+    def purge(self, retention_days=inspection_retention_days):
+        """删除超过保留天数的巡检记录，返回删除的巡检次数"""
+        if not retention_days:
+            return 0
+        cutoff = time.time() - retention_days * 86400
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM results WHERE run_id IN (SELECT id FROM runs WHERE started < ?)", (cutoff,))
+            return self.conn.execute("DELETE FROM runs WHERE started < ?", (cutoff,)).rowcount
+
+    def history(self, device_name, command=None, limit=50):
+        """按时间倒序返回设备的巡检记录；指定command时返回该命令每次的 (时间, 状态, 耗时, 输出)"""
+        with self.lock:
+            if command is None:
+                return self.conn.execute(
+                    "SELECT started, command_set, status, elapsed FROM runs WHERE device = ?"
+                    " ORDER BY started DESC LIMIT ?", (device_name, limit)
+                ).fetchall()
+            rows = self.conn.execute(
+                "SELECT runs.started, results.status, results.elapsed, results.output FROM results"
+                " JOIN runs ON runs.id = results.run_id WHERE runs.device = ? AND results.command = ?"
+                " ORDER BY runs.started DESC LIMIT ?", (device_name, command, limit)
+            ).fetchall()
+        return [(started, status, elapsed, zlib.decompress(output).decode('utf-8'))
+                for started, status, elapsed, output in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def inspect_into_store(device_name, device_info, command_set, commands, store, log=print):
+    """登录一台设备执行一组巡检命令，每条命令的输出、耗时和状态写入历史库"""
+    started = time.time()
+    status, results, session = "完成", [], None
+    try:
+        session = connect_device(device_info, device_name=device_name)
+        timings = []
+        outputs = run_inspection(session, commands, timings=timings)
+        for cmd, output, elapsed in zip(commands, outputs, timings):
+            if isinstance(output, Exception):
+                results.append((cmd, f"失败: {str(output)}", elapsed, ''))
+            else:
+                results.append((cmd, "完成", elapsed, output))
+        failed = sum(1 for output in outputs if isinstance(output, Exception))
+        if failed:
+            status = f"{failed}条命令失败"
+    except paramiko.AuthenticationException:
+        status = "认证失败"
+    except Exception as e:
+        status = f"失败: {str(e)}"
+    finally:
+        if session:
+            session['client'].close()
+    elapsed = time.time() - started
+    store.add_run(device_name, device_info['ip'], command_set, started, status, elapsed, results)
+    log(f"{device_name} [{command_set}] {status}，{len(results)}条命令，耗时 {elapsed:.1f}秒")
+    return status
+
+
+class InspectionScheduler:
+    """无界面定时巡检：每分钟检查计划，到期的计划对其设备并行巡检。
+    同一计划在同一设备上的上一次巡检未结束时跳过本次，避免重叠"""
+
+    def __init__(self, devices, command_sets, schedule, store, log=print, max_workers=fleet_max_workers):
+        self.devices = devices
+        self.command_sets = command_sets
+        self.schedule = schedule
+        self.store = store
+        self.log = log
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.running = set()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def run_entry(self, entry):
+        """执行一条计划：提交到线程池，返回提交的Future列表"""
+        commands = self.command_sets.get(entry['command_set'])
+        if not commands:
+            self.log(f"⚠ 命令组 {entry['command_set']} 不存在或为空，跳过: {entry['line']}")
+            return []
+        futures = []
+        for device_name in entry['devices'] or list(self.devices):
+            if device_name not in self.devices:
+                self.log(f"⚠ 设备 {device_name} 不在设备文件中，跳过")
+                continue
+            key = (entry['line'], device_name)
+            with self.lock:
+                if key in self.running:
+                    self.log(f"⚠ {device_name} [{entry['command_set']}] 上一次巡检尚未结束，跳过本次")
+                    continue
+                self.running.add(key)
+            futures.append(self.executor.submit(self._inspect, key, device_name, entry['command_set'], commands))
+        return futures
+
+    def _inspect(self, key, device_name, command_set, commands):
+        try:
+            return profiler.run(f"inspection_{command_set}", device_name, inspect_into_store, device_name,
+                                self.devices[device_name], command_set, commands, self.store, self.log)
+        finally:
+            with self.lock:
+                self.running.discard(key)
+
+    def run_forever(self):
+        """阻塞运行，直到stop()；每天第一次检查时按保留天数清理历史记录"""
+        self.log(f"定时巡检已启动: {len(self.schedule)}条计划, {len(self.devices)}台设备")
+        purged_day = None
+        last_minute = None  # 已处理的最后一分钟
+        while not self.stop_event.is_set():
+            now = datetime.now().replace(second=0, microsecond=0)
+            if last_minute is not None and now <= last_minute:
+                # 提前醒来或系统时间被向回调整，同一分钟不重复触发
+                self.stop_event.wait(60 - datetime.now().second - datetime.now().microsecond / 1e6)
+                continue
+            last_minute = now
+            if now.date() != purged_day:
+                purged_day = now.date()
+                removed = self.store.purge()
+                if removed:
+                    self.log(f"已清理 {removed} 次超过 {inspection_retention_days} 天的巡检记录")
+            for entry in self.schedule:
+                if entry['cron'].matches(now):
+                    self.run_entry(entry)
+            # 上一分钟内完成的巡检耗时
+            spans.export()
+            # 等到下一分钟开始
+            self.stop_event.wait(60 - datetime.now().second - datetime.now().microsecond / 1e6)
+        self.executor.shutdown(wait=True)
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def run_headless(args):
+    """命令行入口：--schedule 按计划持续运行，--run-once 立即执行一个命令组后退出，--history 查看历史"""
+    def log(text):
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {text}", flush=True)
+
+    store = InspectionStore(args.db)
+    if os.environ.get(profile_env_var):
+        # 无界面时只为每次巡检生成报告，主线程只负责调度
+        profiler.on_report = lambda path: log(f"性能分析报告: {path}")
+        profiler.enable(main_thread=False)
+    try:
+        if args.history:
+            for started, command_set, status, elapsed in store.history(args.history):
+                print(f"{datetime.fromtimestamp(started):%Y-%m-%d %H:%M:%S}\t{command_set}\t{status}\t{elapsed:.1f}秒")
+            return
+
+        devices = load_device_file(args.devices)
+        command_sets = read_command_sets(args.commands)
+        if args.run_once:
+            entry = {'cron': None, 'command_set': args.run_once, 'line': f"run-once {args.run_once}",
+                     'devices': args.device.split(',') if args.device else None}
+            scheduler = InspectionScheduler(devices, command_sets, [entry], store, log)
+            for future in scheduler.run_entry(entry):
+                future.result()
+            scheduler.executor.shutdown()
+            spans.export()
+            return
+
+        scheduler = InspectionScheduler(devices, command_sets, read_schedule(args.schedule_file), store, log)
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            log("收到中断，等待正在进行的巡检结束...")
+            scheduler.stop()
+            scheduler.executor.shutdown(wait=True)
+            spans.export()
+    finally:
+        profiler.disable()
+        store.close()
+
+
+def format_route_records(records):
+    """把RouteRecord格式化为对齐的文本表格"""
+    header = f"{'Prefix':<20} {'Protocol':<12} {'Next-hop':<18} {'LocPref':<8} {'MED':<6} {'Age':<14} AS path"
+    lines = [header, '-' * len(header)]
+    for r in records:
+        protocol = f"{'*' if r.active else ' '}{r.protocol}/{r.preference}" if r.protocol else ('*' if r.active else '')
+        lines.append(f"{r.prefix:<20} {protocol:<12} {r.next_hop:<18} {r.local_pref:<8} {r.med:<6} "
+                     f"{r.age:<14} {r.as_path}")
+        if r.communities:
+            lines.append(f"{'':<20} Communities: {' '.join(r.communities)}")
+    return '\n'.join(lines) + '\n'
+
+
+# 配置管理与查询使用的命令，界面和脚本共用
+def prefix_list_commands(action, name, prefixes):
+    """公网线路prefix-list的set/delete命令，action为 set 或 delete"""
+    return [f"{action} policy-options prefix-list {name} {prefix}" for prefix in prefixes]
+
+
+def firewall_source_commands(action, term, prefixes, filter_name=fbf_filter_name):
+    """强制线路term源地址的set/delete命令"""
+    return [f"{action} firewall filter {filter_name} term {term} from source-address {prefix}" for prefix in prefixes]
+
+
+def static_route_commands(prefix, next_hop=route_next_hop):
+    # 此处命令以实际为准，可以只有一条，也可以添加tag、as-path、community等静态路由属性。
+    return [f"set routing-options static route {prefix} next-hop {next_hop}",
+            f"set routing-options static route {prefix} tag 888"]
+
+
+def discard_route_commands(prefix):
+    # 黑洞路由功能自定义，可以添加指定的tag、community等属性。
+    return [f"set routing-options static route {prefix} discard",
+            f"set routing-options static route {prefix} tag description"]
+
+
+def delete_static_route_command(prefix):
+    return f"delete routing-options static route {prefix}"
+
+
+def route_query_command(ip_range, line_ip=None, direction=None, extensive=False, structured=False):
+    """路由查询命令，direction为None(路由表)、'advertising'(发布)或'receive'(接收)"""
+    command = f"show route {ip_range}"
+    if direction:
+        command += f" {direction}-protocol bgp {line_ip}"
+    if structured:
+        return command + " | display xml | no-more"
+    return command + (" extensive" if extensive else "") + "|no-more"
+
+
+def rib_table_command(line_ip):
+    """全表导入命令：线路的整张接收路由表"""
+    return f'show route receive-protocol bgp {line_ip} table inet.0 | no-more'
+
+
+def isp_matrix_commands(ip_range, lines):
+    """全线路对比命令，每条线路依次为接收、发布两条，偶数下标为接收"""
+    commands = []
+    for line in lines:
+        commands.append(f"show route {ip_range} receive-protocol bgp {line['line_ip']} | no-more")
+        commands.append(f"show route {ip_range} advertising-protocol bgp {line['line_ip']} | no-more")
+    return commands
+
+
+def isp_matrix_cells(index, result):
+    """把全线路对比中一条命令的结果汇总为对比表单元格 {列名: 值}"""
+    if isinstance(result, Exception):
+        return {'received' if index % 2 == 0 else 'advertised': "失败"}
+    parser = RouteTextParser()
+    for text_line in result.split('\n'):
+        parser.add_line(text_line)
+    records = parser.finish()
+    best = next((r for r in records if r.active), records[0] if records else None)
+    if index % 2 == 0:
+        return {'received': f"是({len(records)})" if records else "否",
+                'receive_as_path': best.as_path if best else "",
+                'local_pref': best.local_pref if best else "",
+                'med': best.med if best else ""}
+    return {'advertised': f"是({len(records)})" if records else "否",
+            'advertise_as_path': best.as_path if best else ""}
+
+
+def download_config(cli, structured=False, log=None):
+    """下载完整配置，数据到达时逐行(或逐个XML元素)解析到ConfigModel"""
+    log = log or (lambda text: None)
+    model = ConfigModel()
+    if structured:
+        command = "show configuration | display xml | no-more"
+        log(f"执行命令: {command}\n")
+        stream = JunosXmlStream(parse_config_element)
+        parse_time = [0.0]
+
+        def on_data(data):
+            start = time.time()
+            for record in stream.feed(data):
+                model.add_record(record)
+            parse_time[0] += time.time() - start
+
+        cli.run(command, on_data=on_data)
+        spans.record('parse', parse_time[0], getattr(cli, 'device', None), command)
+        if not stream.started:
+            raise Exception("⚠ 设备未返回XML格式输出")
+    else:
+        command = "show configuration | display set | no-more"
+        log(f"执行命令: {command}\n")
+        cli.run(command, on_line=model.add_set_line)
+    return model
+
+
+def verify_config_applied(cli, commands, run_prefix=""):
+    """读取命令所在配置层级的 display set 输出，返回未生效的命令列表(为空表示全部生效)"""
+    if not commands:
+        return []
+    section = " ".join(config_verification_section(commands))
+    output = cli.run(f"{run_prefix}show configuration {section} | display set | no-more")
+    return find_unapplied_statements(commands, output)
+
+
+def apply_config(cli, commands, log=None):
+    """整批配置通过一次 load set terminal 载入，commit check 通过后 commit confirmed，
+    验证生效后再 commit 确认，并记录各阶段耗时。返回 {timings, base_commit_id, commit_id}"""
+    log = log or (lambda text: None)
+    device = getattr(cli, 'device', None)
+    statements = [cmd for cmd in commands if cmd.split() and cmd.split()[0] in ('set', 'delete')]
+    timings = []
+
+    def phase(name, func):
+        start_time = time.time()
+        status = 'error'
+        try:
+            result = func()
+            status = 'ok'
+            return result
+        finally:
+            timings.append((name, time.time() - start_time))
+            spans.record('config_phase', timings[-1][1], device, name, status)
+
+    def check(output, success_text, message):
+        errors = [line.strip() for line in output.splitlines() if CONFIG_ERROR_PATTERN.search(line)]
+        if errors or success_text not in output:
+            raise Exception(f"{message}: {errors[0] if errors else output.strip()[-200:]}")
+
+    base_commit_id = read_commit_id(cli)
+    commit_status = 'error'
+    try:
+        log("\n执行命令: configure exclusive\n")
+        output = phase("进入配置模式", lambda: cli.run("configure exclusive", on_data=log))
+        errors = [line.strip() for line in output.splitlines() if 'error:' in line]
+        if errors:
+            # 配置数据库被其他会话锁定等情况，设备仍停留在操作模式
+            raise Exception(errors[0])
+
+        confirmed = False
+        try:
+            if statements:
+                log(f"\n执行命令: load set terminal ({len(statements)}行)\n")
+                output = phase("载入配置", lambda: cli.run_input("load set terminal", statements))
+                check(output, "load complete", "载入配置失败")
+
+            output = phase("commit check", lambda: cli.run("commit check", on_data=log))
+            check(output, "configuration check succeeds", "提交检查失败")
+
+            if config_commit_confirmed_minutes:
+                output = phase("commit confirmed", lambda: cli.run(
+                    f"commit confirmed {config_commit_confirmed_minutes}", on_data=log))
+                check(output, "commit complete", "提交失败")
+                confirmed = True
+
+                # 验证通过后才确认提交，否则设备将在超时后自动回滚
+                unapplied = phase("验证配置", lambda: verify_config_applied(cli, statements, run_prefix="run "))
+                if unapplied:
+                    raise Exception(f"{len(unapplied)}条配置未生效，设备将在"
+                                    f"{config_commit_confirmed_minutes}分钟后自动回滚: {unapplied[0]}")
+
+            output = phase("commit", lambda: cli.run("commit", on_data=log))
+            check(output, "commit complete", "提交失败")
+        except CliTimeoutError:
+            # 通道状态未知，由调用方关闭会话，exclusive模式下未提交的修改随会话一起丢弃
+            raise
+        except Exception:
+            if not confirmed:
+                # 放弃未提交的修改，避免退出时的确认提示
+                cli.run("rollback 0", on_data=log)
+            cli.run("exit", on_data=log)
+            raise
+        cli.run("exit", on_data=log)
+
+        if not config_commit_confirmed_minutes:
+            unapplied = phase("验证配置", lambda: verify_config_applied(cli, statements))
+            if unapplied:
+                raise Exception(f"{len(unapplied)}条配置未生效: {unapplied[0]}")
+        commit_status = 'ok'
+    finally:
+        # 整次提交的耗时为各阶段之和
+        spans.record('commit', sum(elapsed for _, elapsed in timings), device, f"{len(statements)}条配置",
+                     commit_status)
+        log("\n阶段耗时: " + ", ".join(f"{name} {elapsed:.2f}秒" for name, elapsed in timings) + "\n")
+    return {'timings': timings, 'base_commit_id': base_commit_id, 'commit_id': read_commit_id(cli)}
+
+
+def ingest_rib(cli, command, meta, on_progress=None):
+    """执行全表命令，不保留原始输出，路由行分块交给解析进程，返回RibTable"""
+    ingest = RibIngest(RibTable(meta), on_progress=on_progress)
+    try:
+        cli.run(command, timeout=rib_ingest_timeout, on_line=ingest.add_line, keep_output=False)
+        return ingest.finish()
+    finally:
+        ingest.close()
+
+
+def inspect_device(device_name, device_info, commands, out_dir, stamp, update_row=None):
+    """使用独立SSH会话巡检单台设备，结果写入该设备的文件；update_row(设备名, 状态, 进度, 耗时)报告进度"""
+    update_row = update_row or (lambda *args: None)
+    start_time = time.time()
+    safe_name = re.sub(r'[\\/:*?"<>|\s]', '_', str(device_name))
+    file_path = os.path.join(out_dir, f"{safe_name}_{stamp}.txt")
+    result = {'device': device_name, 'ip': device_info['ip'], 'status': "完成",
+              'done': 0, 'total': len(commands), 'elapsed': 0.0, 'file': file_path}
+    session = None
+    try:
+        update_row(device_name, "连接中", f"0/{len(commands)}")
+        session = connect_device(device_info, device_name=device_name)
+
+        def on_result(index, cmd, output):
+            result['done'] += 1
+            update_row(device_name, "巡检中", f"{result['done']}/{len(commands)}",
+                       f"{time.time() - start_time:.1f}")
+
+        outputs = run_inspection(session, commands, on_result=on_result)
+
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(f"设备: {device_name} ({device_info['ip']})\n巡检时间: {stamp}\n")
+            for cmd, output in zip(commands, outputs):
+                f.write(f"\n✅ 执行命令: {cmd}\n")
+                f.write(f"⚠ 执行失败: {str(output)}\n" if isinstance(output, Exception) else output)
+
+        failed = [cmd for cmd, output in zip(commands, outputs) if isinstance(output, Exception)]
+        if failed:
+            result['status'] = f"{len(failed)}条命令失败"
+    except paramiko.AuthenticationException:
+        result['status'] = "认证失败"
+    except Exception as e:
+        result['status'] = f"失败: {str(e)}"
+    finally:
+        if session:
+            session['client'].close()
+
+    result['elapsed'] = time.time() - start_time
+    update_row(device_name, result['status'], f"{result['done']}/{len(commands)}", f"{result['elapsed']:.1f}")
+    return result
+
+
+class JuniperDevice:
+    """脚本使用的设备接口，与图形界面走相同的连接、查询、解析和下发代码：
+
+        with JuniperDevice(load_device_file("device_route.xlsx")["R1"]) as device:
+            records = device.routes("8.8.8.0/24", line_ip="1.1.1.1", direction="receive")
+    """
+
+    def __init__(self, device_info, log=None, device_name=None):
+        self.device_info = device_info
+        self.log = log
+        self.device_name = device_name
+        self.session = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connect(self):
+        if self.session is None:
+            self.session = connect_device(self.device_info, self.log, self.device_name)
+        return self.session
+
+    def close(self):
+        if self.session is not None:
+            self.session['client'].close()
+            self.session = None
+
+    def run(self, command, **kwargs):
+        """在shell通道执行一条命令，返回输出"""
+        return self.connect()['cli'].run(command, **kwargs)
+
+    def routes(self, ip_range, line_ip=None, direction=None):
+        """查询路由并解析为RouteRecord列表"""
+        parser = RouteTextParser()
+        self.run(route_query_command(ip_range, line_ip, direction), on_line=parser.add_line)
+        return parser.finish()
+
+    def config(self, structured=False):
+        """下载并解析完整配置，返回ConfigModel"""
+        return download_config(self.connect()['cli'], structured, self.log)
+
+    def apply(self, commands):
+        """下发并提交set/delete命令，返回各阶段耗时和提交标识"""
+        return apply_config(self.connect()['cli'], commands, self.log)
+
+    def inspect(self, commands, timings=None):
+        """show命令在多个exec通道上并发执行，返回与commands顺序一致的输出"""
+        return run_inspection(self.connect(), commands, timings=timings)
+
+
+def build_arg_parser():
+    arg_parser = argparse.ArgumentParser(description="Juniper多线路由管理工具，不带参数时启动图形界面")
+    arg_parser.add_argument('--schedule', action='store_true', help="无界面运行，按计划文件定时巡检")
+    arg_parser.add_argument('--run-once', metavar='命令组', help="立即对设备执行一个命令组的巡检后退出")
+    arg_parser.add_argument('--device', help="--run-once时只巡检这些设备(逗号分隔)")
+    arg_parser.add_argument('--history', metavar='设备名', help="显示设备的巡检历史")
+    arg_parser.add_argument('--devices', default="device_route.xlsx", help="设备信息文件")
+    arg_parser.add_argument('--commands', default="commands.txt", help="巡检命令文件，#[组名] 开始一个命令组")
+    arg_parser.add_argument('--schedule-file', default=inspection_schedule_file, help="定时巡检计划文件")
+    arg_parser.add_argument('--db', default=inspection_db, help="巡检历史库")
+    return arg_parser
+
+
+def is_headless(args):
+    return bool(args.schedule or args.run_once or args.history)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    cli_args = build_arg_parser().parse_args()
+    if is_headless(cli_args):
+        run_headless(cli_args)
+    else:
+        build_arg_parser().print_help()